@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Нагрузочный тест AI-консультанта против локальной заглушки OpenAI
+
+Проверяет, что задержка калькулятора не растет, пока N запросов
+к AI находятся в обработке.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_ai_load --requests 50 --delay 0.5
+    python -m benchmarks.bench_ai_load --blocking   # старое поведение для сравнения
+    python -m benchmarks.bench_ai_load --stream     # время до первого фрагмента ответа
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from openai import AsyncOpenAI, OpenAI
+
+from benchmarks.fake_openai import FakeOpenAIServer
+from bot.ai_assistant import AIAssistant
+from bot.calculator import FulfillmentCalculator
+from utils.formatters import format_calculation_result
+
+
+class _BlockingClient:
+    """Синхронный клиент OpenAI под асинхронным интерфейсом (как было раньше)"""
+
+    def __init__(self, client: OpenAI):
+        self.chat = self
+        self.completions = self
+        self._client = client
+
+    async def create(self, **kwargs):
+        return self._client.chat.completions.create(**kwargs)
+
+
+async def measure_calculator_latency(duration: float, interval: float = 0.01) -> list:
+    """Имитация нажатий в калькуляторе: расчет и форматирование результата"""
+    calculator = FulfillmentCalculator()
+    services = ['packaging', 'shipping', 'analytics']
+    latencies = []
+
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        await asyncio.sleep(0)  # Передаем управление циклу, как при диспетчеризации апдейта
+        result = calculator.calculate('ozon', 1500, services)
+        format_calculation_result(result, 'ozon', 1500, services)
+        latencies.append(time.perf_counter() - started)
+        await asyncio.sleep(interval)
+
+    return latencies
+
+
+async def _ask_streaming(assistant: AIAssistant, question: str, first_text: list) -> str:
+    """Потоковый запрос с замером времени до первого фрагмента"""
+    started = time.perf_counter()
+    answer = ""
+    async for fragment in assistant.stream_response(question):
+        if not answer:
+            first_text.append(time.perf_counter() - started)
+        answer += fragment
+    return answer
+
+
+def _report(title: str, latencies: list) -> None:
+    ordered = sorted(latencies)
+    p95 = ordered[int(len(ordered) * 0.95) - 1]
+    print(f"{title:<28} n={len(ordered):<5} "
+          f"p50={statistics.median(ordered) * 1000:8.3f} мс  "
+          f"p95={p95 * 1000:8.3f} мс  "
+          f"max={ordered[-1] * 1000:8.3f} мс")
+
+
+async def run(requests: int, delay: float, concurrency: int, blocking: bool, stream: bool) -> None:
+    server = FakeOpenAIServer(delay=delay)
+    server.start()
+
+    if blocking:
+        client = _BlockingClient(OpenAI(api_key="test", base_url=server.base_url))
+    else:
+        client = AsyncOpenAI(api_key="test", base_url=server.base_url)
+    assistant = AIAssistant(openai_client=client, max_concurrency=concurrency, request_timeout=delay * requests + 10)
+
+    try:
+        # Прогрев: ленивые импорты клиента и первое соединение не должны попадать в замеры
+        if stream:
+            await _ask_streaming(assistant, "прогрев", [])
+        else:
+            await assistant.get_response("прогрев")
+        server.requests_count = 0
+
+        _report("Калькулятор без нагрузки", await measure_calculator_latency(1.0))
+
+        started = time.perf_counter()
+        first_text = []
+        ai_tasks = [
+            asyncio.create_task(
+                _ask_streaming(assistant, f"Вопрос {i}: сколько стоит упаковка?", first_text) if stream
+                else assistant.get_response(f"Вопрос {i}: сколько стоит упаковка?")
+            )
+            for i in range(requests)
+        ]
+        probe = asyncio.create_task(measure_calculator_latency(delay * 2))
+        await asyncio.gather(*ai_tasks)
+        ai_elapsed = time.perf_counter() - started
+
+        _report(f"Калькулятор + {requests} AI", await probe)
+        print(f"AI-запросов: {requests}, обработано сервером: {server.requests_count}, "
+              f"лимит параллелизма: {concurrency}, общее время: {ai_elapsed:.2f} сек")
+        if stream:
+            _report("AI: до первого фрагмента", first_text)
+    finally:
+        if not blocking:
+            await client.close()
+        server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=50, help="Число одновременных AI-запросов")
+    parser.add_argument("--delay", type=float, default=0.5, help="Время ответа заглушки OpenAI, сек")
+    parser.add_argument("--concurrency", type=int, default=8, help="Лимит параллельных запросов к OpenAI")
+    parser.add_argument("--blocking", action="store_true", help="Синхронный клиент OpenAI для сравнения")
+    parser.add_argument("--stream", action="store_true", help="Потоковые ответы с замером времени до первого фрагмента")
+    args = parser.parse_args()
+
+    asyncio.run(run(args.requests, args.delay, args.concurrency, args.blocking, args.stream and not args.blocking))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Сравнение пакетного и поштучного расчета стоимости
+
+Строит сетку маркетплейсы x объемы заказов x наборы услуг (по умолчанию
+около миллиона расчетов), считает ее через calculate_batch и через
+calculate() в цикле и проверяет точное совпадение результатов.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_batch_quotes --quotes 1000000
+    python -m benchmarks.bench_batch_quotes --discount-mode marginal
+"""
+
+import argparse
+import time
+
+from bot.calculator import FulfillmentCalculator, mask_to_services, services_to_mask
+from bot.tariff_engine import DISCOUNT_MODES, compile_tariffs
+from config.tariffs import MARKETPLACE_TARIFFS, CALCULATION_PARAMS
+
+SERVICE_SETS = (
+    ['packaging', 'shipping'],
+    ['packaging', 'shipping', 'returns'],
+    ['packaging', 'shipping', 'labeling', 'quality_control'],
+    ['storage', 'packaging', 'shipping', 'returns', 'labeling', 'quality_control', 'photo', 'analytics'],
+)
+
+FIELDS = ('marketplace_commission', 'total_service_cost', 'total_cost', 'cost_per_order')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quotes", type=int, default=1000000, help="Примерное число расчетов в сетке")
+    parser.add_argument("--discount-mode", choices=DISCOUNT_MODES, help="Режим скидок вместо заданного в тарифах")
+    args = parser.parse_args()
+
+    tariffs = None
+    if args.discount_mode:
+        tariffs = compile_tariffs(params={**CALCULATION_PARAMS, 'discount_mode': args.discount_mode})
+    calculator = FulfillmentCalculator(tariffs)
+    marketplaces = list(MARKETPLACE_TARIFFS)
+    masks = [services_to_mask(services) for services in SERVICE_SETS]
+    orders = list(range(1, args.quotes // (len(marketplaces) * len(masks)) + 1))
+    quotes = len(marketplaces) * len(orders) * len(masks)
+
+    started = time.perf_counter()
+    batch = calculator.calculate_batch(marketplaces, orders, masks)
+    batch_time = time.perf_counter() - started
+
+    # Поштучный расчет: услуги в порядке битов маски, как в calculate_batch
+    services_by_mask = [mask_to_services(mask) for mask in masks]
+    started = time.perf_counter()
+    results = [
+        calculator.calculate(marketplace, orders_count, services)
+        for marketplace in marketplaces
+        for orders_count in orders
+        for services in services_by_mask
+    ]
+    scalar_time = time.perf_counter() - started
+
+    mismatches = 0
+    for field in FIELDS:
+        expected = batch[field].ravel().tolist()
+        mismatches += sum(result[field] != value for result, value in zip(results, expected))
+
+    print(f"Расчетов: {quotes:,} ({len(marketplaces)} маркетплейса x {len(orders):,} объемов x {len(masks)} набора услуг)")
+    print(f"Пакетный: {batch_time:.3f} сек ({quotes / batch_time:,.0f} расчетов/сек)")
+    print(f"Поштучный: {scalar_time:.3f} сек ({quotes / scalar_time:,.0f} расчетов/сек)")
+    print(f"Ускорение: x{scalar_time / batch_time:,.0f}")
+    print(f"Расхождений: {mismatches}")
+    raise SystemExit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Микробенчмарк инлайн-клавиатур
+
+Сравнивает построение клавиатур на каждый вызов (как было раньше)
+с готовыми клавиатурами из bot.keyboards: время и число выделений
+памяти на один callback. Сценарий повторяет проход калькулятора:
+маркетплейс, выбор двух услуг, результат, возврат в меню.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_keyboards --iterations 20000
+"""
+
+import argparse
+import time
+import tracemalloc
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from bot import keyboards
+from bot.calculator import services_to_mask
+
+
+def _rebuild(markup: InlineKeyboardMarkup) -> InlineKeyboardMarkup:
+    """Построение того же дерева кнопок заново"""
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(button.text, callback_data=button.callback_data) for button in row]
+        for row in markup.inline_keyboard
+    ])
+
+
+def rebuild_flow() -> list:
+    return [
+        _rebuild(keyboards.get_marketplace_keyboard()),
+        keyboards._build_services_keyboard(0),
+        keyboards._build_services_keyboard(services_to_mask(['packaging'])),
+        keyboards._build_services_keyboard(services_to_mask(['packaging', 'shipping'])),
+        _rebuild(keyboards.get_calculation_result_keyboard()),
+        _rebuild(keyboards.get_main_menu_keyboard()),
+    ]
+
+
+def cached_flow() -> list:
+    return [
+        keyboards.get_marketplace_keyboard(),
+        keyboards.get_services_keyboard(),
+        keyboards.get_services_keyboard(['packaging']),
+        keyboards.get_services_keyboard(['packaging', 'shipping']),
+        keyboards.get_calculation_result_keyboard(),
+        keyboards.get_main_menu_keyboard(),
+    ]
+
+
+def measure(flow, iterations: int) -> tuple:
+    """(мкс, блоков памяти, байт) на один callback"""
+    callbacks = len(flow())
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        flow()
+    elapsed = time.perf_counter() - started
+
+    # Результаты удерживаются, чтобы посчитать выделенные под них блоки
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    kept = [flow() for _ in range(100)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    diff = [stat for stat in after.compare_to(before, 'filename') if stat.size_diff > 0]
+    blocks = sum(stat.count_diff for stat in diff)
+    size = sum(stat.size_diff for stat in diff)
+    del kept
+
+    scale = 100 * callbacks
+    return elapsed / (iterations * callbacks) * 1e6, blocks / scale, size / scale
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000, help="Число проходов сценария")
+    args = parser.parse_args()
+
+    # Прогрев кэша вариантов клавиатуры услуг
+    cached_flow()
+
+    for name, flow in (("построение на каждый вызов", rebuild_flow), ("готовые клавиатуры", cached_flow)):
+        per_callback, blocks, size = measure(flow, args.iterations)
+        print(f"{name:>28}: {per_callback:8.2f} мкс/callback, {blocks:6.1f} блоков, {size:8.0f} байт на callback")
+
+    print(f"Вариантов клавиатуры услуг в кэше: {len(keyboards._services_keyboards)}")
+
+
+if __name__ == '__main__':
+    main()
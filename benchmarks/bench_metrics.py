@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Накладные расходы метрик и проверка эндпоинта /metrics
+
+1. Обертка обработчика: время вызова пустого обработчика с оберткой
+   и без, и прирост памяти за серию вызовов (на горячем пути не должно
+   оставаться выделенных объектов).
+2. Сценарии stress_update_order (калькулятор и заявка) с метриками
+   и без: процессорное время на одно обновление.
+3. Запрос GET /metrics к локальному серверу метрик: формат строк и
+   наличие гистограмм обработчиков, Bot API и диалогов по состояниям.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_metrics --users 300
+"""
+
+import argparse
+import asyncio
+import logging
+import re
+import time
+import tracemalloc
+
+import httpx
+from telegram import Update
+
+from benchmarks.fake_bot_api import FakeBotRequest
+from benchmarks.stress_update_order import interleaved_updates, make_processor
+from bot.instrumentation import MetricsServer, instrument_callback
+from bot.rate_limiter import PriorityRateLimiter
+from run_bot import build_application
+
+# Строка образца в текстовом формате Prometheus
+SAMPLE_RE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\]|\\.)*"'
+                       r'(,[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\]|\\.)*")*\})? -?[0-9.e+-]+$|^.* \+Inf$')
+
+
+async def noop(update, context):
+    return None
+
+
+async def call_cost(calls: int) -> tuple:
+    """(нс на вызов без обертки, с оберткой, прирост памяти в байтах за серию вызовов)"""
+    wrapped = instrument_callback(noop, "bench_noop")
+    timings = []
+    for callback in (noop, wrapped):
+        started = time.perf_counter()
+        for _ in range(calls):
+            await callback(None, None)
+        timings.append((time.perf_counter() - started) / calls * 1e9)
+
+    for _ in range(1000):
+        await wrapped(None, None)
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for _ in range(calls):
+        await wrapped(None, None)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    growth = sum(stat.size_diff for stat in after.compare_to(before, 'filename')
+                 if stat.traceback[0].filename.endswith("instrumentation.py"))
+    return timings[0], timings[1], growth
+
+
+async def process(updates: list, workers: int, latency: float, instrument: bool):
+    """(приложение, процессорное время)"""
+    application = build_application("123456:metrics", request=FakeBotRequest(latency=latency),
+                                    update_processor=make_processor("chat", workers),
+                                    rate_limiter=PriorityRateLimiter(overall_rate=0, chat_rate=0, group_rate=0),
+                                    instrument=instrument)
+    await application.initialize()
+    await application.start()
+    cpu_started = time.process_time()
+    for data in updates:
+        await application.update_queue.put(Update.de_json(data, application.bot))
+    await application.update_queue.join()
+    cpu = time.process_time() - cpu_started
+    await application.stop()
+    return application, cpu
+
+
+async def scrape(application) -> str:
+    server = MetricsServer()
+    await server.start("127.0.0.1", 0)
+    try:
+        async with httpx.AsyncClient() as client:
+            response = await client.get(f"http://127.0.0.1:{server.port}/metrics")
+    finally:
+        await server.stop()
+        await application.shutdown()
+    response.raise_for_status()
+    return response.text
+
+
+async def run(users: int, workers: int, latency: float, calls: int, repeats: int, seed: int) -> bool:
+    plain_ns, wrapped_ns, growth = await call_cost(calls)
+    print(f"Пустой обработчик: {plain_ns:.0f} нс, с метриками {wrapped_ns:.0f} нс "
+          f"(+{wrapped_ns - plain_ns:.0f} нс), прирост памяти за {calls} вызовов: {growth} байт")
+
+    updates = interleaved_updates(users, seed)
+    plain_cpu, instrumented_cpu = [], []
+    for _ in range(repeats):
+        application, cpu = await process(updates, workers, latency, instrument=False)
+        await application.shutdown()
+        plain_cpu.append(cpu)
+        application, cpu = await process(updates, workers, latency, instrument=True)
+        instrumented_cpu.append(cpu)
+        if len(instrumented_cpu) < repeats:
+            await application.shutdown()
+    plain = min(plain_cpu) / len(updates) * 1e6
+    instrumented = min(instrumented_cpu) / len(updates) * 1e6
+    print(f"Обновлений: {len(updates)}, процессор без метрик {plain:.1f} мкс, с метриками {instrumented:.1f} мкс "
+          f"({instrumented - plain:+.1f} мкс на обновление)")
+
+    text = await scrape(application)
+    lines = [line for line in text.splitlines() if line and not line.startswith("#")]
+    malformed = [line for line in lines if not SAMPLE_RE.match(line)]
+    required = ('bot_handler_seconds_count{handler="start"}', 'bot_telegram_api_seconds_count{method="sendMessage"}',
+                'bot_conversations_active{conversation="calculator",state="ORDERS_COUNT"}', 'bot_cache_hit_ratio')
+    missing = [name for name in required if not any(line.startswith(name) for line in lines)]
+    print(f"/metrics: {len(text)} байт, {len(lines)} строк, некорректных {len(malformed)}, "
+          f"нет обязательных метрик: {len(missing)}")
+    for line in lines:
+        if line.startswith(("bot_handler_seconds_count", "bot_conversations_active", "bot_cache_hit_ratio")):
+            print(f"  {line}")
+    for line in malformed[:5] + missing:
+        print(f"  ! {line}")
+    return not malformed and not missing and growth <= 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=300, help="Число имитированных пользователей")
+    parser.add_argument("--workers", type=int, default=16, help="Число одновременно обрабатываемых обновлений")
+    parser.add_argument("--latency", type=float, default=0.001, help="Задержка Bot API, сек")
+    parser.add_argument("--calls", type=int, default=200000, help="Вызовов пустого обработчика")
+    parser.add_argument("--repeats", type=int, default=3, help="Повторов каждого прогона, берется лучший")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.ERROR)
+    ok = asyncio.run(run(args.users, args.workers, args.latency, args.calls, args.repeats, args.seed))
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
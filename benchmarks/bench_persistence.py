@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Накладные расходы SQLitePersistence на обработку обновлений
+
+Прогоняет сценарии stress_update_order (калькулятор и заявка) без
+хранения состояния и с SQLitePersistence, сравнивает время на одно
+обновление и процессорное время вместе с потоком записи. Затем
+создает приложение заново на той же базе и проверяет, что диалоги
+и сессии пользователей восстановились (сессии подгружаются так же,
+как при первом обновлении пользователя).
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_persistence --users 500 --interval 1.0
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+from telegram import Update
+from telegram.ext import CallbackContext
+
+from benchmarks.fake_bot_api import FakeBotRequest
+from benchmarks.stress_update_order import (
+    USER_ID_BASE, check_results, interleaved_updates, make_processor, unlimited_rate_limiter
+)
+from bot.persistence import SQLitePersistence
+from bot.session import UserSession
+from run_bot import build_application
+
+
+async def process(updates: list, workers: int, latency: float, persistence: SQLitePersistence = None) -> tuple:
+    """(приложение, время обработки, процессорное время, длительности update_persistence)"""
+    application = build_application("123456:bench", request=FakeBotRequest(latency=latency, jitter=0.0),
+                                    update_processor=make_processor("chat", workers), persistence=persistence,
+                                    rate_limiter=unlimited_rate_limiter())
+    collecting = []
+    if persistence is not None:
+        update_persistence = application.update_persistence
+
+        async def timed_update_persistence():
+            started = time.perf_counter()
+            await update_persistence()
+            collecting.append(time.perf_counter() - started)
+
+        application.update_persistence = timed_update_persistence
+
+    await application.initialize()
+    await application.start()
+    started, cpu_started = time.perf_counter(), time.process_time()
+    for data in updates:
+        await application.update_queue.put(Update.de_json(data, application.bot))
+    await application.update_queue.join()
+    elapsed, cpu = time.perf_counter() - started, time.process_time() - cpu_started
+    await application.stop()
+    await application.shutdown()
+    return application, elapsed, cpu, collecting
+
+
+async def restore(db_path: str, workers: int, users: int):
+    """Новое приложение на той же базе: диалоги загружаются при initialize(), сессии - по обращению"""
+    application = build_application("123456:bench", request=FakeBotRequest(latency=0.0, jitter=0.0),
+                                    update_processor=make_processor("chat", workers),
+                                    persistence=SQLitePersistence(db_path, session_type=UserSession),
+                                    rate_limiter=unlimited_rate_limiter())
+    await application.initialize()
+    for i in range(users):
+        await CallbackContext(application, user_id=USER_ID_BASE + i).refresh_data()
+    await application.shutdown()
+    return application
+
+
+async def run(users: int, workers: int, latency: float, interval: float, repeats: int, seed: int) -> bool:
+    updates = interleaved_updates(users, seed)
+    plain_times, persistent_times = [], []
+    plain_cpu, persistent_cpu = [], []
+    collecting, writes = [], 0
+
+    with tempfile.TemporaryDirectory() as directory:
+        for attempt in range(repeats):
+            _, elapsed, cpu, _ = await process(updates, workers, latency)
+            plain_times.append(elapsed)
+            plain_cpu.append(cpu)
+
+            db_path = os.path.join(directory, f"state_{attempt}.sqlite3")
+            persistence = SQLitePersistence(db_path, update_interval=interval, session_type=UserSession)
+            _, elapsed, cpu, collecting = await process(updates, workers, latency, persistence)
+            persistent_times.append(elapsed)
+            persistent_cpu.append(cpu)
+            writes = persistence.writes
+
+        db_size = os.path.getsize(db_path)
+        restored = await restore(db_path, workers, users)
+
+    # Время по часам сильно шумит из-за задержек Bot API; процессорное время (включая поток записи) стабильнее
+    plain = min(plain_times) / len(updates)
+    persistent = min(persistent_times) / len(updates)
+    overhead = (min(persistent_cpu) - min(plain_cpu)) / len(updates)
+    errors = check_results(restored, users)
+
+    print(f"Пользователей: {users}, обновлений: {len(updates)}, задержка Bot API: {latency} сек, "
+          f"интервал записи: {interval} сек")
+    print(f"Без хранения: {plain * 1e6:.1f} мкс/обновление, процессор {min(plain_cpu) / len(updates) * 1e6:.1f} мкс")
+    print(f"С SQLite:     {persistent * 1e6:.1f} мкс/обновление, "
+          f"процессор {min(persistent_cpu) / len(updates) * 1e6:.1f} мкс")
+    print(f"Накладные расходы: {overhead * 1e6:+.1f} мкс процессорного времени на обновление")
+    if collecting:
+        print(f"Сбор изменений: {len(collecting)} раз, в среднем {sum(collecting) / len(collecting) * 1000:.2f} мс")
+    print(f"Транзакций записи: {writes}, размер базы: {db_size / 1024:.0f} КБ")
+    if errors:
+        print(f"После перезапуска ошибок: {len(errors)}")
+        for line in errors[:10]:
+            print(f"  {line}")
+    else:
+        print("После перезапуска все диалоги и сессии восстановлены")
+    return not errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=300, help="Число имитированных пользователей")
+    parser.add_argument("--workers", type=int, default=16, help="Число одновременно обрабатываемых обновлений")
+    # С нулевой задержкой обработчики не уступают цикл событий и запись не запускается до конца прогона
+    parser.add_argument("--latency", type=float, default=0.001, help="Задержка Bot API, сек")
+    parser.add_argument("--interval", type=float, default=1.0, help="Интервал записи на диск, сек")
+    parser.add_argument("--repeats", type=int, default=5, help="Повторов каждого прогона, берется лучший")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.ERROR)
+    ok = asyncio.run(run(args.users, args.workers, args.latency, args.interval, args.repeats, args.seed))
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Кеш готовых расчетов: доля попаданий и время на расчет
+
+Генерирует поток запросов калькулятора с типичным перекосом: большинство
+пользователей выбирают популярные объемы и наборы услуг, остальные -
+произвольные. Сравнивает расчет с форматированием на каждый запрос
+и выдачу через QuoteCache.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_quote_cache --quotes 50000 --popular 0.8
+"""
+
+import argparse
+import random
+import time
+
+from bot.calculator import FulfillmentCalculator
+from bot.quote_cache import QuoteCache
+from utils.formatters import format_calculation_result
+
+MARKETPLACES = ('wildberries', 'ozon', 'yandex')
+POPULAR_VOLUMES = (100, 300, 500, 1000, 1500, 2000, 3000, 5000, 10000)
+POPULAR_SERVICES = (
+    ['packaging', 'shipping'],
+    ['packaging', 'shipping', 'returns'],
+    ['packaging', 'shipping', 'labeling'],
+    ['packaging'],
+)
+ALL_SERVICES = ('packaging', 'shipping', 'returns', 'labeling', 'quality_control', 'photo', 'analytics')
+
+
+def quote_stream(count: int, popular: float, seed: int) -> list:
+    rng = random.Random(seed)
+    stream = []
+    for _ in range(count):
+        marketplace = rng.choices(MARKETPLACES, weights=(5, 4, 1))[0]
+        if rng.random() < popular:
+            orders_count = rng.choice(POPULAR_VOLUMES)
+            services = list(rng.choice(POPULAR_SERVICES))
+        else:
+            orders_count = rng.randint(1, 20000)
+            services = rng.sample(ALL_SERVICES, rng.randint(1, 4))
+        stream.append((marketplace, orders_count, services))
+    return stream
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quotes", type=int, default=50000, help="Число запросов расчета")
+    parser.add_argument("--popular", type=float, default=0.8, help="Доля запросов с популярными параметрами")
+    parser.add_argument("--size", type=int, default=1000, help="Размер кеша")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    stream = quote_stream(args.quotes, args.popular, args.seed)
+
+    calculator = FulfillmentCalculator()
+    started = time.perf_counter()
+    for marketplace, orders_count, services in stream:
+        result = calculator.calculate(marketplace, orders_count, services)
+        format_calculation_result(result, marketplace, orders_count, services)
+    uncached = time.perf_counter() - started
+
+    cache = QuoteCache(args.size)
+    started = time.perf_counter()
+    for marketplace, orders_count, services in stream:
+        cache.get_quote(marketplace, orders_count, services)
+    cached = time.perf_counter() - started
+
+    stats = cache.stats()
+    print(f"Запросов: {len(stream):,}, популярных: {args.popular:.0%}, размер кеша: {args.size}")
+    print(f"Без кеша: {uncached / len(stream) * 1e6:.1f} мкс/расчет")
+    print(f"С кешем:  {cached / len(stream) * 1e6:.1f} мкс/расчет")
+    print(f"Попаданий: {stats['hits']:,}, промахов: {stats['misses']:,}, доля попаданий: {stats['hit_ratio']:.1%}")
+
+
+if __name__ == '__main__':
+    main()
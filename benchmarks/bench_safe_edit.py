@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Число запросов к Bot API на одно нажатие кнопки меню
+
+Пользователи отправляют /start (приходит фото с подписью и меню), затем
+нажимают кнопки на последнем сообщении бота, в том числе дважды подряд
+одну и ту же. Поддельный Bot API отклоняет правки, как Telegram: текст
+у фото, правку без изменений. Сравнивается прежний safe_edit_message
+(edit_message_text, при любой ошибке - новое сообщение) и текущий.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_safe_edit --users 200
+"""
+
+import argparse
+import asyncio
+import logging
+import tempfile
+import time
+
+from telegram import Update
+
+import bot.handlers as handlers
+from benchmarks.fake_bot_api import FakeBotRequest
+from benchmarks.stress_update_order import unlimited_rate_limiter
+from bot.media import media_registry
+from bot.message_tracker import sent_messages
+from run_bot import build_application
+
+USER_ID_BASE = 600000
+
+# Нажатия после /start; повтор main_menu ничего не меняет на экране
+TAPS = ("company_info", "main_menu", "main_menu", "services", "main_menu", "advantages", "main_menu", "calculator")
+
+
+async def legacy_safe_edit_message(update: Update, text: str, reply_markup=None, parse_mode='HTML') -> None:
+    """Прежняя реализация: правка текста, при любой ошибке - новое сообщение"""
+    query = update.callback_query
+    try:
+        await query.edit_message_text(text=text, reply_markup=reply_markup, parse_mode=parse_mode)
+    except Exception:
+        await query.message.reply_text(text=text, reply_markup=reply_markup, parse_mode=parse_mode)
+
+
+def start_update(update_id: int, user_id: int) -> dict:
+    user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+    chat = {"id": user_id, "type": "private", "first_name": user["first_name"]}
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": int(time.time()), "chat": chat, "from": user, "text": "/start",
+            "entities": [{"type": "bot_command", "offset": 0, "length": 6}]
+        }
+    }
+
+
+def tap_update(update_id: int, user_id: int, data: str, message: dict) -> dict:
+    user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+    return {
+        "update_id": update_id,
+        "callback_query": {"id": str(update_id), "from": user, "chat_instance": str(user_id),
+                           "data": data, "message": message}
+    }
+
+
+async def run(users: int, implementation: str) -> dict:
+    request = FakeBotRequest(track_messages=True)
+    application = build_application("123456:edits", request=request, rate_limiter=unlimited_rate_limiter())
+    original = handlers.safe_edit_message
+    if implementation == "legacy":
+        handlers.safe_edit_message = legacy_safe_edit_message
+    sent_messages.clear()
+    sent_messages.skipped = 0
+    # Поддельные file_id не должны попасть в настоящий реестр медиа бота
+    original_store = media_registry.store_path
+    directory = tempfile.TemporaryDirectory()
+    media_registry.use_store(f"{directory.name}/media_registry.json")
+
+    await application.initialize()
+    update_id = tap_calls = new_messages = 0
+    try:
+        for i in range(users):
+            user_id = USER_ID_BASE + i
+            update_id += 1
+            await application.process_update(Update.de_json(start_update(update_id, user_id), application.bot))
+            for data in TAPS:
+                update_id += 1
+                message = request.last_message(user_id)
+                calls_before = len(request.calls)
+                await application.process_update(
+                    Update.de_json(tap_update(update_id, user_id, data, message), application.bot)
+                )
+                # answerCallbackQuery одинаков в обоих вариантах и не считается
+                methods = [method for method, _, _ in request.calls[calls_before:] if method != "answerCallbackQuery"]
+                tap_calls += len(methods)
+                new_messages += sum(method.startswith("send") for method in methods)
+    finally:
+        handlers.safe_edit_message = original
+        media_registry.use_store(original_store)
+        directory.cleanup()
+        await application.shutdown()
+
+    taps = users * len(TAPS)
+    return {
+        'taps': taps,
+        'calls_per_tap': tap_calls / taps,
+        'failed_edits': request.edit_errors,
+        'new_messages': new_messages,
+        'skipped': sent_messages.skipped,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200, help="Число пользователей")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.ERROR)
+    for implementation in ("legacy", "current"):
+        stats = asyncio.run(run(args.users, implementation))
+        print(f"{implementation:8s}: нажатий {stats['taps']:,}, запросов на нажатие {stats['calls_per_tap']:.2f}, "
+              f"отклоненных правок {stats['failed_edits']:,}, новых сообщений {stats['new_messages']:,}, "
+              f"пропущено правок {stats['skipped']:,}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Память сессий пользователей и выгрузка простаивающих сессий
+
+1. Память: --sessions пользователей с заполненным расчетом и заявкой
+   в виде прежних словарей user_data и в виде UserSession (tracemalloc),
+   а также оценка memory_report, которую показывает команда /memory.
+2. Выгрузка: сценарии stress_update_order (калькулятор и заявка)
+   с SQLitePersistence, затем SessionSweeper выгружает все сессии
+   из памяти. Половина пользователей сразу обращается снова, пока
+   данные еще в очереди записи, вторая - после записи в базу; в обоих
+   случаях сессия должна восстановиться полностью. Печатается время
+   подгрузки одной сессии.
+3. Брошенные диалоги: --abandoned пользователей бросают калькулятор на
+   вводе количества заказов или заявку на вводе контакта, столько же
+   активных начинают те же диалоги после таймаута. SessionSweeper должен
+   сбросить только брошенные диалоги, удалить опустевшие сессии и
+   отправить каждому брошенному чату ровно одно сообщение через полосу
+   BULK; следующий текст "1500" не должен попасть в ORDERS_COUNT.
+   Печатаются время сброса и освобожденная память.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_sessions --sessions 100000 --users 300 --abandoned 2000
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+
+from telegram import Update
+from telegram.ext import CallbackContext
+
+from benchmarks.fake_bot_api import FakeBotRequest
+from benchmarks.stress_update_order import (
+    USER_ID_BASE, check_results, interleaved_updates, make_processor, make_update, unlimited_rate_limiter
+)
+from bot.persistence import SQLitePersistence
+from bot.rate_limiter import BULK, PriorityRateLimiter
+from bot.session import SessionSweeper, UserSession, memory_report
+from run_bot import build_application
+
+
+def legacy_user_data(user_id: int) -> dict:
+    """user_data в том виде, в каком его заполняли обработчики раньше"""
+    return {
+        'marketplace': 'ozon',
+        'orders_count': 1500 + user_id % 1000,
+        'selected_services': ['packaging', 'shipping'],
+        'last_quote': ['ozon', 1500 + user_id % 1000, ['packaging', 'shipping']],
+        'application_name': f"Пользователь {user_id}",
+        'application_contact': f"+7 900 {user_id}",
+        'application_description': f"Нужен фулфилмент для {user_id}",
+    }
+
+
+def measure(factory, count: int) -> float:
+    """Байт на объект по tracemalloc"""
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    objects = [factory(USER_ID_BASE + i) for i in range(count)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    # Сам список объектов не относится к сессиям
+    size -= objects.__sizeof__()
+    return size / count
+
+
+def make_session(user_id: int) -> UserSession:
+    session = UserSession()
+    session.restore(legacy_user_data(user_id))
+    return session
+
+
+class LaneRecorder(PriorityRateLimiter):
+    """Ограничитель без лимитов, запоминающий полосу каждой отправки сообщения"""
+
+    def __init__(self):
+        super().__init__(overall_rate=0, chat_rate=0, group_rate=0)
+        self.lanes = Counter()
+
+    async def process_request(self, callback, args, kwargs, endpoint: str, data: dict, rate_limit_args):
+        if endpoint == 'sendMessage':
+            self.lanes[(data.get('chat_id'), rate_limit_args)] += 1
+        return await super().process_request(callback, args, kwargs, endpoint, data, rate_limit_args)
+
+
+async def process(updates: list, persistence: SQLitePersistence, workers: int, latency: float,
+                  rate_limiter=None, application=None):
+    if application is None:
+        application = build_application("123456:sessions", request=FakeBotRequest(latency=latency),
+                                        update_processor=make_processor("chat", workers), persistence=persistence,
+                                        rate_limiter=rate_limiter or unlimited_rate_limiter())
+        await application.initialize()
+        await application.start()
+    for data in updates:
+        await application.update_queue.put(Update.de_json(data, application.bot))
+    await application.update_queue.join()
+    return application
+
+
+def flow_updates(user_ids, steps: list, first_update_id: int) -> list:
+    updates = []
+    for user_id in user_ids:
+        for kind, data in steps:
+            updates.append(make_update(first_update_id + len(updates), user_id, kind, data))
+    return updates
+
+
+# Калькулятор брошен на вводе количества заказов, заявка - на вводе контакта
+CALCULATOR_STEPS = [("callback", "calculator"), ("callback", "marketplace_ozon")]
+APPLICATION_STEPS = [("callback", "application"), ("text", "Брошенная заявка")]
+
+
+async def expiry(users: int, workers: int, latency: float, batch_size: int) -> bool:
+    timeout = 60.0
+    abandoned = [USER_ID_BASE + i for i in range(users)]
+    active = [USER_ID_BASE + users + i for i in range(users)]
+    calculator = set(abandoned[::2]) | set(active[::2])
+
+    def steps_for(user_ids):
+        return (flow_updates([u for u in user_ids if u in calculator], CALCULATOR_STEPS, 1)
+                + flow_updates([u for u in user_ids if u not in calculator], APPLICATION_STEPS, 1))
+
+    limiter = LaneRecorder()
+    application = await process(steps_for(abandoned), None, workers, latency, rate_limiter=limiter)
+    memory_before = memory_report(application.user_data.values())
+    # Вместо ожидания таймаута брошенные сессии "стареют" на две минуты
+    for user_id in abandoned:
+        application.user_data[user_id].last_seen -= timeout * 2
+    await process(steps_for(active), None, workers, latency, application=application)
+    request = application.bot.request
+    conversations = {handler.name: handler for handlers in application.handlers.values() for handler in handlers
+                     if getattr(handler, 'name', None) in ('calculator', 'application')}
+    in_flows = sum(len(handler._conversations) for handler in conversations.values())
+
+    sweeper = SessionSweeper(ttl=0, interval=3600, timeouts={'calculator': timeout, 'application': timeout},
+                             batch_size=batch_size, notify=True)
+    await sweeper.start(application)
+    limiter.lanes.clear()
+    calls_before = len(request.calls)
+    started = time.perf_counter()
+    await sweeper.sweep()
+    elapsed = time.perf_counter() - started
+    waited = time.monotonic()
+    while sweeper.notified < users and time.monotonic() - waited < 30:
+        await asyncio.sleep(0.01)
+    notices = len(request.calls) - calls_before
+    # Повторный проход не сбрасывает ничего и не шлет повторных сообщений
+    await sweeper.sweep()
+    await asyncio.sleep(0.05)
+    repeated = len(request.calls) - calls_before - notices
+
+    errors = []
+    left = {user_id for handler in conversations.values() for _, user_id in handler._conversations}
+    if left != set(active):
+        errors.append(f"после сброса в диалогах {len(left)} пользователей, ожидалось {len(active)} активных")
+    if any(user_id in application.user_data for user_id in abandoned):
+        errors.append("сессии брошенных диалогов остались в памяти")
+    if limiter.lanes != Counter({(user_id, BULK): 1 for user_id in abandoned}):
+        wrong = sorted(key for key, count in limiter.lanes.items() if key[0] not in abandoned or count != 1)
+        errors.append(f"сообщения об истечении: {sum(limiter.lanes.values())}, лишние или повторные: {wrong[:5]}")
+    if repeated:
+        errors.append(f"повторный проход отправил {repeated} сообщений")
+
+    # Текст после истечения не попадает в ORDERS_COUNT, у активных - попадает
+    calls_before = len(request.calls)
+    probe = [u for u in abandoned if u in calculator][:50] + [u for u in active if u in calculator][:50]
+    await process(flow_updates(probe, [("text", "1500")], 10 ** 6), None, workers, latency, application=application)
+    answered = {int(params.get("chat_id")) for _, params, _ in request.calls[calls_before:]}
+    if answered != set(probe[50:]):
+        errors.append(f"на \"1500\" ответили {len(answered & set(probe[:50]))} брошенным и "
+                      f"{len(answered & set(probe[50:]))} из 50 активных")
+
+    await sweeper.stop()
+    await application.stop()
+    await application.shutdown()
+
+    print(f"Брошенных диалогов: {users}, активных: {users} (в диалогах было {in_flows}), "
+          f"сброшено: {sweeper.expired} за {elapsed * 1000:.1f} мс пачками по {batch_size}")
+    print(f"Освобождено: ~{sweeper.reclaimed_bytes / 1024:.0f} КБ "
+          f"(~{sweeper.reclaimed_bytes / max(sweeper.expired, 1):.0f} байт на диалог, сессия занимала "
+          f"~{memory_before['compact_per_session']:.0f}), сообщений об истечении: {notices}")
+    for line in errors[:10]:
+        print(f"  ! {line}")
+    print("Сброшены только брошенные диалоги, по одному сообщению в чат" if not errors else f"Ошибок: {len(errors)}")
+    return not errors and sweeper.expired == users and notices == users
+
+
+async def eviction(users: int, workers: int, latency: float, seed: int) -> bool:
+    with tempfile.TemporaryDirectory() as directory:
+        persistence = SQLitePersistence(os.path.join(directory, "state.sqlite3"), update_interval=60,
+                                        session_type=UserSession)
+        application = await process(interleaved_updates(users, seed), persistence, workers, latency)
+        in_memory = len(application.user_data)
+
+        sweeper = SessionSweeper(ttl=0.001, interval=3600)
+        await sweeper.start(application)
+        await asyncio.sleep(0.01)
+        await sweeper.sweep()
+        await sweeper.stop()
+        after_sweep = len(application.user_data)
+
+        # Первая половина возвращается, пока данные в очереди записи, вторая - после записи
+        load_times = []
+        for i in range(users):
+            if i == users // 2:
+                while persistence.pending:
+                    await asyncio.sleep(0.001)
+            started = time.perf_counter()
+            await CallbackContext(application, user_id=USER_ID_BASE + i).refresh_data()
+            load_times.append(time.perf_counter() - started)
+        errors = check_results(application, users)
+
+        await application.stop()
+        await application.shutdown()
+
+    load_times.sort()
+    print(f"Пользователей: {users}, сессий в памяти: {in_memory}, после выгрузки: {after_sweep}, "
+          f"выгружено: {sweeper.evicted}")
+    print(f"Подгрузка сессии: p50 {statistics.median(load_times) * 1e6:.0f} мкс, "
+          f"p95 {load_times[int(len(load_times) * 0.95) - 1] * 1e6:.0f} мкс")
+    for line in errors[:10]:
+        print(f"  ! {line}")
+    print("После выгрузки и подгрузки все сессии совпадают" if not errors else f"Ошибок: {len(errors)}")
+    return not errors and after_sweep == 0
+
+
+async def run(sessions: int, users: int, abandoned: int, batch_size: int, workers: int, latency: float,
+              seed: int) -> bool:
+    legacy = measure(legacy_user_data, sessions)
+    compact = measure(make_session, sessions)
+    print(f"Сессий: {sessions:,}. Байт на сессию: словарь user_data {legacy:.0f}, UserSession {compact:.0f} "
+          f"({(1 - compact / legacy) * 100:.0f}% меньше)")
+    report = memory_report(make_session(USER_ID_BASE + i) for i in range(1000))
+    print(f"Оценка /memory: {report['dict_per_session']:.0f} -> {report['compact_per_session']:.0f} байт")
+    evicted = await eviction(users, workers, latency, seed)
+    return await expiry(abandoned, workers, latency, batch_size) and evicted
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=100000, help="Сессий для замера памяти")
+    parser.add_argument("--users", type=int, default=300, help="Пользователей в проверке выгрузки")
+    parser.add_argument("--abandoned", type=int, default=2000, help="Брошенных диалогов в проверке сброса")
+    parser.add_argument("--batch", type=int, default=500, help="Диалогов в одной пачке сброса")
+    parser.add_argument("--workers", type=int, default=16, help="Число одновременно обрабатываемых обновлений")
+    parser.add_argument("--latency", type=float, default=0.001, help="Задержка Bot API, сек")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.ERROR)
+    ok = asyncio.run(run(args.sessions, args.users, args.abandoned, args.batch, args.workers, args.latency, args.seed))
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Лимиты частоты запросов пользователей
+
+1. Стоимость проверки: UserThrottle.check для --users разных
+   пользователей (разрешенные запросы) и для одного пользователя сверх
+   лимита (отказы), ThrottleHandler.check_update на готовых обновлениях,
+   а также память состояний всех пользователей во всех классах
+   (tracemalloc).
+2. Злоупотребление через весь граф обработчиков: --normal пользователей
+   проходят калькулятор и заявку, параллельно --spammers пользователей
+   жмут кнопку услуги по --clicks раз и задают по --questions вопросов
+   AI-консультанту (заглушке). Обычные пользователи должны закончить
+   сценарии без отказов, вопросов от каждого нарушителя до AI доходит
+   не больше лимита, сообщение об ограничении - одно на класс и окно,
+   а на каждое нажатие кнопки, в том числе отклоненное, бот отвечает.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_user_throttle --users 100000 --normal 200 --spammers 10
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+import time
+import tracemalloc
+from collections import Counter
+
+from telegram import Update
+
+import bot.ai_assistant as ai_assistant_module
+from benchmarks.fake_bot_api import FakeBotRequest
+from benchmarks.replay_handlers import AI_QUESTIONS, StubAssistant
+from benchmarks.stress_update_order import (
+    USER_ID_BASE, check_results, make_processor, make_update, unlimited_rate_limiter, user_script
+)
+from bot.throttle import AI, CALCULATOR, DEFAULT, ThrottleHandler, UserThrottle, user_throttle
+from config.settings import USER_RATE_LIMITS
+from run_bot import build_application
+
+SPAMMER_ID_BASE = 900000
+
+
+def per_call(function, calls: int) -> float:
+    """Микросекунд на вызов"""
+    started = time.perf_counter()
+    function()
+    return (time.perf_counter() - started) / calls * 1e6
+
+
+def overhead(users: int) -> None:
+    user_ids = [USER_ID_BASE + i for i in range(users)]
+    throttle = UserThrottle(USER_RATE_LIMITS)
+
+    def allowed():
+        for user_id in user_ids:
+            throttle.check(user_id, DEFAULT)
+
+    def rejected():
+        for _ in range(users):
+            throttle.check(USER_ID_BASE, CALCULATOR)
+
+    allowed_us = per_call(allowed, users)
+    rejected_us = per_call(rejected, users)
+
+    sample = min(users, 20000)
+    updates = [Update.de_json(make_update(i + 1, USER_ID_BASE + i, "callback", "service_packaging"), None)
+               for i in range(sample)]
+    handler = ThrottleHandler(UserThrottle(USER_RATE_LIMITS))
+
+    def check_updates():
+        for update in updates:
+            handler.check_update(update)
+
+    handler_us = per_call(check_updates, sample)
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    throttle = UserThrottle(USER_RATE_LIMITS)
+    now = time.monotonic()
+    for user_id in user_ids:
+        for action in (AI, CALCULATOR, DEFAULT):
+            throttle.check(user_id, action, now)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+
+    print(f"Проверка: разрешенный запрос {allowed_us:.2f} мкс, отказ {rejected_us:.2f} мкс, "
+          f"check_update с классификацией {handler_us:.2f} мкс")
+    print(f"Память: {users:,} пользователей во всех трех классах - {size / 2 ** 20:.1f} МБ "
+          f"({size / users:.0f} байт на пользователя)")
+
+
+def spammer_script(user_id: int, clicks: int, questions: int) -> list:
+    steps = [("callback", "calculator"), ("callback", "marketplace_ozon"), ("text", "1500")]
+    steps += [("callback", "service_packaging")] * clicks
+    steps += [("callback", "ai_chat")]
+    steps += [("text", f"{AI_QUESTIONS[1]} Вопрос {i}") for i in range(questions)]
+    return steps
+
+
+def interleave(scripts: dict, seed: int) -> list:
+    """Случайное перемешивание сценариев с сохранением порядка внутри пользователя"""
+    rng = random.Random(seed)
+    positions = dict.fromkeys(scripts, 0)
+    active = list(scripts)
+    updates = []
+    while active:
+        user_id = rng.choice(active)
+        kind, data = scripts[user_id][positions[user_id]]
+        positions[user_id] += 1
+        updates.append(make_update(len(updates) + 1, user_id, kind, data))
+        if positions[user_id] == len(scripts[user_id]):
+            active.remove(user_id)
+    return updates
+
+
+async def abuse(normal: int, spammers: int, clicks: int, questions: int, workers: int, latency: float,
+                seed: int) -> bool:
+    spammer_ids = [SPAMMER_ID_BASE + i for i in range(spammers)]
+    scripts = {USER_ID_BASE + i: user_script(USER_ID_BASE + i) for i in range(normal)}
+    scripts.update({user_id: spammer_script(user_id, clicks, questions) for user_id in spammer_ids})
+    updates = interleave(scripts, seed)
+
+    stub = StubAssistant()
+    ai_assistant_module._ai_assistant = stub
+    user_throttle.clear()
+    rejected_before = dict(user_throttle.rejected)
+    request = FakeBotRequest(latency=latency)
+    application = build_application("123456:throttle", request=request, update_processor=make_processor("chat", workers),
+                                    rate_limiter=unlimited_rate_limiter())
+    await application.initialize()
+    await application.start()
+    started = time.monotonic()
+    for data in updates:
+        await application.update_queue.put(Update.de_json(data, application.bot))
+    await application.update_queue.join()
+    elapsed = time.monotonic() - started
+    errors = check_results(application, normal)
+    await application.stop()
+    await application.shutdown()
+    ai_assistant_module._ai_assistant = None
+
+    warnings = Counter()
+    for method, params, _ in request.calls:
+        if "⏳" in str(params.get("text", "")):
+            chat_id = int(params.get("chat_id") or 0)
+            warnings[(chat_id, method)] += 1
+    # answerCallbackQuery не содержит chat_id: предупреждения по кнопкам считаются по всем нарушителям
+    callback_warnings = sum(1 for method, params, _ in request.calls
+                            if method == "answerCallbackQuery" and "⏳" in str(params.get("text", "")))
+    rejected = {action: user_throttle.rejected[action] - rejected_before.get(action, 0)
+                for action in user_throttle.rejected}
+
+    limit, window = USER_RATE_LIMITS['ai']
+    calculator_window = USER_RATE_LIMITS['calculator'][1]
+    max_ai_warnings = 1 + int(elapsed // window)
+    max_callback_warnings = spammers * (1 + int(elapsed // calculator_window))
+    if stub.requests > spammers * limit:
+        errors.append(f"до AI дошло {stub.requests} вопросов, лимит {spammers * limit}")
+    for user_id in spammer_ids:
+        if warnings[(user_id, "sendMessage")] > max_ai_warnings:
+            errors.append(f"нарушителю {user_id} отправлено {warnings[(user_id, 'sendMessage')]} предупреждений")
+    if callback_warnings > max_callback_warnings:
+        errors.append(f"предупреждений на кнопки: {callback_warnings}, ожидалось не больше {max_callback_warnings}")
+    answered = {str(params.get("callback_query_id")) for method, params, _ in request.calls
+                if method == "answerCallbackQuery"}
+    unanswered = [data["callback_query"]["id"] for data in updates
+                  if "callback_query" in data and data["callback_query"]["id"] not in answered]
+    if unanswered:
+        errors.append(f"нажатий без ответа: {len(unanswered)}")
+    if not callback_warnings or not any(warnings[(user_id, "sendMessage")] for user_id in spammer_ids):
+        errors.append("нарушители не получили предупреждений")
+
+    print(f"Обновлений: {len(updates):,} за {elapsed:.1f} сек, обычных пользователей: {normal}, "
+          f"нарушителей: {spammers} ({clicks} нажатий, {questions} вопросов)")
+    print(f"Отклонено: {', '.join(f'{action} {count}' for action, count in rejected.items())}; "
+          f"вопросов до AI: {stub.requests} (лимит {limit} за {window:.0f} сек на пользователя), "
+          f"предупреждений: {callback_warnings} на кнопки, "
+          f"{sum(warnings[(user_id, 'sendMessage')] for user_id in spammer_ids)} в чат")
+    for line in errors[:10]:
+        print(f"  ! {line}")
+    print("Обычные пользователи не ограничены, нарушители остановлены" if not errors else f"Ошибок: {len(errors)}")
+    return not errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100000, help="Пользователей в замере проверки и памяти")
+    parser.add_argument("--normal", type=int, default=200, help="Обычных пользователей")
+    parser.add_argument("--spammers", type=int, default=10, help="Нарушителей")
+    parser.add_argument("--clicks", type=int, default=100, help="Нажатий кнопки услуги от нарушителя")
+    parser.add_argument("--questions", type=int, default=20, help="Вопросов к AI от нарушителя")
+    parser.add_argument("--workers", type=int, default=16, help="Число одновременно обрабатываемых обновлений")
+    parser.add_argument("--latency", type=float, default=0.001, help="Задержка Bot API, сек")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.ERROR)
+    overhead(args.users)
+    ok = asyncio.run(abuse(args.normal, args.spammers, args.clicks, args.questions, args.workers, args.latency,
+                           args.seed))
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
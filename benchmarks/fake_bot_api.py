@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+"""
+Поддельный транспорт Bot API для нагрузочных тестов
+
+Подставляется в Application.builder().request(...): запросы бота не уходят
+в Telegram, а записываются и получают правдоподобные ответы с заданной
+задержкой. Так можно прогонять реальные обработчики без сети и токена.
+"""
+
+import asyncio
+import json
+import random
+import time
+from collections import defaultdict, deque
+
+from telegram.request import BaseRequest, RequestData
+
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "ReliableSolutionsBot", "username": "reliable_solutions_bot"}
+
+# Методы, которые в Telegram возвращают отправленное или измененное сообщение
+MESSAGE_METHODS = {"sendMessage", "editMessageText", "sendPhoto", "editMessageReplyMarkup", "editMessageCaption"}
+
+# Методы, на которые Telegram накладывает лимиты частоты
+FLOOD_LIMITED_PREFIXES = ('send', 'edit', 'copy', 'forward')
+
+
+class FakeBotRequest(BaseRequest):
+    """
+    Транспорт Bot API в памяти
+
+    calls - список (метод, параметры, время вызова) в порядке поступления.
+    latency и jitter задают задержку ответа в секундах: latency + U(0, jitter).
+
+    Если заданы overall_limit и/или chat_limit, отправки сверх этого числа
+    за последнюю секунду (всего и в один чат) получают 429 с retry_after,
+    как от Telegram при флуде; такие вызовы считаются в flood_errors.
+
+    С track_messages=True транспорт помнит вид и содержимое отправленных
+    сообщений и отклоняет правки так же, как Telegram: текст у фото,
+    подпись у текста, правку без изменений и правку неизвестного сообщения.
+    Отклоненные правки считаются в edit_errors.
+
+    Отправки в чаты из blocked_chats получают 403, как от пользователя,
+    заблокировавшего бота.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, seed: int = None,
+                 overall_limit: int = None, chat_limit: int = None, retry_after: int = 1,
+                 track_messages: bool = False, blocked_chats=()):
+        self.latency = latency
+        self.jitter = jitter
+        self.overall_limit = overall_limit
+        self.chat_limit = chat_limit
+        self.retry_after = retry_after
+        self.track_messages = track_messages
+        self.blocked_chats = {str(chat_id) for chat_id in blocked_chats}
+        self.calls = []
+        self.flood_errors = 0
+        self.edit_errors = 0
+        self._messages = {}  # (chat_id, message_id) -> (вид, содержимое, сообщение)
+        self._latest = {}  # chat_id -> message_id последнего отправленного сообщения
+        self._sent = deque()  # время отправок за последнюю секунду
+        self._sent_by_chat = defaultdict(deque)
+        self._random = random.Random(seed)
+        self._message_id = 0
+        self._file_id = 0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def calls_for_chat(self, chat_id: int) -> list:
+        """Вызовы, адресованные чату, в порядке поступления"""
+        return [(method, params) for method, params, _ in self.calls if str(params.get("chat_id")) == str(chat_id)]
+
+    async def do_request(self, url: str, method: str, request_data: RequestData = None,
+                         read_timeout=None, write_timeout=None, connect_timeout=None, pool_timeout=None) -> tuple:
+        api_method = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data is not None else {}
+        self.calls.append((api_method, params, time.monotonic()))
+
+        delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay:
+            await asyncio.sleep(delay)
+
+        if api_method.startswith(FLOOD_LIMITED_PREFIXES) and self._is_flood(params.get("chat_id")):
+            self.flood_errors += 1
+            return 429, json.dumps({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after}
+            }).encode()
+
+        if api_method.startswith(FLOOD_LIMITED_PREFIXES) and str(params.get("chat_id")) in self.blocked_chats:
+            return 403, json.dumps({
+                "ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"
+            }).encode()
+
+        if self.track_messages:
+            error = self._check_edit(api_method, params)
+            if error:
+                self.edit_errors += 1
+                return 400, json.dumps({"ok": False, "error_code": 400, "description": f"Bad Request: {error}"}).encode()
+
+        return 200, json.dumps({"ok": True, "result": self._result(api_method, params)}).encode()
+
+    def _check_edit(self, api_method: str, params: dict):
+        """Текст ошибки Telegram для недопустимой правки или None"""
+        if api_method not in ("editMessageText", "editMessageCaption"):
+            return None
+        stored = self._messages.get((str(params.get("chat_id")), params.get("message_id")))
+        if stored is None:
+            return "message to edit not found"
+        kind, content, _ = stored
+        if api_method == "editMessageText" and kind != "text":
+            return "there is no text in the message to edit"
+        if api_method == "editMessageCaption" and kind != "photo":
+            return "there is no caption in the message to edit"
+        if content == self._content(params):
+            return ("message is not modified: specified new message content and reply markup "
+                    "are exactly the same as a current content and reply markup of the message")
+        return None
+
+    @staticmethod
+    def _content(params: dict) -> str:
+        return json.dumps([params.get("text", params.get("caption")), params.get("reply_markup")], sort_keys=True)
+
+    def _is_flood(self, chat_id) -> bool:
+        now = time.monotonic()
+        windows = [(self._sent, self.overall_limit)]
+        if chat_id is not None:
+            windows.append((self._sent_by_chat[str(chat_id)], self.chat_limit))
+        for window, _ in windows:
+            while window and window[0] <= now - 1.0:
+                window.popleft()
+        if any(limit is not None and len(window) >= limit for window, limit in windows):
+            return True
+        for window, _ in windows:
+            window.append(now)
+        return False
+
+    def _result(self, api_method: str, params: dict):
+        if api_method == "getMe":
+            return BOT_USER
+        if api_method == "getUpdates":
+            return []
+        if api_method in MESSAGE_METHODS:
+            return self._message(api_method, params)
+        return True
+
+    def _message(self, api_method: str, params: dict) -> dict:
+        chat_id = int(params.get("chat_id") or 0)
+        message_id = params.get("message_id")
+        if message_id is None:
+            self._message_id += 1
+            message_id = self._message_id
+
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+        }
+        if api_method in ("sendPhoto", "editMessageCaption"):
+            self._file_id += 1
+            message["photo"] = [{
+                "file_id": f"fake-photo-{self._file_id}",
+                "file_unique_id": f"fake-unique-{self._file_id}",
+                "width": 512, "height": 512
+            }]
+            message["caption"] = params.get("caption", "")
+        else:
+            message["text"] = params.get("text", "")
+
+        if self.track_messages and api_method != "editMessageReplyMarkup":
+            kind = "photo" if "photo" in message else "text"
+            self._messages[(str(chat_id), message_id)] = (kind, self._content(params), message)
+            if api_method.startswith("send"):
+                self._latest[str(chat_id)] = message_id
+        return message
+
+    def last_message(self, chat_id: int) -> dict:
+        """Последнее отправленное в чат сообщение в текущем виде (только с track_messages)"""
+        message_id = self._latest.get(str(chat_id))
+        return self._messages[(str(chat_id), message_id)][2] if message_id is not None else None
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+"""
+Локальная заглушка OpenAI API для нагрузочных тестов
+
+Отвечает на POST /v1/chat/completions фиксированным ответом
+после заданной задержки, имитируя время генерации модели.
+При stream=true ответ отдается по словам в формате SSE
+(с include_usage последним фрагментом идет расход токенов).
+Сервер работает в отдельном потоке со своим циклом событий,
+чтобы не зависеть от цикла тестируемого кода.
+"""
+
+import asyncio
+import json
+import threading
+import time
+
+
+class FakeOpenAIServer:
+    """Минимальный HTTP/1.1 сервер с поддержкой keep-alive"""
+
+    def __init__(self, delay: float = 0.5, answer: str = "Тестовый ответ AI-консультанта.",
+                 token_delay: float = 0.02):
+        self.delay = delay
+        self.answer = answer
+        self.token_delay = token_delay
+        self.requests_count = 0
+        self.port = None
+        self._loop = None
+        self._thread = None
+        self._ready = threading.Event()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="fake-openai", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+    def stop(self) -> None:
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+
+    def _run(self) -> None:
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        server = self._loop.run_until_complete(
+            asyncio.start_server(self._handle_connection, "127.0.0.1", 0)
+        )
+        self.port = server.sockets[0].getsockname()[1]
+        self._ready.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            server.close()
+            pending = asyncio.all_tasks(self._loop)
+            for task in pending:
+                task.cancel()
+            self._loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            self._loop.close()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                self.requests_count += 1
+                await self._respond(writer, json.loads(body or b"{}"))
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer: asyncio.StreamWriter, payload: dict) -> None:
+        if payload.get("stream"):
+            await self._respond_stream(writer, payload)
+            return
+
+        await asyncio.sleep(self.delay)
+
+        body = json.dumps({
+            "id": f"chatcmpl-{self.requests_count}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model", "gpt-4o"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": self.answer},
+                "finish_reason": "stop"
+            }],
+            "usage": {"prompt_tokens": 100, "completion_tokens": 20, "total_tokens": 120}
+        }, ensure_ascii=False).encode("utf-8")
+
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: application/json\r\n"
+            b"Content-Length: " + str(len(body)).encode() + b"\r\n"
+            b"\r\n" + body
+        )
+        await writer.drain()
+
+    async def _respond_stream(self, writer: asyncio.StreamWriter, payload: dict) -> None:
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream\r\n"
+            b"Transfer-Encoding: chunked\r\n"
+            b"\r\n"
+        )
+        # Время до первого токена меньше полной генерации
+        await asyncio.sleep(self.token_delay)
+
+        words = self.answer.split(" ")
+        for index, word in enumerate(words):
+            delta = word if index == 0 else " " + word
+            self._write_event(writer, {
+                "id": f"chatcmpl-{self.requests_count}",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": payload.get("model", "gpt-4o"),
+                "choices": [{"index": 0, "delta": {"content": delta}, "finish_reason": None}]
+            })
+            await writer.drain()
+            await asyncio.sleep(max(self.delay - self.token_delay, 0) / len(words))
+
+        if (payload.get("stream_options") or {}).get("include_usage"):
+            self._write_event(writer, {
+                "id": f"chatcmpl-{self.requests_count}",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": payload.get("model", "gpt-4o"),
+                "choices": [],
+                "usage": {"prompt_tokens": 100, "completion_tokens": len(words), "total_tokens": 100 + len(words)}
+            })
+        self._write_chunk(writer, b"data: [DONE]\n\n")
+        self._write_chunk(writer, b"")
+        await writer.drain()
+
+    def _write_event(self, writer: asyncio.StreamWriter, event: dict) -> None:
+        data = json.dumps(event, ensure_ascii=False).encode("utf-8")
+        self._write_chunk(writer, b"data: " + data + b"\n\n")
+
+    @staticmethod
+    def _write_chunk(writer: asyncio.StreamWriter, data: bytes) -> None:
+        writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Воспроизведение синтетических обновлений через весь граф обработчиков
+
+Приложение собирается тем же build_application, что и в run_bot.py,
+со всеми ConversationHandler и обертками метрик. Каждый имитированный
+пользователь проходит меню (/start, о компании, услуги, преимущества),
+а дальше со своей вероятностью калькулятор, подачу заявки и AI-чат
+(вопросы по шаблону и к заглушке AI-помощника). Сценарии разных
+пользователей перемешаны, одновременно в работе --concurrent
+пользователей; обновления подаются в очередь порциями, чтобы не
+держать в памяти весь поток. Запросы к Bot API уходят в поддельный
+транспорт в памяти, заявки и реестр пользователей - во временные базы.
+
+Для каждого числа пользователей два прогона на свежем приложении:
+1. Пропускная способность (обновлений в секунду) и перцентили времени
+   обработки обновления (p50/p95/p99, без ожидания предыдущих
+   обновлений чата), в целом и по сценариям.
+2. Память на активного пользователя под tracemalloc: прирост после
+   всех сценариев (user_data, состояния диалогов, кеши) без памяти
+   самого теста и поддельного транспорта.
+
+--save-baseline сохраняет результаты в JSON, --baseline сравнивает
+с сохраненными и завершается с кодом 1, если скорость упала или
+задержки, память или число вызовов Bot API выросли больше чем на
+--tolerance. Базовую линию стоит снимать на той же машине, где идет
+сравнение. Прогон под tracemalloc в несколько раз медленнее: 100000
+пользователей занимают больше часа, --no-memory его отключает.
+
+Запуск из корня проекта:
+    python -m benchmarks.replay_handlers --users 1000,10000,100000 --save-baseline replay_baseline.json
+    python -m benchmarks.replay_handlers --users 1000,10000 --baseline replay_baseline.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import random
+import tempfile
+import time
+import tracemalloc
+from array import array
+from collections import Counter
+from datetime import datetime
+
+from telegram import Update
+
+import bot.ai_assistant as ai_assistant_module
+from benchmarks.fake_bot_api import FakeBotRequest
+from benchmarks.stress_update_order import make_update, unlimited_rate_limiter
+from bot.broadcast import user_registry
+from bot.leads import lead_dispatcher
+from bot.media import media_registry
+from bot.message_tracker import sent_messages
+from bot.update_processor import ChatOrderedUpdateProcessor
+from run_bot import build_application
+
+USER_ID_BASE = 700000
+WARMUP_USERS = 50
+FLOWS = ("menu", "calculator", "application", "ai")
+MARKETPLACES = ("wildberries", "ozon", "yandex")
+SERVICES = ("storage", "packaging", "shipping", "returns", "analytics")
+# Первый вопрос отвечается по шаблону, второй уходит в AI-помощник
+AI_QUESTIONS = ("Сколько стоит хранение на складе?", "Как вы работаете с возвратами брака и маркировкой?")
+
+
+class StubAssistant:
+    """AI-помощник без обращения к OpenAI: фиксированный ответ по словам"""
+
+    prompt_version = "stub"
+
+    def __init__(self, delay: float = 0.0, answer: str = "Тестовый ответ AI-консультанта о фулфилменте."):
+        self.delay = delay
+        self.words = answer.split(" ")
+        self.requests = 0
+
+    async def get_response(self, user_message: str, user_context: dict = None) -> str:
+        self.requests += 1
+        await asyncio.sleep(self.delay)
+        return " ".join(self.words)
+
+    async def stream_response(self, user_message: str, user_context: dict = None):
+        self.requests += 1
+        for word in self.words:
+            await asyncio.sleep(self.delay / len(self.words))
+            yield word + " "
+
+    async def close(self) -> None:
+        pass
+
+
+class TimedUpdateProcessor(ChatOrderedUpdateProcessor):
+    """Порядок внутри чата как в боте плюс время обработки каждого обновления"""
+
+    def __init__(self, workers: int):
+        super().__init__(workers)
+        self.update_ids = array('L')
+        self.durations = array('d')
+        self.done = 0
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        await super().do_process_update(update, self._timed(update, coroutine))
+
+    async def _timed(self, update: object, coroutine) -> None:
+        started = time.perf_counter()
+        try:
+            await coroutine
+        finally:
+            self.durations.append(time.perf_counter() - started)
+            self.update_ids.append(update.update_id)
+            self.done += 1
+
+
+def user_script(user_id: int, rng: random.Random) -> list:
+    """Шаги одного пользователя: (сценарий, тип, данные)"""
+    steps = [("menu", "command", "/start")]
+    steps += [("menu", "callback", data) for data in ("company_info", "services", "advantages", "main_menu")]
+    if rng.random() < 0.7:
+        steps += [("calculator", "callback", "calculator"),
+                  ("calculator", "callback", f"marketplace_{rng.choice(MARKETPLACES)}"),
+                  ("calculator", "text", str(rng.randrange(100, 20000, 100)))]
+        steps += [("calculator", "callback", f"service_{code}") for code in rng.sample(SERVICES, 2)]
+        steps.append(("calculator", "callback", "service_calculate"))
+    if rng.random() < 0.3:
+        steps += [("application", "callback", "application"),
+                  ("application", "text", f"Пользователь {user_id}"),
+                  ("application", "text", f"+7 900 {user_id}"),
+                  ("application", "text", f"Нужен фулфилмент для {user_id}")]
+    if rng.random() < 0.4:
+        steps += [("ai", "callback", "ai_chat"), ("ai", "callback", "ai_examples"),
+                  ("ai", "callback", "ai_ask_question"), ("ai", "text", AI_QUESTIONS[0]),
+                  ("ai", "callback", "ai_ask_question"), ("ai", "text", AI_QUESTIONS[1])]
+    return steps
+
+
+def make_step_update(update_id: int, user_id: int, kind: str, data: str) -> dict:
+    if kind != "command":
+        return make_update(update_id, user_id, kind, data)
+    update = make_update(update_id, user_id, "text", data)
+    update["message"]["entities"] = [{"type": "bot_command", "offset": 0, "length": len(data)}]
+    return update
+
+
+def replay_stream(users: int, concurrent: int, seed: int, first_user: int):
+    """
+    Обновления (номер сценария, данные) в случайном порядке между
+    пользователями и по порядку внутри пользователя
+
+    Одновременно в работе не больше concurrent пользователей, вместо
+    закончившего начинает следующий; выбор шага - O(1).
+    """
+    rng = random.Random(seed)
+    next_user = 0
+    active = []
+    update_id = 0
+    while active or next_user < users:
+        while len(active) < concurrent and next_user < users:
+            user_id = first_user + next_user
+            active.append((user_id, iter(user_script(user_id, rng))))
+            next_user += 1
+        index = rng.randrange(len(active))
+        user_id, steps = active[index]
+        step = next(steps, None)
+        if step is None:
+            active[index] = active[-1]
+            active.pop()
+            continue
+        flow, kind, data = step
+        update_id += 1
+        yield FLOWS.index(flow), make_step_update(update_id, user_id, kind, data)
+
+
+def percentile(ordered, fraction: float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+
+async def replay(users: int, workers: int, concurrent: int, window: int, latency: float, ai_delay: float,
+                 seed: int, measure_memory: bool) -> dict:
+    """Один прогон на свежем приложении"""
+    request = FakeBotRequest(latency=latency)
+    processor = TimedUpdateProcessor(workers)
+    application = build_application("123456:replay", request=request, update_processor=processor,
+                                    rate_limiter=unlimited_rate_limiter())
+    stub = StubAssistant(ai_delay)
+    ai_assistant_module._ai_assistant = stub
+    sent_messages.clear()
+    api_calls = Counter()
+
+    async def feed(stream, flows: bytearray) -> int:
+        count = 0
+        for flow, data in stream:
+            flows.append(flow)
+            await application.update_queue.put(Update.de_json(data, application.bot))
+            count += 1
+            # put() в неограниченную очередь не отдает управление, а разбор порции целиком задержал бы обработчики
+            await asyncio.sleep(0)
+            # Ждем, пока обработается половина порции, и сбрасываем журнал вызовов транспорта
+            if count % window == 0:
+                while processor.done < count - window // 2:
+                    await asyncio.sleep(0.001)
+                api_calls.update(method for method, _, _ in request.calls)
+                request.calls.clear()
+        while processor.done < count:
+            await asyncio.sleep(0.001)
+        await application.update_queue.join()
+        api_calls.update(method for method, _, _ in request.calls)
+        request.calls.clear()
+        return count
+
+    with tempfile.TemporaryDirectory() as directory:
+        lead_dispatcher.db_path = f"{directory}/leads.db"
+        lead_dispatcher.sinks = []
+        user_registry.db_path = f"{directory}/users.db"
+        user_registry.open()
+        # Поддельные file_id не должны попасть в настоящий реестр медиа бота
+        original_store = media_registry.store_path
+        media_registry.use_store(f"{directory}/media_registry.json")
+        await lead_dispatcher.start()
+        await application.initialize()
+        await application.start()
+        try:
+            # Разогрев: импорты, кеши расчетов и клавиатур не относятся к пользователям
+            await feed(replay_stream(WARMUP_USERS, WARMUP_USERS, seed + 1, USER_ID_BASE - WARMUP_USERS), bytearray())
+            await user_registry.flush()
+            await lead_dispatcher.dispatch()
+            processor.update_ids = array('L')
+            processor.durations = array('d')
+            processor.done = 0
+            api_calls.clear()
+
+            if measure_memory:
+                tracemalloc.start()
+                before = tracemalloc.take_snapshot()
+
+            flows = bytearray()
+            cpu_started = time.process_time()
+            started = time.perf_counter()
+            count = await feed(replay_stream(users, concurrent, seed, USER_ID_BASE), flows)
+            await user_registry.flush()
+            await lead_dispatcher.dispatch()
+            elapsed = time.perf_counter() - started
+            cpu = time.process_time() - cpu_started
+
+            memory = None
+            if measure_memory:
+                after = tracemalloc.take_snapshot()
+                tracemalloc.stop()
+                ignored = (tracemalloc.Filter(False, __file__), tracemalloc.Filter(False, tracemalloc.__file__),
+                           tracemalloc.Filter(False, "*/fake_bot_api.py"))
+                memory = sum(stat.size_diff for stat in
+                             after.filter_traces(ignored).compare_to(before.filter_traces(ignored), 'filename'))
+        finally:
+            await application.stop()
+            await application.shutdown()
+            await lead_dispatcher.stop()
+            await user_registry.close()
+            media_registry.use_store(original_store)
+            ai_assistant_module._ai_assistant = None
+
+    durations = sorted(processor.durations)
+    by_flow = {flow: [] for flow in FLOWS}
+    for update_id, duration in zip(processor.update_ids, processor.durations):
+        by_flow[FLOWS[flows[update_id - 1]]].append(duration)
+    return {
+        'updates': count,
+        'elapsed': elapsed,
+        'cpu': cpu,
+        'durations': durations,
+        'by_flow': {flow: sorted(values) for flow, values in by_flow.items()},
+        'api_calls': api_calls,
+        'ai_requests': stub.requests,
+        'memory': memory,
+    }
+
+
+def summarize(users: int, timing: dict, memory: dict) -> dict:
+    """Показатели для печати и базовой линии"""
+    durations = timing['durations']
+    return {
+        'users': users,
+        'updates': timing['updates'],
+        'updates_per_sec': round(timing['updates'] / timing['elapsed'], 1),
+        'cpu_us_per_update': round(timing['cpu'] / timing['updates'] * 1e6, 1),
+        'p50_ms': round(percentile(durations, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(durations, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(durations, 0.99) * 1000, 3),
+        'flows_p95_ms': {flow: round(percentile(values, 0.95) * 1000, 3)
+                         for flow, values in timing['by_flow'].items()},
+        'api_calls_per_update': round(sum(timing['api_calls'].values()) / timing['updates'], 3),
+        'bytes_per_user': round(memory['memory'] / users) if memory else None,
+    }
+
+
+def report(result: dict, timing: dict) -> None:
+    print(f"Пользователей: {result['users']:,}, обновлений: {result['updates']:,}, "
+          f"{result['updates_per_sec']:,.0f} обновлений/сек, процессор {result['cpu_us_per_update']:.0f} мкс на обновление")
+    print(f"  Обработка обновления: p50 {result['p50_ms']:.2f} мс, p95 {result['p95_ms']:.2f} мс, "
+          f"p99 {result['p99_ms']:.2f} мс")
+    print("  p95 по сценариям: " + ", ".join(
+        f"{flow} {value:.2f} мс ({len(timing['by_flow'][flow]):,})" for flow, value in result['flows_p95_ms'].items()))
+    print(f"  Вызовов Bot API на обновление: {result['api_calls_per_update']:.2f} "
+          f"({', '.join(f'{method} {count:,}' for method, count in timing['api_calls'].most_common(5))}), "
+          f"запросов к AI: {timing['ai_requests']:,}")
+    if result['bytes_per_user'] is not None:
+        print(f"  Память на активного пользователя: {result['bytes_per_user']:,} байт")
+
+
+def compare(results: list, baseline: dict, tolerance: float) -> list:
+    """Ухудшения относительно базовой линии"""
+    regressions = []
+    for result in results:
+        previous = baseline['results'].get(str(result['users']))
+        if previous is None:
+            continue
+        checks = [('updates_per_sec', -1)] + [
+            (key, 1) for key in ('p50_ms', 'p95_ms', 'p99_ms', 'bytes_per_user', 'api_calls_per_update')
+        ]
+        for key, direction in checks:
+            old, new = previous.get(key), result.get(key)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            print(f"  {result['users']:>7,} {key:<16} {old:>12,.2f} -> {new:>12,.2f} ({change * 100:+.1f}%)")
+            if change * direction > tolerance:
+                regressions.append(f"{result['users']} пользователей: {key} {old} -> {new}")
+    return regressions
+
+
+async def run(sizes: list, workers: int, concurrent: int, window: int, latency: float, ai_delay: float,
+              seed: int, memory: bool) -> list:
+    results = []
+    for users in sizes:
+        timing = await replay(users, workers, concurrent, window, latency, ai_delay, seed, measure_memory=False)
+        memory_run = None
+        if memory:
+            memory_run = await replay(users, workers, concurrent, window, latency, ai_delay, seed,
+                                      measure_memory=True)
+        result = summarize(users, timing, memory_run)
+        report(result, timing)
+        results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", default="1000,10000,100000", help="Числа имитированных пользователей через запятую")
+    parser.add_argument("--workers", type=int, default=32, help="Число одновременно обрабатываемых обновлений")
+    parser.add_argument("--concurrent", type=int, default=2000, help="Пользователей, одновременно проходящих сценарии")
+    parser.add_argument("--window", type=int, default=2000, help="Обновлений в очереди на обработку")
+    parser.add_argument("--latency", type=float, default=0.001, help="Задержка Bot API, сек")
+    parser.add_argument("--ai-delay", type=float, default=0.0, help="Время ответа заглушки AI-помощника, сек")
+    parser.add_argument("--no-memory", action="store_true", help="Без прогона под tracemalloc")
+    parser.add_argument("--baseline", help="JSON базовой линии для сравнения")
+    parser.add_argument("--save-baseline", help="Куда сохранить результаты как базовую линию")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Допустимое ухудшение, доля")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.ERROR)
+    sizes = [int(value) for value in args.users.split(",") if value.strip()]
+    results = asyncio.run(run(sizes, args.workers, args.concurrent, args.window, args.latency, args.ai_delay,
+                              args.seed, not args.no_memory))
+
+    ok = True
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)
+        print(f"Сравнение с {args.baseline} от {baseline.get('created')}:")
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions:
+            print(f"  ! {line}")
+        ok = not regressions
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as file:
+            json.dump({
+                'created': datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'settings': {'workers': args.workers, 'concurrent': args.concurrent, 'latency': args.latency,
+                             'ai_delay': args.ai_delay, 'seed': args.seed},
+                'results': {str(result['users']): result for result in results},
+            }, file, ensure_ascii=False, indent=2)
+        print(f"Базовая линия сохранена в {args.save_baseline}")
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
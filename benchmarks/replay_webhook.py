@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Воспроизведение записанных обновлений Telegram на эндпоинт вебхука
+
+Читает Update в формате JSON (по одному на строку) или генерирует
+синтетические /start и нажатия кнопок, отправляет их POST-запросами
+с секретным токеном и считает пропускную способность и задержки.
+
+Без --url поднимает локально сервер вебхука python-telegram-bot
+(Updater.start_webhook, как в BOT_MODE=webhook) с поддельным Bot API:
+только прием и постановка в очередь, без Telegram. Клиент держит
+заданное число постоянных HTTP-соединений, как Telegram при
+max_connections; поддерживается только http:// (TLS на прокси).
+
+Запуск из корня проекта:
+    python -m benchmarks.replay_webhook --updates 20000 --concurrency 40
+    python -m benchmarks.replay_webhook --file updates.jsonl --url http://127.0.0.1:8080/telegram --secret s3cr3t
+"""
+
+import argparse
+import asyncio
+import json
+import socket
+import statistics
+import time
+from urllib.parse import urlsplit
+
+from telegram.ext import Application
+
+from benchmarks.fake_bot_api import FakeBotRequest
+
+
+def synthetic_updates(count: int, users: int = 1000) -> list:
+    """Смесь команд /start и нажатий кнопок меню от разных пользователей"""
+    updates = []
+    for update_id in range(1, count + 1):
+        user_id = 100000 + update_id % users
+        user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+        chat = {"id": user_id, "type": "private", "first_name": user["first_name"]}
+        if update_id % 3 == 0:
+            updates.append({
+                "update_id": update_id,
+                "message": {
+                    "message_id": update_id, "date": int(time.time()), "chat": chat, "from": user,
+                    "text": "/start", "entities": [{"type": "bot_command", "offset": 0, "length": 6}]
+                }
+            })
+        else:
+            updates.append({
+                "update_id": update_id,
+                "callback_query": {
+                    "id": str(update_id), "from": user, "chat_instance": str(user_id),
+                    "data": "calculator" if update_id % 3 == 1 else "company_info",
+                    "message": {"message_id": update_id - 1, "date": int(time.time()), "chat": chat, "text": "menu"}
+                }
+            })
+    return updates
+
+
+def load_updates(path: str) -> list:
+    with open(path, encoding="utf-8") as source:
+        return [json.loads(line) for line in source if line.strip()]
+
+
+async def _post_loop(host: str, port: int, path: str, headers: bytes, bodies: list, cursor: list,
+                     latencies: list, statuses: dict) -> None:
+    """Один keep-alive канал, как у Telegram: запросы идут последовательно"""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while cursor[0] < len(bodies):
+            body = bodies[cursor[0]]
+            cursor[0] += 1
+            started = time.perf_counter()
+            writer.write(
+                f"POST {path} HTTP/1.1\r\nHost: {host}\r\nContent-Length: {len(body)}\r\n".encode()
+                + headers + b"\r\n" + body
+            )
+            await writer.drain()
+
+            head = await reader.readuntil(b"\r\n\r\n")
+            status = int(head.split(b" ", 2)[1])
+            length = 0
+            for line in head.split(b"\r\n"):
+                if line.lower().startswith(b"content-length:"):
+                    length = int(line.split(b":", 1)[1])
+            await reader.readexactly(length)
+
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+    finally:
+        writer.close()
+
+
+async def replay(url: str, secret: str, updates: list, concurrency: int) -> dict:
+    target = urlsplit(url)
+    bodies = [json.dumps(update).encode() for update in updates]
+    headers = b"Content-Type: application/json\r\n"
+    if secret:
+        headers += f"X-Telegram-Bot-Api-Secret-Token: {secret}\r\n".encode()
+
+    latencies = []
+    statuses = {}
+    cursor = [0]
+
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        _post_loop(target.hostname, target.port or 80, target.path or "/", headers, bodies, cursor, latencies, statuses)
+        for _ in range(concurrency)
+    ))
+    elapsed = time.perf_counter() - started
+
+    ordered = sorted(latencies)
+    print(f"Обновлений: {len(bodies)}, соединений: {concurrency}, время: {elapsed:.2f} сек")
+    print(f"Пропускная способность: {len(bodies) / elapsed:,.0f} обновлений/сек")
+    print(f"Задержка: p50={statistics.median(ordered) * 1000:.2f} мс, "
+          f"p95={ordered[int(len(ordered) * 0.95) - 1] * 1000:.2f} мс, "
+          f"p99={ordered[int(len(ordered) * 0.99) - 1] * 1000:.2f} мс")
+    print(f"Коды ответов: {statuses}")
+    return statuses
+
+
+def free_port() -> int:
+    """Свободный локальный порт: сервер вебхука PTB не сообщает порт, выбранный системой"""
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+async def run_local(updates: list, concurrency: int, secret: str) -> None:
+    """Локальный сервер вебхука PTB с приложением, которое только разбирает очередь"""
+    request = FakeBotRequest()
+    application = Application.builder().token("123456:replay").request(request).get_updates_request(request).build()
+    port = free_port()
+    await application.initialize()
+    await application.updater.start_webhook(
+        listen="127.0.0.1", port=port, url_path="telegram", secret_token=secret, max_connections=concurrency
+    )
+    received = 0
+
+    async def drain():
+        nonlocal received
+        while True:
+            await application.update_queue.get()
+            received += 1
+
+    drainer = asyncio.create_task(drain())
+    try:
+        statuses = await replay(f"http://127.0.0.1:{port}/telegram", secret, updates, concurrency)
+    finally:
+        drainer.cancel()
+        await application.updater.stop()
+        await application.shutdown()
+    print(f"Принято в очередь: {received}, отклонено: {sum(count for status, count in statuses.items() if status != 200)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Адрес вебхука; без него поднимается локальный сервер")
+    parser.add_argument("--secret", default="replay-secret", help="Секретный токен вебхука")
+    parser.add_argument("--file", help="Файл с записанными Update (JSON по строкам)")
+    parser.add_argument("--updates", type=int, default=10000, help="Число синтетических обновлений")
+    parser.add_argument("--concurrency", type=int, default=40, help="Параллельных соединений (как max_connections)")
+    args = parser.parse_args()
+
+    updates = load_updates(args.file) if args.file else synthetic_updates(args.updates)
+    if args.url:
+        asyncio.run(replay(args.url, args.secret, updates, args.concurrency))
+    else:
+        asyncio.run(run_local(updates, args.concurrency, args.secret))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Стресс-тест рассылки по реестру пользователей
+
+В реестре --users чатов, часть из них (--blocked) заблокировала бота.
+Поддельный Bot API отвечает 429 сверх --api-limit отправок в секунду
+и 403 для заблокированных чатов. Рассылка идет через ограничитель
+отправок и посреди работы останавливается (--crash-after секунд), как
+при падении бота, после чего новый экземпляр продолжает ее с
+контрольной точки.
+
+Проверяется, что каждый активный чат получил сообщение, повторов не
+больше одной страницы, а заблокированные чаты помечены неактивными.
+Печатаются скорость, оценка оставшегося времени по ходу работы и время
+рассылки на 50 000 чатов при лимите Telegram 30 сообщений в секунду.
+
+Запуск из корня проекта:
+    python -m benchmarks.stress_broadcast --users 3000 --rate 100
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import tempfile
+import time
+from collections import Counter
+
+from telegram.ext import ExtBot
+
+from benchmarks.fake_bot_api import FakeBotRequest
+from bot.broadcast import Broadcaster, UserRegistry, DONE
+from bot.rate_limiter import PriorityRateLimiter
+
+CHAT_ID_BASE = 1000000
+
+
+async def make_bot(request: FakeBotRequest, rate: float) -> ExtBot:
+    rate_limiter = PriorityRateLimiter(overall_rate=rate, overall_burst=1)
+    bot = ExtBot("123456:broadcast", request=request, get_updates_request=request, rate_limiter=rate_limiter)
+    await bot.initialize()
+    return bot
+
+
+async def watch(broadcaster: Broadcaster, broadcast_id: int, until: float = None) -> dict:
+    """Печать хода рассылки раз в секунду до ее окончания или до момента until"""
+    while True:
+        await asyncio.sleep(1.0)
+        progress = broadcaster.progress(broadcast_id)
+        if progress is None:
+            continue
+        done = progress['sent'] + progress['failed'] + progress['blocked']
+        eta = f"{progress['eta']:.0f} сек" if progress['eta'] is not None else "-"
+        print(f"  {done:>6}/{progress['total']}  {progress['rate']:6.1f} сообщ./сек  осталось ~{eta}")
+        if progress['status'] == DONE or (until is not None and time.monotonic() >= until):
+            return progress
+
+
+async def run(users: int, blocked_share: float, rate: float, api_limit: int, workers: int,
+              page_size: int, crash_after: float, seed: int) -> bool:
+    rng = random.Random(seed)
+    chats = [CHAT_ID_BASE + i for i in range(users)]
+    blocked = set(rng.sample(chats, int(users * blocked_share)))
+    request = FakeBotRequest(latency=0.02, jitter=0.03, seed=seed, overall_limit=api_limit, blocked_chats=blocked)
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "users.sqlite3")
+        registry = UserRegistry(db_path)
+        await asyncio.to_thread(registry.open)
+        for chat_id in chats:
+            registry.touch(chat_id)
+        await registry.flush()
+
+        started = time.monotonic()
+        bot = await make_bot(request, rate)
+        broadcaster = Broadcaster(registry, workers=workers, page_size=page_size, progress_interval=3600)
+        await broadcaster.start(bot)
+        broadcast_id = await broadcaster.create("Тарифы обновлены: <b>упаковка дешевле на 10%</b>")
+        print(f"Рассылка #{broadcast_id}: {users} чатов, заблокировали бота {len(blocked)}")
+        await watch(broadcaster, broadcast_id, until=time.monotonic() + crash_after)
+        await broadcaster.stop()
+        await bot.shutdown()
+        sent_before = len(request.calls)
+        print(f"Остановка после {sent_before} отправок, продолжаем с контрольной точки")
+
+        registry = UserRegistry(db_path)
+        bot = await make_bot(request, rate)
+        broadcaster = Broadcaster(registry, workers=workers, page_size=page_size, progress_interval=3600)
+        await broadcaster.start(bot)
+        progress = await watch(broadcaster, broadcast_id)
+        elapsed = time.monotonic() - started
+        active = await asyncio.to_thread(registry.count_active)
+        await broadcaster.stop()
+        await bot.shutdown()
+
+    delivered = Counter(
+        int(params["chat_id"]) for method, params, _ in request.calls
+        if method == "sendMessage" and str(params["chat_id"]) not in request.blocked_chats
+    )
+    attempts = Counter(int(params["chat_id"]) for method, params, _ in request.calls if method == "sendMessage")
+    missing = [chat_id for chat_id in chats if chat_id not in blocked and chat_id not in delivered]
+    duplicates = sum(count - 1 for count in delivered.values() if count > 1)
+    sends = sum(attempts.values())
+    throughput = sends / elapsed
+
+    print(f"Время: {elapsed:.1f} сек, запросов sendMessage {sends}, {throughput:.1f} в секунду, ответов 429: "
+          f"{request.flood_errors}")
+    print(f"Доставлено: {progress['sent']}, заблокировали: {progress['blocked']}, ошибок: {progress['failed']}")
+    print(f"Не получили сообщение: {len(missing)}, повторов после перезапуска: {duplicates} "
+          f"(не больше страницы {page_size}), активных в реестре: {active}")
+    print(f"50 000 чатов при 30 сообщ./сек: ~{50000 / min(throughput, 30) / 60:.0f} мин")
+
+    return (not missing and duplicates <= page_size and active == users - len(blocked)
+            and progress['failed'] == 0 and progress['status'] == DONE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=3000, help="Чатов в реестре")
+    parser.add_argument("--blocked", type=float, default=0.05, help="Доля чатов, заблокировавших бота")
+    parser.add_argument("--rate", type=float, default=100.0, help="Отправок в секунду по ограничителю")
+    parser.add_argument("--api-limit", type=int, default=100, help="Отправок в секунду до 429 от Bot API")
+    parser.add_argument("--workers", type=int, default=20, help="Воркеров рассылки")
+    parser.add_argument("--page-size", type=int, default=500, help="Чатов между контрольными точками")
+    parser.add_argument("--crash-after", type=float, default=8.0, help="Секунд до остановки посреди рассылки")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.ERROR)
+    ok = asyncio.run(run(args.users, args.blocked, args.rate, args.api_limit, args.workers,
+                         args.page_size, args.crash_after, args.seed))
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
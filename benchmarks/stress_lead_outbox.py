@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Стресс-тест доставки заявок
+
+Поднимает локальную заглушку CRM на aiohttp, которая
+отвечает ошибкой на часть запросов, а на часть - ошибкой уже после
+приема пачки (повторная доставка). Заявки идут в три приемника:
+заглушку CRM, чат администратора через поддельный Bot API и почтовую
+папку. На середине потока диспетчер "падает" без корректной остановки,
+новый диспетчер на том же журнале доставляет оставшееся. Часть заявок
+отправляется повторно с тем же ключом.
+
+В конце проверяется, что каждая заявка дошла до каждого приемника,
+и выводится число повторных доставок и время submit(). Отдельно
+проверяется почтовая папка: имя с переводом строки не ломает письмо,
+а заявка, которую записать нельзя, не задерживает остальные из пачки.
+
+Запуск из корня проекта:
+    python -m benchmarks.stress_lead_outbox --leads 1000 --fail-rate 0.3
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+from collections import Counter
+
+from aiohttp import web
+from telegram import Bot
+
+from benchmarks.fake_bot_api import FakeBotRequest
+from bot.leads import EmailSpoolSink, LeadDispatcher, TelegramChatSink, WebhookSink
+
+ADMIN_CHAT_ID = -1001
+
+
+class FakeCRM:
+    """Заглушка CRM: принимает пачки заявок и иногда отвечает ошибкой"""
+
+    def __init__(self, fail_rate: float, lost_rate: float, seed: int):
+        self.fail_rate = fail_rate
+        self.lost_rate = lost_rate
+        self.received = Counter()  # ключ -> сколько раз пришла заявка
+        self.requests = 0
+        self._random = random.Random(seed)
+
+    async def handle(self, request):
+        self.requests += 1
+        if self._random.random() < self.fail_rate:
+            return web.Response(status=503, text="try later")
+        leads = json.loads(await request.read())['leads']
+        self.received.update(lead['idempotency_key'] for lead in leads)
+        if self._random.random() < self.lost_rate:
+            # Пачка принята, но ответ "потерян" - диспетчер отправит ее повторно
+            return web.Response(status=500, text="lost response")
+        return web.json_response({"ok": True})
+
+
+def make_leads(count: int) -> list:
+    return [
+        {
+            'key': f"{700000 + i}:{i + 1}",
+            'created_at': time.time(),
+            'user_id': 700000 + i,
+            'username': None,
+            'name': f"Клиент {i}",
+            'contact': f"+7 900 {i:07d}",
+            'description': f"Нужен фулфилмент, заявка {i}",
+        }
+        for i in range(count)
+    ]
+
+
+async def wait_delivered(dispatcher: LeadDispatcher, total: int, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        stats = await asyncio.to_thread(dispatcher.stats)
+        if stats and all(sink['delivered'] == total for sink in stats.values()):
+            return True
+        await asyncio.sleep(0.05)
+    return False
+
+
+async def crash(dispatcher: LeadDispatcher) -> None:
+    """Остановка без записи оставшегося и последней доставки, как при падении процесса"""
+    dispatcher._task.cancel()
+    try:
+        await dispatcher._task
+    except asyncio.CancelledError:
+        pass
+    await asyncio.to_thread(dispatcher._outbox.close)
+
+
+class BrokenSpoolSink(EmailSpoolSink):
+    """Почтовая папка, в которую не записывается одна заявка"""
+
+    def __init__(self, directory: str, broken_key: str):
+        super().__init__(directory)
+        self.broken_key = broken_key
+
+    def _write(self, lead: dict) -> None:
+        if lead['key'] == self.broken_key:
+            raise ValueError("broken lead")
+        super()._write(lead)
+
+
+async def check_spool_isolation() -> list:
+    """Ошибка одной заявки в пачке проваливает только ее"""
+    leads = make_leads(3)
+    leads[0]['name'] = "Имя\r\nс переводом строки"
+    with tempfile.TemporaryDirectory() as directory:
+        spool = os.path.join(directory, "spool")
+        dispatcher = LeadDispatcher(os.path.join(directory, "leads.sqlite3"),
+                                    [BrokenSpoolSink(spool, leads[2]['key'])],
+                                    flush_interval=0.01, max_attempts=3, retry_base=0.0, retry_max=0.0)
+        await dispatcher.start()
+        for lead in leads:
+            dispatcher.submit(lead)
+        for _ in range(dispatcher.max_attempts):
+            await dispatcher.dispatch()
+        stats = (await dispatcher.refresh_stats())['email']
+        await dispatcher.stop()
+        spooled = sorted(name for name in os.listdir(spool) if name.endswith(".eml"))
+
+    expected = {'delivered': 2, 'pending': 0, 'failed': 1}
+    if stats != expected or len(spooled) != 2:
+        return [f"почтовая папка: {stats} и {len(spooled)} писем, ожидалось {expected} и 2 письма"]
+    return []
+
+
+async def run(count: int, fail_rate: float, lost_rate: float, batch_size: int, seed: int) -> bool:
+    crm = FakeCRM(fail_rate, lost_rate, seed)
+    app = web.Application()
+    app.router.add_post("/leads", crm.handle)
+    server = web.AppRunner(app, access_log=None)
+    await server.setup()
+    await web.TCPSite(server, "127.0.0.1", 0).start()
+    crm_url = f"http://127.0.0.1:{server.addresses[0][1]}/leads"
+
+    request = FakeBotRequest(latency=0.002)
+    bot = Bot("123456:leads", request=request, get_updates_request=request)
+    await bot.initialize()
+
+    leads = make_leads(count)
+    half = count // 2
+    submit_times = []
+
+    with tempfile.TemporaryDirectory() as directory:
+        spool = os.path.join(directory, "spool")
+
+        def make_dispatcher() -> LeadDispatcher:
+            sinks = [
+                WebhookSink(crm_url),
+                TelegramChatSink(bot, ADMIN_CHAT_ID),
+                EmailSpoolSink(spool),
+            ]
+            return LeadDispatcher(os.path.join(directory, "leads.sqlite3"), sinks, batch_size=batch_size,
+                                  flush_interval=0.05, max_attempts=50, retry_base=0.02, retry_max=0.5)
+
+        def submit(dispatcher: LeadDispatcher, batch: list) -> None:
+            for lead in batch:
+                started = time.perf_counter()
+                dispatcher.submit(dict(lead))
+                submit_times.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        first = make_dispatcher()
+        await first.start()
+        for i in range(0, half, 10):
+            submit(first, leads[i:min(i + 10, half)])
+            await asyncio.sleep(0)
+        # Ждем записи в журнал, но не доставки: дальше "падение"
+        while first.journaled < half:
+            await asyncio.sleep(0.001)
+        await crash(first)
+        await first.sinks[0].close()
+
+        second = make_dispatcher()
+        await second.start()
+        # Повтор первой половины с теми же ключами не должен создать новых заявок
+        submit(second, leads[:half // 4] + leads[half:])
+        delivered = await wait_delivered(second, count, timeout=60)
+        elapsed = time.perf_counter() - started
+        stats = await second.refresh_stats()
+        await second.stop()
+
+        spooled = len([name for name in os.listdir(spool) if name.endswith(".eml")])
+
+    await server.cleanup()
+    await bot.shutdown()
+
+    texts = [params['text'] for method, params, _ in request.calls if method == 'sendMessage']
+    telegram_names = Counter(
+        line.split("</b>")[0].split("<b>")[-1]
+        for text in texts for line in text.splitlines() if line.startswith("👤")
+    )
+
+    errors = await check_spool_isolation()
+    if not delivered:
+        errors.append(f"не все заявки доставлены: {stats}")
+    missing_crm = [lead['key'] for lead in leads if lead['key'] not in crm.received]
+    if missing_crm:
+        errors.append(f"CRM не получила {len(missing_crm)} заявок")
+    missing_telegram = [lead['name'] for lead in leads if lead['name'] not in telegram_names]
+    if missing_telegram:
+        errors.append(f"в чат администратора не дошло {len(missing_telegram)} заявок")
+    if spooled != count:
+        errors.append(f"в почтовой папке {spooled} писем вместо {count}")
+
+    submit_times.sort()
+    print(f"Заявок: {count}, отказов CRM: {fail_rate:.0%}, потерянных ответов: {lost_rate:.0%}, пачка: {batch_size}")
+    print(f"Доставка во все приемники с перезапуском: {elapsed:.2f} сек")
+    print(f"submit(): медиана {submit_times[len(submit_times) // 2] * 1e6:.1f} мкс, "
+          f"максимум {submit_times[-1] * 1e6:.1f} мкс")
+    print(f"CRM: запросов {crm.requests}, уникальных заявок {len(crm.received)}, "
+          f"повторных получений {sum(crm.received.values()) - len(crm.received)}")
+    print(f"Чат администратора: сообщений {len(texts)}, "
+          f"повторных заявок {sum(telegram_names.values()) - len(telegram_names)}")
+    print(f"Почтовая папка: {spooled} писем")
+    if errors:
+        for line in errors:
+            print(f"Ошибка: {line}")
+    else:
+        print("Все заявки доставлены во все приемники")
+    return not errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--leads", type=int, default=1000, help="Число заявок")
+    parser.add_argument("--fail-rate", type=float, default=0.3, help="Доля запросов, на которые CRM отвечает 503")
+    parser.add_argument("--lost-rate", type=float, default=0.1, help="Доля принятых пачек с потерянным ответом")
+    parser.add_argument("--batch-size", type=int, default=20, help="Заявок в одной доставке")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.CRITICAL)
+    ok = asyncio.run(run(args.leads, args.fail_rate, args.lost_rate, args.batch_size, args.seed))
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
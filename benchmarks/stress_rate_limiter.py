@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Стресс-тест ограничителя отправок
+
+Поддельный Bot API отвечает 429, как Telegram при флуде: больше
+--overall-limit отправок в секунду всего или --chat-limit в один чат.
+Одновременно идут массовая рассылка (полоса bulk) и всплеск нажатий
+/start во время промо: каждый пользователь получает фото и несколько
+правок сообщения подряд (полоса interactive).
+
+Без ограничителя часть отправок падает с RetryAfter. С ограничителем
+ошибок нет, а ответы пользователям не ждут окончания рассылки.
+
+Запуск из корня проекта:
+    python -m benchmarks.stress_rate_limiter --users 60 --broadcast 150
+    python -m benchmarks.stress_rate_limiter --mode none
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+import time
+
+from telegram.error import RetryAfter
+from telegram.ext import ExtBot
+
+from benchmarks.fake_bot_api import FakeBotRequest
+from bot.rate_limiter import BULK, INTERACTIVE, PriorityRateLimiter, lane_kwargs
+
+USER_ID_BASE = 800000
+BROADCAST_ID_BASE = 900000
+
+
+def percentile(values: list, share: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+
+async def timed(coroutine, latencies: list, failures: list) -> None:
+    started = time.perf_counter()
+    try:
+        await coroutine
+    except RetryAfter:
+        failures.append(1)
+        return
+    latencies.append(time.perf_counter() - started)
+
+
+async def user_taps(bot: ExtBot, chat_id: int, edits: int, delay: float, latencies: list, failures: list) -> None:
+    """Пользователь нажал /start и сразу несколько кнопок"""
+    await asyncio.sleep(delay)
+    await timed(bot.send_photo(chat_id, photo="fake-logo", caption="Добро пожаловать",
+                               **lane_kwargs(bot, INTERACTIVE)), latencies, failures)
+    for _ in range(edits):
+        await timed(bot.edit_message_text("Меню", chat_id=chat_id, message_id=1,
+                                          **lane_kwargs(bot, INTERACTIVE)), latencies, failures)
+
+
+async def run(mode: str, users: int, edits: int, broadcast: int, spread: float,
+              overall_limit: int, chat_limit: int, seed: int) -> bool:
+    request = FakeBotRequest(latency=0.02, jitter=0.03, seed=seed,
+                             overall_limit=overall_limit, chat_limit=chat_limit)
+    rate_limiter = PriorityRateLimiter() if mode == "limiter" else None
+    bot = ExtBot("123456:flood", request=request, get_updates_request=request, rate_limiter=rate_limiter)
+    await bot.initialize()
+
+    rng = random.Random(seed)
+    interactive, bulk, failures = [], [], []
+    started = time.perf_counter()
+    tasks = [
+        timed(bot.send_message(BROADCAST_ID_BASE + i, "Акция недели", **lane_kwargs(bot, BULK)), bulk, failures)
+        for i in range(broadcast)
+    ]
+    tasks += [
+        user_taps(bot, USER_ID_BASE + i, edits, rng.uniform(0, spread), interactive, failures)
+        for i in range(users)
+    ]
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    stats = rate_limiter.stats() if rate_limiter else None
+    await bot.shutdown()
+
+    total = broadcast + users * (edits + 1)
+    print(f"Режим: {mode}, отправок: {total} (рассылка {broadcast}, пользователей {users} x {edits + 1})")
+    print(f"Лимиты Bot API: {overall_limit}/сек всего, {chat_limit}/сек в чат")
+    print(f"Время: {elapsed:.1f} сек, ответов 429: {request.flood_errors}, неудачных отправок: {len(failures)}")
+    print(f"Ответы пользователям: p50 {percentile(interactive, 0.5):.2f} сек, p95 {percentile(interactive, 0.95):.2f} сек")
+    print(f"Рассылка: p50 {percentile(bulk, 0.5):.2f} сек, последняя {max(bulk, default=0):.2f} сек")
+    if stats:
+        print(f"Ограничитель: ждали {stats['throttled']}, максимум в очереди {stats['max_queue_depth']}, "
+              f"RetryAfter {stats['retry_after']}")
+    return not failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=("limiter", "none"), default="limiter")
+    parser.add_argument("--users", type=int, default=60, help="Пользователей во всплеске /start")
+    parser.add_argument("--edits", type=int, default=2, help="Правок сообщения на пользователя после фото")
+    parser.add_argument("--broadcast", type=int, default=150, help="Сообщений в рассылке")
+    parser.add_argument("--spread", type=float, default=2.0, help="За сколько секунд приходят пользователи")
+    parser.add_argument("--overall-limit", type=int, default=30, help="Отправок в секунду всего до 429")
+    parser.add_argument("--chat-limit", type=int, default=3, help="Отправок в секунду в один чат до 429")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.ERROR)
+    ok = asyncio.run(run(args.mode, args.users, args.edits, args.broadcast, args.spread,
+                         args.overall_limit, args.chat_limit, args.seed))
+    raise SystemExit(0 if ok or args.mode == "none" else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Стресс-тест перезагрузки тарифов на ходу
+
+Тарифы читаются из временного JSON-файла. Пока --clients задач
+непрерывно считают стоимость через кеш расчетов, файл переписывается
+каждые --period секунд: цены по очереди меняются между двумя версиями,
+а каждая пятая запись содержит ошибку и должна быть отклонена.
+
+Для каждого расчета проверяется, что ставки услуг и комиссия в тексте
+относятся к одной версии тарифов. Печатаются время от записи файла до
+подмены таблицы, время сборки новой версии и скорость расчетов.
+
+Запуск из корня проекта:
+    python -m benchmarks.stress_tariff_reload --duration 5
+"""
+
+import argparse
+import asyncio
+import copy
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+
+import config.tariffs as tariffs_module
+from bot.quote_cache import quote_cache
+from bot.tariff_engine import get_tariff_table, set_tariff_table, load_tariffs
+from bot.tariff_reload import TariffReloader
+
+SERVICE_SETS = (["packaging", "shipping"], ["storage", "packaging", "shipping", "returns"], ["analytics"])
+
+
+def make_config(version: int) -> dict:
+    """Конфигурация, где цены зависят от номера версии"""
+    services = copy.deepcopy(tariffs_module.SERVICE_TARIFFS)
+    marketplaces = copy.deepcopy(tariffs_module.MARKETPLACE_TARIFFS)
+    for code, tariff in services.items():
+        tariff['rate'] = tariffs_module.SERVICE_TARIFFS[code]['rate'] + version
+    for code, tariff in marketplaces.items():
+        tariff['commission_rate'] = round(tariffs_module.MARKETPLACE_TARIFFS[code]['commission_rate'] + version / 100, 2)
+    return {
+        'marketplaces': marketplaces,
+        'services': services,
+        'volume_discounts': {str(threshold): discount for threshold, discount in tariffs_module.VOLUME_DISCOUNTS.items()},
+        'params': tariffs_module.CALCULATION_PARAMS,
+    }
+
+
+def write_config(path: str, config: dict) -> None:
+    temporary = path + ".tmp"
+    with open(temporary, "w", encoding="utf-8") as file:
+        json.dump(config, file, ensure_ascii=False)
+    os.replace(temporary, path)
+
+
+def version_of(result: dict, text: str) -> set:
+    """Номера версий, которым соответствуют ставки расчета и комиссия в тексте"""
+    versions = {
+        service['rate'] - tariffs_module.SERVICE_TARIFFS[code]['rate']
+        for code, service in result['services'].items()
+    }
+    base = tariffs_module.MARKETPLACE_TARIFFS[result['marketplace']]['commission_rate']
+    commission = [version for version in (0, 1, 2) if f": {round(base + version / 100, 2) * 100}%" in text]
+    # Комиссия не нашлась в тексте - считаем расчет несогласованным
+    return versions | set(commission or [None])
+
+
+async def client(stop: asyncio.Event, rng: random.Random, stats: dict) -> None:
+    marketplaces = list(tariffs_module.MARKETPLACE_TARIFFS)
+    while not stop.is_set():
+        result, text = quote_cache.get_quote(rng.choice(marketplaces), rng.randrange(100, 20000, 100),
+                                             rng.choice(SERVICE_SETS))
+        if len(version_of(result, text)) != 1:
+            stats['mixed'] += 1
+        stats['quotes'] += 1
+        await asyncio.sleep(0)
+
+
+async def run(duration: float, period: float, interval: float, clients: int, seed: int) -> bool:
+    rng = random.Random(seed)
+    original = get_tariff_table()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "tariffs.json")
+        write_config(path, make_config(1))
+        set_tariff_table(load_tariffs(path))
+        quote_cache.clear()
+
+        reloader = TariffReloader(path, interval)
+        await reloader.start()
+        stop = asyncio.Event()
+        stats = {'quotes': 0, 'mixed': 0}
+        tasks = [asyncio.create_task(client(stop, random.Random(seed + i), stats)) for i in range(clients)]
+
+        swap_delays, rejected, writes, version = [], 0, 0, 1
+        started = time.monotonic()
+        while time.monotonic() - started < duration:
+            await asyncio.sleep(period * rng.uniform(0.8, 1.2))
+            writes += 1
+            before = get_tariff_table().version
+            if writes % 5 == 0:
+                broken = make_config(2)
+                broken['services']['packaging']['rate'] = -1
+                write_config(path, broken)
+                await asyncio.sleep(interval * 2)
+                if get_tariff_table().version == before:
+                    rejected += 1
+                continue
+            version = 3 - version
+            write_config(path, make_config(version))
+            written = time.monotonic()
+            while get_tariff_table().version == before and time.monotonic() - written < 5:
+                await asyncio.sleep(0.001)
+            swap_delays.append(time.monotonic() - written)
+
+        stop.set()
+        await asyncio.gather(*tasks)
+        await reloader.stop()
+        elapsed = time.monotonic() - started
+
+        compile_times = []
+        for _ in range(20):
+            compile_started = time.perf_counter()
+            load_tariffs(path)
+            compile_times.append(time.perf_counter() - compile_started)
+
+    set_tariff_table(original)
+    quote_cache.clear()
+
+    print(f"Записей файла: {writes}, применено версий: {reloader.reloads}, отклонено ошибочных: {rejected}")
+    print(f"От записи до подмены: в среднем {sum(swap_delays) / len(swap_delays) * 1000:.0f} мс, "
+          f"максимум {max(swap_delays) * 1000:.0f} мс (опрос раз в {interval} сек)")
+    print(f"Чтение и сборка версии: {min(compile_times) * 1000:.2f} мс")
+    print(f"Расчетов: {stats['quotes']:,} за {elapsed:.1f} сек ({stats['quotes'] / elapsed:,.0f}/сек), "
+          f"попаданий в кеш {quote_cache.hit_ratio * 100:.0f}%, со смешанными версиями: {stats['mixed']}")
+    expected_rejected = writes // 5
+    return stats['mixed'] == 0 and rejected == expected_rejected and reloader.reloads == len(swap_delays)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=5.0, help="Секунд работы")
+    parser.add_argument("--period", type=float, default=0.2, help="Секунд между записями файла")
+    parser.add_argument("--interval", type=float, default=0.02, help="Секунд между проверками файла")
+    parser.add_argument("--clients", type=int, default=20, help="Одновременных расчетов")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.CRITICAL)
+    ok = asyncio.run(run(args.duration, args.period, args.interval, args.clients, args.seed))
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Стресс-тест параллельной обработки обновлений
+
+Много имитированных пользователей одновременно проходят калькулятор
+(маркетплейс, количество заказов, две услуги, расчет) и подачу заявки
+(имя, контакт, описание). Обновления разных пользователей перемешаны,
+внутри пользователя идут по порядку. Запросы к Bot API уходят в
+поддельный транспорт со случайной задержкой, поэтому обработчики
+завершаются вразнобой.
+
+В конце проверяется, что каждый диалог калькулятора остался в состоянии
+CALCULATION_RESULT, диалог заявки завершен, а user_data содержит
+ровно введенные данные и параметры расчета.
+
+Запуск из корня проекта:
+    python -m benchmarks.stress_update_order --users 500 --workers 16
+    python -m benchmarks.stress_update_order --processor simple   # без порядка внутри чата - ожидаются ошибки
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+import time
+
+from telegram import Update
+from telegram.ext import ConversationHandler, SimpleUpdateProcessor
+
+from benchmarks.fake_bot_api import FakeBotRequest
+from bot.states import CALCULATION_RESULT
+from bot.rate_limiter import PriorityRateLimiter
+from bot.update_processor import ChatOrderedUpdateProcessor
+from run_bot import build_application
+
+USER_ID_BASE = 500000
+
+
+def user_script(user_id: int) -> list:
+    """Шаги одного пользователя: (тип, данные)"""
+    return [
+        ("callback", "calculator"),
+        ("callback", "marketplace_ozon"),
+        ("text", "1500"),
+        ("callback", "service_packaging"),
+        ("callback", "service_shipping"),
+        ("callback", "service_calculate"),
+        ("callback", "application"),
+        ("text", f"Пользователь {user_id}"),
+        ("text", f"+7 900 {user_id}"),
+        ("text", f"Нужен фулфилмент для {user_id}"),
+    ]
+
+
+def make_update(update_id: int, user_id: int, kind: str, data: str) -> dict:
+    user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+    chat = {"id": user_id, "type": "private", "first_name": user["first_name"]}
+    if kind == "text":
+        return {
+            "update_id": update_id,
+            "message": {"message_id": update_id, "date": int(time.time()), "chat": chat, "from": user, "text": data}
+        }
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id), "from": user, "chat_instance": str(user_id), "data": data,
+            "message": {"message_id": 1, "date": int(time.time()), "chat": chat, "text": "menu"}
+        }
+    }
+
+
+def interleaved_updates(users: int, seed: int) -> list:
+    """Случайное перемешивание сценариев с сохранением порядка внутри пользователя"""
+    rng = random.Random(seed)
+    pending = {USER_ID_BASE + i: list(user_script(USER_ID_BASE + i)) for i in range(users)}
+    active = list(pending)
+    updates = []
+    while active:
+        user_id = rng.choice(active)
+        kind, data = pending[user_id].pop(0)
+        updates.append(make_update(len(updates) + 1, user_id, kind, data))
+        if not pending[user_id]:
+            active.remove(user_id)
+    return updates
+
+
+def make_processor(name: str, workers: int):
+    if name == "chat":
+        return ChatOrderedUpdateProcessor(workers)
+    if name == "simple":
+        return SimpleUpdateProcessor(workers)
+    return SimpleUpdateProcessor(1)
+
+
+def unlimited_rate_limiter() -> PriorityRateLimiter:
+    """Имитированные пользователи нажимают быстрее лимитов Telegram, поддельный Bot API их не проверяет"""
+    return PriorityRateLimiter(overall_rate=0, chat_rate=0, group_rate=0)
+
+
+def check_results(application, users: int) -> list:
+    """Список расхождений с ожидаемым итогом"""
+    conversations = {
+        handler.name: handler
+        for handler in application.handlers[0]
+        if isinstance(handler, ConversationHandler)
+    }
+    # Публичного доступа к состояниям диалогов в PTB нет
+    calculator_states = conversations["calculator"]._conversations
+    application_states = conversations["application"]._conversations
+
+    errors = []
+    for i in range(users):
+        user_id = USER_ID_BASE + i
+        key = (user_id, user_id)
+        session = application.user_data.get(user_id)
+        user_data = session.to_state() if session is not None else {}
+        expected = {
+            'marketplace': 'ozon',
+            'orders_count': 1500,
+            'selected_services': ['packaging', 'shipping'],
+            'last_quote': ['ozon', 1500, ['packaging', 'shipping']],
+            'application_name': f"Пользователь {user_id}",
+            'application_contact': f"+7 900 {user_id}",
+            'application_description': f"Нужен фулфилмент для {user_id}",
+        }
+        if calculator_states.get(key) != CALCULATION_RESULT:
+            errors.append(f"{user_id}: калькулятор в состоянии {calculator_states.get(key)}")
+        if key in application_states:
+            errors.append(f"{user_id}: заявка не завершена, состояние {application_states[key]}")
+        for field, value in expected.items():
+            if user_data.get(field) != value:
+                errors.append(f"{user_id}: {field}={user_data.get(field)!r}, ожидалось {value!r}")
+    return errors
+
+
+async def run(users: int, workers: int, processor: str, latency: float, jitter: float, seed: int) -> bool:
+    request = FakeBotRequest(latency=latency, jitter=jitter, seed=seed)
+    application = build_application("123456:stress", request=request,
+                                     update_processor=make_processor(processor, workers),
+                                     rate_limiter=unlimited_rate_limiter())
+    updates = interleaved_updates(users, seed)
+
+    await application.initialize()
+    await application.start()
+    started = time.perf_counter()
+    for data in updates:
+        await application.update_queue.put(Update.de_json(data, application.bot))
+    # task_done вызывается после обработки обновления, а не после выборки из очереди
+    await application.update_queue.join()
+    elapsed = time.perf_counter() - started
+    await application.stop()
+    await application.shutdown()
+
+    errors = check_results(application, users)
+    print(f"Обработчик: {processor}, воркеров: {workers}, пользователей: {users}, обновлений: {len(updates)}")
+    print(f"Время: {elapsed:.2f} сек, {len(updates) / elapsed:,.0f} обновлений/сек, вызовов Bot API: {len(request.calls)}")
+    if errors:
+        print(f"Ошибок: {len(errors)}")
+        for line in errors[:10]:
+            print(f"  {line}")
+    else:
+        print("Все диалоги завершились в ожидаемом состоянии")
+    return not errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=300, help="Число имитированных пользователей")
+    parser.add_argument("--workers", type=int, default=16, help="Число одновременно обрабатываемых обновлений")
+    parser.add_argument("--processor", choices=("chat", "simple", "sequential"), default="chat",
+                        help="chat - порядок внутри чата, simple - без порядка, sequential - по одному")
+    parser.add_argument("--latency", type=float, default=0.005, help="Базовая задержка Bot API, сек")
+    parser.add_argument("--jitter", type=float, default=0.02, help="Случайная добавка к задержке, сек")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.ERROR)
+    ok = asyncio.run(run(args.users, args.workers, args.processor, args.latency, args.jitter, args.seed))
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,25 +1,94 @@
 # -*- coding: utf-8 -*-
 
 import os
+import asyncio
 import logging
-from openai import OpenAI
-from config.tariffs import MARKETPLACE_TARIFFS, SERVICE_TARIFFS
+import time
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from config.settings import (
+    AI_MAX_CONCURRENCY, AI_REQUEST_TIMEOUT, AI_MAX_RETRIES, AI_KEEPALIVE_EXPIRY,
+    AI_CACHE_SIZE, AI_CACHE_TTL, AI_CACHE_DB, AI_CACHE_SIMILARITY
+)
+from bot.ai_cache import AnswerCache
+from bot.metrics import openai_seconds, openai_errors, openai_tokens
+from bot.tariff_engine import TariffTable, get_tariff_table
 
 logger = logging.getLogger(__name__)
 
+# Метрики запросов к OpenAI
+_COMPLETE_SECONDS = openai_seconds.labels('complete')
+_STREAM_SECONDS = openai_seconds.labels('stream')
+_COMPLETE_ERRORS = openai_errors.labels('complete')
+_STREAM_ERRORS = openai_errors.labels('stream')
+_PROMPT_TOKENS = openai_tokens.labels('prompt')
+_COMPLETION_TOKENS = openai_tokens.labels('completion')
+
+
+def _record_usage(usage) -> None:
+    """Учет токенов из ответа OpenAI"""
+    if usage is not None:
+        _PROMPT_TOKENS.inc(usage.prompt_tokens or 0)
+        _COMPLETION_TOKENS.inc(usage.completion_tokens or 0)
+
 class AIAssistant:
     """AI-помощник для консультаций по услугам фулфилмента"""
     
-    def __init__(self):
-        self.openai_client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
-        self.system_prompt = self._create_system_prompt()
+    def __init__(self, openai_client: AsyncOpenAI = None, max_concurrency: int = None, request_timeout: float = None,
+                 answer_cache: AnswerCache = None):
+        max_concurrency = max_concurrency or AI_MAX_CONCURRENCY
+        self.request_timeout = request_timeout or AI_REQUEST_TIMEOUT
+        self.openai_client = openai_client or AsyncOpenAI(
+            api_key=os.environ.get("OPENAI_API_KEY"),
+            timeout=self.request_timeout,
+            max_retries=AI_MAX_RETRIES,
+            # Постоянный пул keep-alive соединений на все время работы бота
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=max_concurrency,
+                    max_keepalive_connections=max_concurrency,
+                    keepalive_expiry=AI_KEEPALIVE_EXPIRY
+                )
+            )
+        )
+        # Ограничиваем число одновременных запросов к OpenAI
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # Кеш ответов на типовые вопросы
+        self.answer_cache = answer_cache or AnswerCache(
+            max_size=AI_CACHE_SIZE,
+            ttl=AI_CACHE_TTL,
+            db_path=AI_CACHE_DB or None,
+            similarity_threshold=AI_CACHE_SIMILARITY
+        )
+        self.prompt_version = None
+        self._system_prompt = None
+        self._refresh_system_prompt()
+    
+    @property
+    def system_prompt(self) -> str:
+        """Системный промпт, пересобираемый только при изменении тарифов"""
+        self._refresh_system_prompt()
+        return self._system_prompt
+    
+    def _refresh_system_prompt(self) -> None:
+        """Пересборка промпта, если изменился хеш конфигурации тарифов"""
+        tariffs = get_tariff_table()
+        if tariffs.version != self.prompt_version:
+            self._system_prompt = self._create_system_prompt(tariffs)
+            self.prompt_version = tariffs.version
+            logger.info(f"Системный промпт AI-помощника собран, версия {tariffs.version}")
     
-    def _create_system_prompt(self) -> str:
+    async def close(self) -> None:
+        """Закрытие пула соединений с OpenAI"""
+        await self.openai_client.close()
+        await self.answer_cache.close()
+    
+    def _create_system_prompt(self, tariffs: TariffTable) -> str:
         """Создание системного промпта с информацией о компании"""
         
         # Собираем информацию о маркетплейсах
         marketplaces_info = []
-        for mp_code, mp_data in MARKETPLACE_TARIFFS.items():
+        for mp_code, mp_data in tariffs.config.marketplaces.items():
             features = ", ".join(mp_data.get('features', []))
             marketplaces_info.append(
                 f"• {mp_data['name']}: комиссия {mp_data['commission_rate']*100}%, "
@@ -28,7 +97,7 @@ class AIAssistant:
         
         # Собираем информацию об услугах
         services_info = []
-        for service_code, service_data in SERVICE_TARIFFS.items():
+        for service_code, service_data in tariffs.config.services.items():
             rate_info = f"{service_data['rate']} руб"
             if service_data['rate_type'] == 'per_order':
                 rate_info += "/заказ"
@@ -36,12 +105,33 @@ class AIAssistant:
                 rate_info += "/месяц"
             elif service_data['rate_type'] == 'per_item':
                 rate_info += "/товар"
+            elif service_data['rate_type'] == 'per_sku':
+                rate_info += "/товар каталога"
             
             features = ", ".join(service_data.get('features', []))
             services_info.append(
                 f"• {service_data['name']}: {rate_info}. {service_data['description']}. Особенности: {features}"
             )
         
+        # Собираем шкалу скидок за объем
+        discounts = tariffs.discounts
+        discounts_info = [
+            f"• От {threshold:,} заказов/месяц: {rate * 100:g}% скидка"
+            for threshold, rate in discounts.tiers
+        ]
+        discounts_note = " (скидка ступени действует на заказы сверх порога)" if discounts.mode == 'marginal' else ""
+        
+        # Собираем сезонные коэффициенты
+        seasons = tariffs.seasons
+        seasons_info = []
+        for season, multiplier in seasons.multipliers.items():
+            periods = ", ".join(
+                f"{first_day:02d}.{first_month:02d}-{last_day:02d}.{last_month:02d}"
+                for (first_month, first_day), (last_month, last_day) in seasons.ranges(season)
+            )
+            if periods and multiplier != 1.0:
+                seasons_info.append(f"• {periods}: коэффициент {multiplier:g} к стоимости услуг")
+        
         return f"""Ты - AI-консультант компании "Надежные-решения.рф", специализирующейся на услугах фулфилмента для российских маркетплейсов.
 
 ИНФОРМАЦИЯ О КОМПАНИИ:
@@ -56,10 +146,11 @@ class AIAssistant:
 УСЛУГИ ФУЛФИЛМЕНТА:
 {chr(10).join(services_info)}
 
-СКИДКИ ЗА ОБЪЕМ:
-• От 1,000 заказов/месяц: 5% скидка
-• От 5,000 заказов/месяц: 10% скидка  
-• От 10,000 заказов/месяц: 15% скидка
+СКИДКИ ЗА ОБЪЕМ{discounts_note}:
+{chr(10).join(discounts_info)}
+
+СЕЗОННОСТЬ:
+{chr(10).join(seasons_info) or "• Сезонных коэффициентов нет"}
 
 КОНТАКТЫ:
 • Сайт: надежные-решения.рф
@@ -76,6 +167,39 @@ class AIAssistant:
 6. Если не знаешь ответ - честно говори об этом и предлагай связаться с менеджером
 7. Избегай слишком длинных ответов - будь кратким и по делу"""
 
+    def _prepare_request(self, user_message: str, user_context: dict = None) -> tuple:
+        """Сообщения для модели, ключ кеша и версия промпта"""
+        # Добавляем контекст пользователя если есть
+        context_info = ""
+        if user_context:
+            if 'last_calculation' in user_context:
+                calc = user_context['last_calculation']
+                context_info = f"\n\nКОНТЕКСТ ПОЛЬЗОВАТЕЛЯ:\nПоследний расчет: {calc.get('marketplace', 'не указан')} маркетплейс, {calc.get('orders_count', 'не указано')} заказов/месяц, стоимость: {calc.get('total_cost', 'не рассчитана')} руб/месяц"
+        
+        system_prompt = self.system_prompt
+        prompt_version = self.prompt_version
+        
+        messages = [
+            {"role": "system", "content": system_prompt + context_info},
+            {"role": "user", "content": user_message}
+        ]
+        cache_key = self.answer_cache.make_key(user_message, prompt_version, user_context)
+        return messages, cache_key, prompt_version
+
+    def _create_completion(self, messages: list, stream: bool = False):
+        # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
+        # do not change this unless explicitly requested by the user
+        # В потоковом режиме usage приходит последним фрагментом без choices
+        extra = {'stream_options': {'include_usage': True}} if stream else {}
+        return self.openai_client.chat.completions.create(
+            model="gpt-4o",
+            messages=messages,
+            max_tokens=800,
+            temperature=0.7,
+            stream=stream,
+            **extra
+        )
+
     async def get_response(self, user_message: str, user_context: dict = None) -> str:
         """
         Получение ответа от AI-помощника
@@ -88,43 +212,139 @@ class AIAssistant:
             str: Ответ AI-помощника
         """
         try:
-            # Добавляем контекст пользователя если есть
-            context_info = ""
-            if user_context:
-                if 'last_calculation' in user_context:
-                    calc = user_context['last_calculation']
-                    context_info = f"\n\nКОНТЕКСТ ПОЛЬЗОВАТЕЛЯ:\nПоследний расчет: {calc.get('marketplace', 'не указан')} маркетплейс, {calc.get('orders_count', 'не указано')} заказов/месяц, стоимость: {calc.get('total_cost', 'не рассчитана')} руб/месяц"
+            messages, cache_key, prompt_version = self._prepare_request(user_message, user_context)
             
-            messages = [
-                {"role": "system", "content": self.system_prompt + context_info},
-                {"role": "user", "content": user_message}
-            ]
+            # Типовые вопросы отдаем из кеша без обращения к OpenAI
+            cached_answer = self.answer_cache.get(cache_key)
+            if cached_answer is not None:
+                logger.info(f"Ответ AI-помощника взят из кеша (промпт {prompt_version})")
+                return cached_answer
             
-            # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
-            # do not change this unless explicitly requested by the user
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4o",
-                messages=messages,
-                max_tokens=800,
-                temperature=0.7
-            )
+            # Запрос выполняется асинхронно и не блокирует цикл событий бота
+            async with self._semaphore:
+                started = time.perf_counter()
+                try:
+                    response = await asyncio.wait_for(
+                        self._create_completion(messages),
+                        timeout=self.request_timeout
+                    )
+                except Exception:
+                    _COMPLETE_ERRORS.inc()
+                    raise
+                finally:
+                    _COMPLETE_SECONDS.observe(time.perf_counter() - started)
             
-            return response.choices[0].message.content
+            _record_usage(response.usage)
+            logger.info(f"Ответ AI-помощника получен (промпт {prompt_version})")
+            answer = response.choices[0].message.content
+            self.answer_cache.set(cache_key, answer)
+            return answer
             
+        except asyncio.TimeoutError:
+            logger.warning(f"AI-помощник не ответил за {self.request_timeout} сек")
+            return self._fallback_response()
         except Exception as e:
             logger.error(f"Ошибка AI-помощника: {e}")
-            return ("Извините, временные технические проблемы с AI-помощником. "
-                   "Пожалуйста, воспользуйтесь калькулятором или свяжитесь с нашим менеджером: "
-                   "+7 (499) 714 29 99")
-
-    def is_question_about_services(self, message: str) -> bool:
-        """Проверка, является ли сообщение вопросом об услугах"""
-        service_keywords = [
-            'фулфилмент', 'склад', 'хранение', 'упаковка', 'отправка', 'доставка',
-            'возврат', 'маркировка', 'wildberries', 'ozon', 'яндекс', 'маркет',
-            'стоимость', 'цена', 'тариф', 'сколько', 'услуг', 'фото', 'качество',
-            'аналитика', 'комиссия', 'расчет', 'калькулятор'
-        ]
+            return self._fallback_response()
+
+    async def stream_response(self, user_message: str, user_context: dict = None):
+        """
+        Потоковое получение ответа от AI-помощника
         
-        message_lower = message.lower()
-        return any(keyword in message_lower for keyword in service_keywords)
+        Args:
+            user_message: Сообщение пользователя
+            user_context: Контекст пользователя (предыдущие расчеты и т.д.)
+        
+        Yields:
+            str: Очередной фрагмент ответа
+        """
+        parts = []
+        try:
+            messages, cache_key, prompt_version = self._prepare_request(user_message, user_context)
+            
+            cached_answer = self.answer_cache.get(cache_key)
+            if cached_answer is not None:
+                logger.info(f"Ответ AI-помощника взят из кеша (промпт {prompt_version})")
+                yield cached_answer
+                return
+            
+            # Поток читается в отдельной задаче: слот семафора не ждет правок сообщений в Telegram
+            fragments = asyncio.Queue()
+            reader = asyncio.get_running_loop().create_task(self._read_stream(messages, fragments))
+            try:
+                while True:
+                    fragment = await fragments.get()
+                    if fragment is None:
+                        break
+                    if isinstance(fragment, Exception):
+                        raise fragment
+                    parts.append(fragment)
+                    yield fragment
+            finally:
+                if not reader.done():
+                    reader.cancel()
+            
+            logger.info(f"Потоковый ответ AI-помощника получен (промпт {prompt_version})")
+            self.answer_cache.set(cache_key, "".join(parts))
+            
+        except asyncio.TimeoutError:
+            _STREAM_ERRORS.inc()
+            logger.warning(f"AI-помощник не ответил за {self.request_timeout} сек")
+            if not parts:
+                yield self._fallback_response()
+        except Exception as e:
+            _STREAM_ERRORS.inc()
+            logger.error(f"Ошибка AI-помощника: {e}")
+            if not parts:
+                yield self._fallback_response()
+
+    async def _read_stream(self, messages: list, fragments: asyncio.Queue) -> None:
+        """Чтение потока OpenAI в очередь: фрагменты, затем None или исключение"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.request_timeout
+        try:
+            async with self._semaphore:
+                started = time.perf_counter()
+                stream = await asyncio.wait_for(
+                    self._create_completion(messages, stream=True),
+                    timeout=self.request_timeout
+                )
+                chunks = stream.__aiter__()
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), timeout=deadline - loop.time())
+                    except StopAsyncIteration:
+                        break
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        fragments.put_nowait(delta)
+                    _record_usage(getattr(chunk, 'usage', None))
+                _STREAM_SECONDS.observe(time.perf_counter() - started)
+        except Exception as e:
+            fragments.put_nowait(e)
+            return
+        fragments.put_nowait(None)
+
+    def _fallback_response(self) -> str:
+        """Ответ при недоступности AI-помощника"""
+        return ("Извините, временные технические проблемы с AI-помощником. "
+               "Пожалуйста, воспользуйтесь калькулятором или свяжитесь с нашим менеджером: "
+               "+7 (499) 714 29 99")
+
+_ai_assistant = None
+
+
+def get_ai_assistant() -> AIAssistant:
+    """Общий для всего процесса экземпляр AI-помощника"""
+    global _ai_assistant
+    if _ai_assistant is None:
+        _ai_assistant = AIAssistant()
+    return _ai_assistant
+
+
+async def close_ai_assistant() -> None:
+    """Закрытие общего AI-помощника при остановке бота"""
+    global _ai_assistant
+    if _ai_assistant is not None:
+        await _ai_assistant.close()
+        _ai_assistant = None
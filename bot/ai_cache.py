@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+
+"""
+Кеш ответов AI-консультанта по нормализованному вопросу
+"""
+
+import asyncio
+import logging
+import math
+import re
+import sqlite3
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Слова, не влияющие на смысл вопроса; отрицания (не, ни, без) меняют смысл и остаются
+STOPWORDS = frozenset({
+    'а', 'и', 'в', 'во', 'на', 'у', 'о', 'об', 'по', 'за', 'с', 'со', 'к', 'ко',
+    'из', 'от', 'до', 'для', 'при', 'ли', 'же', 'бы', 'ну', 'то', 'это',
+    'как', 'какой', 'какая', 'какое', 'какие', 'какую', 'каков', 'мне', 'меня',
+    'я', 'мы', 'вы', 'вам', 'вас', 'ваш', 'ваша', 'ваши', 'вашей', 'вашего',
+    'есть', 'можно', 'пожалуйста', 'подскажите', 'скажите', 'расскажите',
+    'привет', 'здравствуйте', 'добрый', 'день', 'еще', 'ещё', 'там', 'тут'
+})
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s]+", re.UNICODE)
+
+
+def normalize_question(question: str) -> str:
+    """
+    Нормализация вопроса для ключа кеша
+
+    Приводит к нижнему регистру, убирает пунктуацию и стоп-слова.
+    Порядок слов сохраняется: "для WB, а не Ozon" и "для Ozon, а не WB" -
+    разные вопросы.
+    """
+    text = _PUNCTUATION_RE.sub(" ", question.lower().replace('ё', 'е'))
+    return " ".join(word for word in text.split() if word not in STOPWORDS)
+
+
+def _bucket(value: float) -> int:
+    """Округление до одной значащей цифры: 1234 -> 1000, 1500 -> 2000"""
+    if not value or value <= 0:
+        return 0
+    magnitude = 10 ** int(math.log10(value))
+    return int(round(value / magnitude) * magnitude)
+
+
+def context_bucket(user_context: dict = None) -> str:
+    """Укрупненный контекст пользователя (последний расчет) для ключа кеша"""
+    if not user_context or 'last_calculation' not in user_context:
+        return "-"
+    calc = user_context['last_calculation']
+    return f"{calc.get('marketplace', '-')}:{_bucket(calc.get('orders_count') or 0)}:{_bucket(calc.get('total_cost') or 0)}"
+
+
+def _trigrams(text: str) -> set:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class AnswerCache:
+    """
+    LRU-кеш ответов с TTL и ограничением размера
+
+    Ключ - (версия промпта, контекст пользователя, нормализованный вопрос).
+    Дополнительно может искать похожие вопросы по триграммам и хранить
+    ответы в SQLite, чтобы они переживали перезапуск бота.
+
+    Поиск идет только в памяти: при открытии база загружает в нее свежие
+    ответы, а новые и удаленные записи пишутся в базу в отдельном потоке
+    (write-behind), не блокируя цикл событий.
+    """
+
+    def __init__(self, max_size: int = 1000, ttl: float = 3600, db_path: str = None,
+                 similarity_threshold: float = 0.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (answer, created_at)
+        self._trigram_index = {}  # (prompt_version, context) -> {trigram: set(question)}
+        self._db = None
+        self._pending = {}  # key -> (answer, created_at) или None для удаления
+        self._flush_task = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS ai_answers ("
+                "prompt_version TEXT, context TEXT, question TEXT, answer TEXT, created_at REAL, "
+                "PRIMARY KEY (prompt_version, context, question))"
+            )
+            self._db.commit()
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict:
+        """Счетчики кеша"""
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hit_ratio
+        }
+
+    def make_key(self, question: str, prompt_version: str, user_context: dict = None) -> tuple:
+        return (prompt_version, context_bucket(user_context), normalize_question(question))
+
+    def get(self, key: tuple):
+        """Ответ из кеша или None"""
+        answer = self._lookup(key)
+        if answer is None and self.similarity_threshold:
+            similar_key = self._find_similar(key)
+            if similar_key is not None:
+                answer = self._lookup(similar_key)
+
+        if answer is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return answer
+
+    def set(self, key: tuple, answer: str) -> None:
+        """Сохранение ответа"""
+        now = time.time()
+        self._store(key, answer, now)
+        if self._db is not None:
+            self._pending[key] = (answer, now)
+            self._schedule_flush()
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._trigram_index.clear()
+
+    async def close(self) -> None:
+        """Запись оставшихся изменений и закрытие базы"""
+        if self._db is None:
+            return
+        if self._flush_task is not None:
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        if self._pending:
+            batch, self._pending = self._pending, {}
+            await asyncio.to_thread(self._write, batch)
+        self._db.close()
+        self._db = None
+
+    def _load(self) -> None:
+        """Свежие ответы из базы в память (при запуске)"""
+        rows = self._db.execute(
+            "SELECT prompt_version, context, question, answer, created_at FROM ai_answers "
+            "WHERE created_at > ? ORDER BY created_at DESC LIMIT ?",
+            (time.time() - self.ttl, self.max_size)
+        ).fetchall()
+        # Самые свежие должны оказаться в конце LRU
+        for prompt_version, context, question, answer, created_at in reversed(rows):
+            self._store((prompt_version, context, question), answer, created_at)
+
+    def _schedule_flush(self) -> None:
+        if self._flush_task is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Вне цикла событий (скрипты, тесты) блокировать нечего
+            batch, self._pending = self._pending, {}
+            self._write(batch)
+            return
+        self._flush_task = loop.create_task(self._flush())
+
+    async def _flush(self) -> None:
+        try:
+            while self._pending and self._db is not None:
+                batch, self._pending = self._pending, {}
+                await asyncio.to_thread(self._write, batch)
+        except Exception as e:
+            logger.error(f"Ошибка записи кеша ответов AI: {e}")
+        finally:
+            self._flush_task = None
+
+    def _write(self, batch: dict) -> None:
+        """Запись пачки изменений и удаление истекших ответов (в отдельном потоке)"""
+        self._db.executemany(
+            "INSERT OR REPLACE INTO ai_answers VALUES (?, ?, ?, ?, ?)",
+            [(*key, *entry) for key, entry in batch.items() if entry is not None]
+        )
+        self._db.executemany(
+            "DELETE FROM ai_answers WHERE prompt_version = ? AND context = ? AND question = ?",
+            [key for key, entry in batch.items() if entry is None]
+        )
+        self._db.execute("DELETE FROM ai_answers WHERE created_at < ?", (time.time() - self.ttl,))
+        self._db.commit()
+
+    def _lookup(self, key: tuple):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        answer, created_at = entry
+        if time.time() - created_at > self.ttl:
+            self._remove(key)
+            return None
+
+        self._entries.move_to_end(key)
+        return answer
+
+    def _store(self, key: tuple, answer: str, created_at: float) -> None:
+        self._entries[key] = (answer, created_at)
+        self._entries.move_to_end(key)
+        self._index(key)
+        while len(self._entries) > self.max_size:
+            oldest_key, _ = self._entries.popitem(last=False)
+            self._unindex(oldest_key)
+
+    def _remove(self, key: tuple) -> None:
+        self._entries.pop(key, None)
+        self._unindex(key)
+        if self._db is not None:
+            self._pending[key] = None
+            self._schedule_flush()
+
+    def _index(self, key: tuple) -> None:
+        if not self.similarity_threshold:
+            return
+        index = self._trigram_index.setdefault(key[:2], {})
+        for trigram in _trigrams(key[2]):
+            index.setdefault(trigram, set()).add(key[2])
+
+    def _unindex(self, key: tuple) -> None:
+        index = self._trigram_index.get(key[:2])
+        if not index:
+            return
+        for trigram in _trigrams(key[2]):
+            questions = index.get(trigram)
+            if questions:
+                questions.discard(key[2])
+                if not questions:
+                    del index[trigram]
+
+    def _find_similar(self, key: tuple):
+        """Самый похожий вопрос (коэффициент Жаккара по триграммам) в той же версии и контексте"""
+        index = self._trigram_index.get(key[:2])
+        if not index:
+            return None
+
+        query = _trigrams(key[2])
+        overlap = {}
+        for trigram in query:
+            for question in index.get(trigram, ()):
+                overlap[question] = overlap.get(question, 0) + 1
+
+        best_question, best_score = None, 0.0
+        for question, common in overlap.items():
+            score = common / (len(query) + len(_trigrams(question)) - common)
+            if score > best_score:
+                best_question, best_score = question, score
+
+        if best_score >= self.similarity_threshold:
+            return (*key[:2], best_question)
+        return None
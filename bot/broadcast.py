@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+
+"""
+Реестр пользователей и рассылки
+
+Реестр запоминает чаты, из которых боту писали /start. Рассылка идет
+по активным чатам в порядке chat_id страницами: страница отправляется
+пулом воркеров через полосу bulk ограничителя, затем номер последнего
+чата страницы сохраняется как контрольная точка. После падения рассылка
+продолжается с контрольной точки, повторно может прийти не больше одной
+страницы. Чаты, где бота заблокировали или удалили, помечаются
+неактивными и в следующие рассылки не попадают.
+"""
+
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+
+from telegram import Bot
+from telegram.error import BadRequest, Forbidden, TelegramError
+
+from bot.rate_limiter import BULK, lane_kwargs
+from config.settings import USERS_DB, BROADCAST_WORKERS, BROADCAST_PAGE_SIZE, BROADCAST_PROGRESS_INTERVAL
+from utils.formatters import sanitize_html
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS users ("
+    "chat_id INTEGER PRIMARY KEY, user_id INTEGER, username TEXT, first_name TEXT, "
+    "first_seen REAL NOT NULL, last_seen REAL NOT NULL, active INTEGER NOT NULL DEFAULT 1)",
+    "CREATE TABLE IF NOT EXISTS broadcasts ("
+    "id INTEGER PRIMARY KEY AUTOINCREMENT, text TEXT NOT NULL, admin_chat_id INTEGER, status_message_id INTEGER, "
+    "created_at REAL NOT NULL, finished_at REAL, status TEXT NOT NULL, checkpoint INTEGER NOT NULL, "
+    "total INTEGER NOT NULL, sent INTEGER NOT NULL DEFAULT 0, failed INTEGER NOT NULL DEFAULT 0, "
+    "blocked INTEGER NOT NULL DEFAULT 0)",
+)
+
+RUNNING = 'running'
+DONE = 'done'
+
+# Отказы Telegram, после которых чат считается недоступным
+_INACTIVE_CHAT_ERRORS = ("chat not found", "user is deactivated", "peer_id_invalid")
+
+
+class UserRegistry:
+    """
+    Чаты пользователей бота в SQLite
+
+    touch() только запоминает чат в памяти, запись в базу идет пачкой
+    в отдельном потоке. До open() записи копятся в памяти.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._db = None
+        self._pending = {}  # chat_id -> строка для записи
+        self._write_task = None
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        return self._db
+
+    def open(self) -> None:
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        for statement in _SCHEMA:
+            self._db.execute(statement)
+        self._db.commit()
+
+    async def close(self) -> None:
+        await self.flush()
+        if self._db is not None:
+            await asyncio.to_thread(self._db.close)
+            self._db = None
+
+    def touch(self, chat_id: int, user=None) -> None:
+        """Отметить, что пользователь пользуется ботом"""
+        self._pending[chat_id] = (
+            chat_id,
+            user.id if user else None,
+            user.username if user else None,
+            user.first_name if user else None,
+            time.time()
+        )
+        if self._db is not None and self._write_task is None:
+            self._write_task = asyncio.get_running_loop().create_task(self._write_soon())
+
+    async def _write_soon(self) -> None:
+        try:
+            await self.flush()
+        finally:
+            self._write_task = None
+
+    async def flush(self) -> None:
+        if not self._pending or self._db is None:
+            return
+        rows, self._pending = list(self._pending.values()), {}
+        await asyncio.to_thread(self._write, rows)
+
+    def _write(self, rows: list) -> None:
+        with self._db:
+            self._db.executemany(
+                "INSERT INTO users (chat_id, user_id, username, first_name, first_seen, last_seen) "
+                "VALUES (?1, ?2, ?3, ?4, ?5, ?5) "
+                "ON CONFLICT (chat_id) DO UPDATE SET user_id = excluded.user_id, username = excluded.username, "
+                "first_name = excluded.first_name, last_seen = excluded.last_seen, active = 1",
+                rows
+            )
+
+    def count_active(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM users WHERE active = 1").fetchone()[0]
+
+    def active_chats_after(self, chat_id: int, limit: int) -> list:
+        """Активные чаты с chat_id больше заданного, по возрастанию"""
+        rows = self._db.execute(
+            "SELECT chat_id FROM users WHERE active = 1 AND chat_id > ? ORDER BY chat_id LIMIT ?",
+            (chat_id, limit)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def deactivate(self, chat_ids: list) -> None:
+        with self._db:
+            self._db.executemany("UPDATE users SET active = 0 WHERE chat_id = ?", [(chat_id,) for chat_id in chat_ids])
+
+
+class Broadcaster:
+    """
+    Рассылки по реестру пользователей
+
+    Состояние каждой рассылки (счетчики и контрольная точка) хранится
+    в таблице broadcasts той же базы. Незавершенные рассылки продолжаются
+    при запуске бота.
+    """
+
+    def __init__(self, registry: UserRegistry, workers: int = 20, page_size: int = 500,
+                 progress_interval: float = 15.0):
+        self.registry = registry
+        self.workers = workers
+        self.page_size = page_size
+        self.progress_interval = progress_interval
+        self.bot = None
+        self._tasks = {}  # id рассылки -> задача
+        self._progress = {}  # id рассылки -> счетчики в памяти
+
+    async def start(self, bot: Bot) -> None:
+        """Открытие реестра и продолжение прерванных рассылок"""
+        self.bot = bot
+        if self.registry.db is None:
+            await asyncio.to_thread(self.registry.open)
+        await self.registry.flush()
+        rows = await asyncio.to_thread(
+            lambda: self.registry.db.execute("SELECT id FROM broadcasts WHERE status = ?", (RUNNING,)).fetchall()
+        )
+        for (broadcast_id,) in rows:
+            logger.info(f"Продолжаем рассылку #{broadcast_id} с контрольной точки")
+            self._launch(broadcast_id)
+
+    async def stop(self) -> None:
+        """Остановка рассылок; контрольные точки уже сохранены, после запуска они продолжатся"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.registry.close()
+
+    async def create(self, text: str, admin_chat_id: int = None, status_message_id: int = None) -> int:
+        """Новая рассылка по всем активным пользователям; возвращает ее номер"""
+        await self.registry.flush()
+
+        def insert() -> int:
+            total = self.registry.count_active()
+            with self.registry.db:
+                cursor = self.registry.db.execute(
+                    "INSERT INTO broadcasts (text, admin_chat_id, status_message_id, created_at, status, checkpoint, total) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (text, admin_chat_id, status_message_id, time.time(), RUNNING, -2 ** 63, total)
+                )
+            return cursor.lastrowid
+
+        broadcast_id = await asyncio.to_thread(insert)
+        self._launch(broadcast_id)
+        return broadcast_id
+
+    def progress(self, broadcast_id: int) -> dict:
+        """Счетчики, скорость (сообщений в секунду) и оценка оставшегося времени"""
+        progress = self._progress.get(broadcast_id)
+        if progress is None:
+            return None
+        elapsed = time.monotonic() - progress['started']
+        done = progress['sent'] + progress['failed'] + progress['blocked']
+        rate = progress['done_since_start'] / elapsed if elapsed > 0 else 0.0
+        remaining = max(0, progress['total'] - done)
+        return {
+            **{key: progress[key] for key in ('total', 'sent', 'failed', 'blocked', 'status')},
+            'rate': rate,
+            'eta': remaining / rate if rate else None,
+        }
+
+    def _launch(self, broadcast_id: int) -> None:
+        task = asyncio.get_running_loop().create_task(self._run(broadcast_id))
+        self._tasks[broadcast_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(broadcast_id, None))
+
+    async def _run(self, broadcast_id: int) -> None:
+        db = self.registry.db
+        row = await asyncio.to_thread(lambda: db.execute(
+            "SELECT text, admin_chat_id, status_message_id, checkpoint, total, sent, failed, blocked "
+            "FROM broadcasts WHERE id = ?", (broadcast_id,)
+        ).fetchone())
+        text, admin_chat_id, status_message_id, checkpoint, total, sent, failed, blocked = row
+        progress = self._progress[broadcast_id] = {
+            'total': total, 'sent': sent, 'failed': failed, 'blocked': blocked, 'status': RUNNING,
+            'started': time.monotonic(), 'done_since_start': 0,
+        }
+        text = sanitize_html(text)
+        reported = time.monotonic()
+
+        try:
+            while True:
+                chats = await asyncio.to_thread(self.registry.active_chats_after, checkpoint, self.page_size)
+                if not chats:
+                    break
+                results = await self._send_page(text, chats, progress)
+
+                inactive = [chat_id for chat_id, result in results.items() if result == 'blocked']
+                if inactive:
+                    await asyncio.to_thread(self.registry.deactivate, inactive)
+                checkpoint = chats[-1]
+                await asyncio.to_thread(self._save, broadcast_id, checkpoint, progress)
+
+                if time.monotonic() - reported >= self.progress_interval:
+                    reported = time.monotonic()
+                    await self._report(broadcast_id, admin_chat_id, status_message_id)
+
+            progress['status'] = DONE
+            await asyncio.to_thread(self._save, broadcast_id, checkpoint, progress)
+            summary = self.progress(broadcast_id)
+            logger.info(
+                f"Рассылка #{broadcast_id} завершена: отправлено {summary['sent']}, ошибок {summary['failed']}, "
+                f"заблокировали бота {summary['blocked']}"
+            )
+            await self._report(broadcast_id, admin_chat_id, status_message_id)
+        except asyncio.CancelledError:
+            logger.info(f"Рассылка #{broadcast_id} остановлена на чате {checkpoint}")
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка рассылки #{broadcast_id}: {e}")
+
+    async def _send_page(self, text: str, chats: list, progress: dict) -> dict:
+        """Отправка страницы пулом воркеров: chat_id -> sent / failed / blocked"""
+        queue = asyncio.Queue()
+        for chat_id in chats:
+            queue.put_nowait(chat_id)
+        results = {}
+
+        async def worker():
+            while not queue.empty():
+                chat_id = queue.get_nowait()
+                result = results[chat_id] = await self._send(chat_id, text)
+                progress[result] += 1
+                progress['done_since_start'] += 1
+
+        await asyncio.gather(*(worker() for _ in range(min(self.workers, len(chats)))))
+        return results
+
+    async def _send(self, chat_id: int, text: str) -> str:
+        try:
+            await self.bot.send_message(chat_id=chat_id, text=text, parse_mode='HTML', **lane_kwargs(self.bot, BULK))
+            return 'sent'
+        except Forbidden:
+            return 'blocked'
+        except BadRequest as e:
+            if any(reason in str(e).lower() for reason in _INACTIVE_CHAT_ERRORS):
+                return 'blocked'
+            logger.warning(f"Рассылка в чат {chat_id} не удалась: {e}")
+            return 'failed'
+        except TelegramError as e:
+            logger.warning(f"Рассылка в чат {chat_id} не удалась: {e}")
+            return 'failed'
+
+    def _save(self, broadcast_id: int, checkpoint: int, progress: dict) -> None:
+        with self.registry.db:
+            self.registry.db.execute(
+                "UPDATE broadcasts SET checkpoint = ?, sent = ?, failed = ?, blocked = ?, status = ?, finished_at = ? "
+                "WHERE id = ?",
+                (checkpoint, progress['sent'], progress['failed'], progress['blocked'], progress['status'],
+                 time.time() if progress['status'] == DONE else None, broadcast_id)
+            )
+
+    @staticmethod
+    def format_progress(broadcast_id: int, progress: dict) -> str:
+        done = progress['sent'] + progress['failed'] + progress['blocked']
+        title = "завершена" if progress['status'] == DONE else "идет"
+        lines = [
+            f"📣 <b>Рассылка #{broadcast_id} {title}</b>",
+            f"Обработано: {done} из {progress['total']}",
+            f"✅ Доставлено: {progress['sent']}",
+            f"🚫 Заблокировали бота: {progress['blocked']}",
+            f"⚠️ Ошибок: {progress['failed']}",
+        ]
+        if progress['status'] != DONE:
+            lines.append(f"Скорость: {progress['rate']:.1f} сообщ./сек")
+            if progress['eta'] is not None:
+                lines.append(f"Осталось примерно: {progress['eta'] / 60:.0f} мин")
+        return "\n".join(lines)
+
+    async def _report(self, broadcast_id: int, admin_chat_id: int, status_message_id: int) -> None:
+        """Обновление сообщения о ходе рассылки у администратора"""
+        if not admin_chat_id or not status_message_id:
+            return
+        try:
+            await self.bot.edit_message_text(
+                chat_id=admin_chat_id,
+                message_id=status_message_id,
+                text=self.format_progress(broadcast_id, self.progress(broadcast_id)),
+                parse_mode='HTML'
+            )
+        except TelegramError as e:
+            logger.debug(f"Не удалось обновить ход рассылки #{broadcast_id}: {e}")
+
+
+# Общий реестр пользователей и рассыльщик; бот подключается при запуске
+user_registry = UserRegistry(USERS_DB)
+broadcaster = Broadcaster(
+    user_registry,
+    workers=BROADCAST_WORKERS,
+    page_size=BROADCAST_PAGE_SIZE,
+    progress_interval=BROADCAST_PROGRESS_INTERVAL
+)
@@ -1,15 +1,43 @@
 # -*- coding: utf-8 -*-
 
+from datetime import date
+
+from bot.tariff_engine import TariffTable, get_tariff_table
 from config.tariffs import MARKETPLACE_TARIFFS, SERVICE_TARIFFS
 
+try:
+    import numpy as np
+except ImportError:  # numpy нужен только для пакетного расчета
+    np = None
+
+# Порядок услуг для битовых масок пакетного расчета: бит i - i-я услуга тарифов
+# (состав услуг при перезагрузке тарифов не меняется, см. check_compatible)
+SERVICE_CODES = tuple(SERVICE_TARIFFS)
+# Номера маркетплейсов в сессиях пользователей (состав тоже не меняется)
+MARKETPLACE_CODES = tuple(MARKETPLACE_TARIFFS)
+
+def services_to_mask(selected_services: list) -> int:
+    """Битовая маска услуг для calculate_batch"""
+    mask = 0
+    for service in selected_services:
+        if service in SERVICE_CODES:
+            mask |= 1 << SERVICE_CODES.index(service)
+    return mask
+
+def mask_to_services(mask: int) -> list:
+    """Список услуг по битовой маске, в порядке SERVICE_CODES"""
+    return [code for bit, code in enumerate(SERVICE_CODES) if mask >> bit & 1]
+
 class FulfillmentCalculator:
     """Калькулятор стоимости услуг фулфилмента"""
     
-    def __init__(self):
-        self.marketplace_tariffs = MARKETPLACE_TARIFFS
-        self.service_tariffs = SERVICE_TARIFFS
+    def __init__(self, tariffs: TariffTable = None):
+        self.tariffs = tariffs or get_tariff_table()
+        self.marketplace_tariffs = self.tariffs.config.marketplaces
+        self.service_tariffs = self.tariffs.config.services
     
-    def calculate(self, marketplace: str, orders_count: int, selected_services: list) -> dict:
+    def calculate(self, marketplace: str, orders_count: int, selected_services: list,
+                  when: date = None, season: str = None) -> dict:
         """
         Основной метод расчета стоимости
         
@@ -17,13 +45,18 @@ class FulfillmentCalculator:
             marketplace: Выбранный маркетплейс
             orders_count: Количество заказов в месяц
             selected_services: Список выбранных услуг
+            when: Дата, по которой определяется сезон (по умолчанию сегодня)
+            season: Сезон явно ('high', 'normal', 'low'), вместо даты
         
         Returns:
             dict: Результат расчета с детализацией
         """
+        season, seasonal_multiplier = self.resolve_season(when, season)
         result = {
             'marketplace': marketplace,
             'orders_count': orders_count,
+            'season': season,
+            'seasonal_multiplier': seasonal_multiplier,
             'services': {},
             'marketplace_commission': 0,
             'total_service_cost': 0,
@@ -32,30 +65,36 @@ class FulfillmentCalculator:
         }
         
         # Расчет комиссии маркетплейса
-        marketplace_tariff = self.marketplace_tariffs.get(marketplace, {})
-        base_commission = marketplace_tariff.get('commission_rate', 0.1)
+        pricing = self.tariffs.marketplaces.get(marketplace) or self.tariffs.default_marketplace
         
         # Применяем скидки за объем
         volume_discount = self._calculate_volume_discount(orders_count)
-        commission_rate = base_commission * (1 - volume_discount)
+        commission_rate = pricing.commission_rate * (1 - volume_discount)
         
         # Примерная стоимость заказа для расчета комиссии
-        average_order_value = marketplace_tariff.get('average_order_value', 1000)
-        result['marketplace_commission'] = orders_count * average_order_value * commission_rate
+        result['marketplace_commission'] = orders_count * pricing.average_order_value * commission_rate
         
         # Расчет стоимости выбранных услуг
         total_service_cost = 0
         service_details = {}
+        services = self.tariffs.services
         
         for service in selected_services:
-            service_tariff = self.service_tariffs.get(service, {})
-            service_cost = self._calculate_service_cost(service, orders_count, service_tariff)
+            service_pricing = services.get(service)
+            if service_pricing is None:
+                service_details[service] = {'name': service, 'cost': 0, 'rate': 0, 'rate_type': 'per_order'}
+                continue
+            
+            service_cost = service_pricing.price(service_pricing, orders_count, pricing.return_rate) * seasonal_multiplier
+            # Минимальная стоимость услуги в месяц
+            if service_cost < service_pricing.min_rate:
+                service_cost = service_pricing.min_rate
             
             service_details[service] = {
-                'name': service_tariff.get('name', service),
+                'name': service_pricing.name,
                 'cost': service_cost,
-                'rate': service_tariff.get('rate', 0),
-                'rate_type': service_tariff.get('rate_type', 'per_order')
+                'rate': service_pricing.rate,
+                'rate_type': service_pricing.rate_type
             }
             
             total_service_cost += service_cost
@@ -67,32 +106,139 @@ class FulfillmentCalculator:
         
         return result
     
+    def resolve_season(self, when: date = None, season: str = None) -> tuple:
+        """(сезон, коэффициент) по явному сезону или по дате"""
+        seasons = self.tariffs.seasons
+        if season is not None:
+            if season not in seasons.multipliers:
+                raise ValueError(f"Неизвестный сезон: {season!r}")
+            return season, seasons.multipliers[season]
+        when = when or date.today()
+        return seasons.season(when), seasons.multiplier(when)
+    
     def _calculate_volume_discount(self, orders_count: int) -> float:
-        """Расчет скидки за объем заказов"""
-        if orders_count >= 10000:
-            return 0.15  # 15% скидка
-        elif orders_count >= 5000:
-            return 0.10  # 10% скидка
-        elif orders_count >= 1000:
-            return 0.05  # 5% скидка
-        else:
-            return 0.0   # Без скидки
+        """Расчет скидки за объем заказов по шкале из VOLUME_DISCOUNTS"""
+        return self.tariffs.discounts.discount(orders_count)
+    
+    def calculate_batch(self, marketplaces, orders_counts, service_masks, grid: bool = True,
+                        when: date = None, season: str = None, seasonal_multiplier=None) -> dict:
+        """
+        Пакетный расчет стоимости на NumPy
+        
+        Args:
+            marketplaces: Коды маркетплейсов
+            orders_counts: Количества заказов в месяц
+            service_masks: Битовые маски услуг (см. services_to_mask)
+            grid: True - полная сетка формы (маркетплейсы, заказы, маски),
+                False - поэлементный расчет по правилам broadcasting NumPy
+            when, season: Сезон для всей сетки, как в calculate()
+            seasonal_multiplier: Коэффициент или массив коэффициентов вместо when/season
+        
+        Returns:
+            dict: Массивы volume_discount, marketplace_commission,
+                total_service_cost, total_cost, cost_per_order
+        
+        Результат совпадает с calculate(), если услуги в нем перечислены
+        в порядке SERVICE_CODES (порядок важен для сложения float).
+        """
+        if np is None:
+            raise RuntimeError("Для пакетного расчета нужен numpy: pip install numpy")
+        
+        if seasonal_multiplier is None:
+            _, seasonal_multiplier = self.resolve_season(when, season)
+        seasonal_multiplier = np.asarray(seasonal_multiplier)
+        
+        # Параметры маркетплейсов по индексам; последний - значения по умолчанию
+        pricings = list(self.tariffs.marketplaces.values()) + [self.tariffs.default_marketplace]
+        index = {pricing.code: i for i, pricing in enumerate(pricings[:-1])}
+        base_commission = np.array([pricing.commission_rate for pricing in pricings])
+        average_order_value = np.array([pricing.average_order_value for pricing in pricings])
+        return_rate = np.array([pricing.return_rate for pricing in pricings])
+        
+        marketplace_codes = np.asarray(marketplaces)
+        marketplace_index = np.array(
+            [index.get(code, len(pricings) - 1) for code in marketplace_codes.ravel().tolist()], dtype=np.intp
+        ).reshape(marketplace_codes.shape)
+        orders = np.asarray(orders_counts, dtype=np.int64)
+        masks = np.asarray(service_masks, dtype=np.int64)
+        if grid:
+            marketplace_index = marketplace_index.reshape(-1, 1, 1)
+            orders = orders.reshape(1, -1, 1)
+            masks = masks.reshape(1, 1, -1)
+        
+        # Скидка за объем: поиск ступени по отсортированным порогам
+        volume_discount = self.tariffs.discounts.discount_batch(orders)
+        
+        # Тот же порядок операций, что в calculate()
+        commission_rate = base_commission[marketplace_index] * (1 - volume_discount)
+        marketplace_commission = orders * average_order_value[marketplace_index] * commission_rate
+        
+        # Услуги складываются по битам в порядке SERVICE_CODES; функции цены те же, что в calculate()
+        marketplace_return_rate = return_rate[marketplace_index]
+        total_service_cost = np.zeros(np.broadcast_shapes(
+            marketplace_index.shape, orders.shape, masks.shape, seasonal_multiplier.shape
+        ))
+        for bit, service in enumerate(SERVICE_CODES):
+            selected = (masks >> bit) & 1 == 1
+            service_pricing = self.tariffs.services.get(service)
+            if service_pricing is None or not selected.any():
+                continue
+            service_cost = service_pricing.price(service_pricing, orders, marketplace_return_rate) * seasonal_multiplier
+            service_cost = np.maximum(service_cost, service_pricing.min_rate)
+            total_service_cost = total_service_cost + np.where(selected, service_cost, 0)
+        
+        total_cost = marketplace_commission + total_service_cost
+        cost_per_order = np.divide(total_cost, orders, out=np.zeros(total_cost.shape), where=orders > 0)
+        
+        return {
+            'volume_discount': np.broadcast_to(volume_discount, total_cost.shape),
+            'marketplace_commission': np.broadcast_to(marketplace_commission, total_cost.shape),
+            'total_service_cost': np.broadcast_to(total_service_cost, total_cost.shape),
+            'total_cost': total_cost,
+            'cost_per_order': cost_per_order
+        }
     
-    def _calculate_service_cost(self, service: str, orders_count: int, service_tariff: dict) -> float:
-        """Расчет стоимости конкретной услуги"""
-        rate = service_tariff.get('rate', 0)
-        rate_type = service_tariff.get('rate_type', 'per_order')
-        
-        if rate_type == 'per_order':
-            return rate * orders_count
-        elif rate_type == 'monthly':
-            return rate
-        elif rate_type == 'percentage':
-            # Процент от оборота (примерная оценка)
-            average_order_value = 1000
-            return rate * orders_count * average_order_value
-        else:
-            return 0
+    def project_costs(self, marketplace: str, orders_count: int, selected_services: list,
+                      start: date = None, months: int = 12) -> list:
+        """
+        Прогноз стоимости по месяцам с учетом сезонности
+        
+        Args:
+            marketplace: Выбранный маркетплейс
+            orders_count: Количество заказов в месяц
+            selected_services: Список выбранных услуг
+            start: Первый месяц прогноза (по умолчанию текущий)
+            months: Число месяцев
+        
+        Returns:
+            list: По словарю на месяц: month (первое число), seasonal_multiplier,
+                total_service_cost, marketplace_commission, total_cost, cost_per_order
+        
+        Коэффициент месяца - среднее по его дням. Все месяцы считаются
+        одним пакетным расчетом.
+        """
+        start = (start or date.today()).replace(day=1)
+        month_starts = [
+            date(start.year + (start.month - 1 + offset) // 12, (start.month - 1 + offset) % 12 + 1, 1)
+            for offset in range(months)
+        ]
+        multipliers = [self.tariffs.seasons.month_multiplier(month.year, month.month) for month in month_starts]
+        
+        batch = self.calculate_batch(
+            [marketplace] * months, [orders_count] * months, [services_to_mask(selected_services)] * months,
+            grid=False, seasonal_multiplier=multipliers
+        )
+        return [
+            {
+                'month': month,
+                'seasonal_multiplier': multipliers[i],
+                'total_service_cost': float(batch['total_service_cost'][i]),
+                'marketplace_commission': float(batch['marketplace_commission'][i]),
+                'total_cost': float(batch['total_cost'][i]),
+                'cost_per_order': float(batch['cost_per_order'][i])
+            }
+            for i, month in enumerate(month_starts)
+        ]
     
     def get_marketplace_info(self, marketplace: str) -> dict:
         """Получение информации о маркетплейсе"""
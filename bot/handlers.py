@@ -1,44 +1,101 @@
 # -*- coding: utf-8 -*-
 
+import html
 import logging
-import os
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto
+import time
+from telegram import Update, InlineKeyboardMarkup, InputMediaPhoto
+from telegram.error import BadRequest
 from telegram.ext import ContextTypes, ConversationHandler
-from bot.keyboards import get_main_menu_keyboard, get_marketplace_keyboard, get_services_keyboard, get_calculation_result_keyboard, get_ai_chat_keyboard
+from bot.keyboards import get_main_menu_keyboard, get_marketplace_keyboard, get_services_keyboard, get_calculation_result_keyboard, get_ai_chat_keyboard, get_ai_answer_keyboard, get_back_keyboard
 from bot.messages import MESSAGES
-from bot.calculator import FulfillmentCalculator
-from bot.ai_assistant import AIAssistant
+from bot.quote_cache import quote_cache
+from bot.ai_assistant import get_ai_assistant
+from bot.broadcast import broadcaster, user_registry
+from bot.intent_router import intent_router
+from bot.leads import lead_dispatcher, make_lead
+from bot.media import media_registry
+from bot.session import memory_report, session_sweeper
+from bot.message_tracker import sent_messages, content_hash, message_kind, PHOTO, CAPTION_LIMIT
+from bot.tariff_engine import TariffConfigError, get_tariff_table
+from bot.tariff_reload import tariff_reloader
 from bot.states import (
     MARKETPLACE_CHOICE, ORDERS_COUNT, SERVICES_CHOICE, CALCULATION_RESULT,
     APPLICATION_NAME, APPLICATION_CONTACT, APPLICATION_DESCRIPTION, AI_CHAT
 )
-from utils.formatters import format_calculation_result
+from config.settings import (
+    AI_STREAMING, AI_STREAM_EDIT_INTERVAL, AI_STREAM_MIN_EDIT_INTERVAL, AI_STREAM_EDIT_CHARS, ADMIN_USER_IDS
+)
+from utils.formatters import MARKETPLACE_DISPLAY_NAMES, sanitize_html
+from utils.stats import LatencyTracker
 
 logger = logging.getLogger(__name__)
 
+AI_ANSWER_HEADER = "🤖 <b>AI-консультант отвечает:</b>\n\n"
+
+# Время от вопроса пользователя до первого видимого текста ответа
+ai_first_text_latency = LatencyTracker("AI: время до первого текста")
+
+# Отказы в правке, после которых вместо правки отправляется новое сообщение
+_EDIT_FALLBACK_ERRORS = (
+    "message to edit not found",
+    "message can't be edited",
+    "there is no text in the message to edit",
+    "there is no caption in the message to edit",
+    "message caption is too long",
+)
+
 async def safe_edit_message(update: Update, text: str, reply_markup=None, parse_mode='HTML') -> None:
-    """Безопасное редактирование сообщения - работает с текстом и фото"""
+    """
+    Показ текста на месте сообщения, с кнопки которого пришло нажатие
+    
+    Текстовое сообщение правится через edit_message_text, фото - через подпись,
+    если текст в нее помещается. Правка, которая ничего не меняет, пропускается.
+    Новое сообщение отправляется, только если править нечего или Telegram
+    отказал в правке по известной причине; остальные ошибки пробрасываются.
+    """
     query = update.callback_query
-    try:
-        # Попытаться отредактировать текст сообщения
-        await query.edit_message_text(
-            text=text,
-            reply_markup=reply_markup,
-            parse_mode=parse_mode
-        )
-    except Exception:
-        # Если не удалось отредактировать (например, сообщение с фото), 
-        # отправляем новое сообщение
-        await query.message.reply_text(
-            text=text,
-            reply_markup=reply_markup,
-            parse_mode=parse_mode
-        )
+    message = query.message
+    chat_id, message_id = message.chat_id, message.message_id
+    content = content_hash(text, reply_markup, parse_mode)
+    
+    tracked_kind, tracked_content = sent_messages.get(chat_id, message_id)
+    if tracked_content == content:
+        sent_messages.skipped += 1
+        return
+    
+    kind = message_kind(message) or tracked_kind
+    if kind == PHOTO and len(text) > CAPTION_LIMIT:
+        kind = None
+    
+    if kind is not None:
+        try:
+            if kind == PHOTO:
+                await query.edit_message_caption(caption=text, reply_markup=reply_markup, parse_mode=parse_mode)
+            else:
+                await query.edit_message_text(text=text, reply_markup=reply_markup, parse_mode=parse_mode)
+            sent_messages.remember(chat_id, message_id, kind, content)
+            return
+        except BadRequest as e:
+            error = str(e).lower()
+            if "message is not modified" in error:
+                sent_messages.remember(chat_id, message_id, kind, content)
+                return
+            if not any(reason in error for reason in _EDIT_FALLBACK_ERRORS):
+                raise
+            logger.info(f"Сообщение {message_id} в чате {chat_id} нельзя изменить ({e}), отправляем новое")
+    
+    sent = await message.reply_text(
+        text=text,
+        reply_markup=reply_markup,
+        parse_mode=parse_mode
+    )
+    sent_messages.remember_sent(sent, content)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик команды /start"""
     user = update.effective_user
     welcome_text = MESSAGES['welcome'].format(name=user.first_name)
+    user_registry.touch(update.effective_chat.id, user)
     
     keyboard = get_main_menu_keyboard()
     logo_path = "assets/logo.png"
@@ -48,20 +105,22 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         await safe_edit_message(update, welcome_text, keyboard)
     else:
         # Если это команда /start, отправляем логотип с приветствием
-        if os.path.exists(logo_path):
-            with open(logo_path, 'rb') as logo_file:
-                await update.message.reply_photo(
-                    photo=logo_file,
-                    caption=welcome_text,
-                    reply_markup=keyboard,
-                    parse_mode='HTML'
-                )
+        # (файл загружается в Telegram один раз, дальше уходит по file_id)
+        if media_registry.exists(logo_path):
+            sent = await media_registry.reply_photo(
+                update.message,
+                logo_path,
+                caption=welcome_text,
+                reply_markup=keyboard,
+                parse_mode='HTML'
+            )
         else:
-            await update.message.reply_text(
+            sent = await update.message.reply_text(
                 text=welcome_text,
                 reply_markup=keyboard,
                 parse_mode='HTML'
             )
+        sent_messages.remember_sent(sent, content_hash(welcome_text, keyboard, 'HTML'))
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик команды /help"""
@@ -70,14 +129,86 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         parse_mode='HTML'
     )
 
+def _is_admin(update: Update) -> bool:
+    """Команда от администратора; остальным служебные команды не отвечают"""
+    if update.effective_user.id in ADMIN_USER_IDS:
+        return True
+    logger.warning(f"Служебная команда {update.message.text.split()[0]} от пользователя {update.effective_user.id}")
+    return False
+
+async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработчик команды /broadcast: рассылка всем пользователям (только для администраторов)"""
+    if not _is_admin(update):
+        return
+    
+    parts = update.message.text.split(maxsplit=1)
+    if len(parts) < 2:
+        await update.message.reply_text("Использование: /broadcast текст сообщения")
+        return
+    
+    status = await update.message.reply_text("📣 Рассылка запускается...")
+    broadcast_id = await broadcaster.create(parts[1], update.effective_chat.id, status.message_id)
+    logger.info(f"Администратор {update.effective_user.id} запустил рассылку #{broadcast_id}")
+
+async def reload_tariffs_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработчик команды /reload_tariffs: перечитать тарифы и показать изменения (только для администраторов)"""
+    if not _is_admin(update):
+        return
+    
+    try:
+        changes = await tariff_reloader.reload()
+    except TariffConfigError as e:
+        text = f"❌ <b>Тарифы не обновлены</b>, действует прежняя версия\n\n<pre>{html.escape(str(e)[:3500], quote=False)}</pre>"
+        await update.message.reply_text(text=text, parse_mode='HTML')
+        return
+    
+    if not changes:
+        await update.message.reply_text(f"Тарифы не изменились (версия {get_tariff_table().version})")
+        return
+    
+    lines = "\n".join(changes)
+    if len(lines) > 3500:
+        lines = lines[:3500] + "\n..."
+    text = (
+        f"✅ <b>Тарифы обновлены</b>, версия {get_tariff_table().version}\n\n"
+        f"<pre>{html.escape(lines, quote=False)}</pre>\n\n"
+        "Сообщить клиентам: /broadcast текст"
+    )
+    await update.message.reply_text(text=text, parse_mode='HTML')
+
+async def memory_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработчик команды /memory: память сессий пользователей (только для администраторов)"""
+    if not _is_admin(update):
+        return
+    
+    sessions = context.application.user_data
+    report = memory_report(sessions.values())
+    compact, legacy = report['compact_per_session'], report['dict_per_session']
+    saved = f", −{(1 - compact / legacy) * 100:.0f}%" if legacy else ""
+    if session_sweeper.evicting:
+        eviction = f"выгружено по простою: {session_sweeper.evicted} (через {session_sweeper.ttl / 60:.0f} мин)"
+    else:
+        eviction = "выгрузка по простою отключена"
+    if session_sweeper.running:
+        expiry = (f"Брошенных диалогов сброшено: {session_sweeper.expired}, "
+                  f"освобождено ~{session_sweeper.reclaimed_bytes / 1024:.0f} КБ")
+    else:
+        expiry = "Сброс брошенных диалогов отключен"
+    text = (
+        "🧠 <b>Сессии пользователей</b>\n\n"
+        f"В памяти: {len(sessions)}, {eviction}\n"
+        f"{expiry}\n"
+        f"Байт на сессию: {compact:.0f} (словарем user_data было бы {legacy:.0f}{saved})\n"
+        f"Всего: ~{len(sessions) * compact / 1024:.0f} КБ вместо ~{len(sessions) * legacy / 1024:.0f} КБ"
+    )
+    await update.message.reply_text(text=text, parse_mode='HTML')
+
 async def company_info(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Информация о компании"""
     query = update.callback_query
     await query.answer()
     
-    keyboard = InlineKeyboardMarkup([
-        [InlineKeyboardButton("🔙 Назад в меню", callback_data="main_menu")]
-    ])
+    keyboard = get_back_keyboard()
     
     await safe_edit_message(update, MESSAGES['company_info'], keyboard)
 
@@ -86,9 +217,7 @@ async def services_info(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     query = update.callback_query
     await query.answer()
     
-    keyboard = InlineKeyboardMarkup([
-        [InlineKeyboardButton("🔙 Назад в меню", callback_data="main_menu")]
-    ])
+    keyboard = get_back_keyboard()
     
     await safe_edit_message(update, MESSAGES['services_info'], keyboard)
 
@@ -97,9 +226,7 @@ async def advantages(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
     query = update.callback_query
     await query.answer()
     
-    keyboard = InlineKeyboardMarkup([
-        [InlineKeyboardButton("🔙 Назад в меню", callback_data="main_menu")]
-    ])
+    keyboard = get_back_keyboard()
     
     await safe_edit_message(update, MESSAGES['advantages'], keyboard)
 
@@ -141,15 +268,9 @@ async def handle_marketplace_choice(update: Update, context: ContextTypes.DEFAUL
     await query.answer()
     
     marketplace = query.data.replace("marketplace_", "")
-    context.user_data['marketplace'] = marketplace
+    context.user_data.marketplace = marketplace
     
-    marketplace_names = {
-        'wildberries': 'Wildberries',
-        'ozon': 'Ozon',
-        'yandex': 'Яндекс Маркет'
-    }
-    
-    text = MESSAGES['orders_count'].format(marketplace=marketplace_names.get(marketplace, marketplace))
+    text = MESSAGES['orders_count'].format(marketplace=MARKETPLACE_DISPLAY_NAMES.get(marketplace, marketplace))
     
     await safe_edit_message(update, text)
     
@@ -162,7 +283,7 @@ async def handle_orders_count(update: Update, context: ContextTypes.DEFAULT_TYPE
         if orders_count <= 0:
             raise ValueError()
         
-        context.user_data['orders_count'] = orders_count
+        context.user_data.orders_count = orders_count
         
         keyboard = get_services_keyboard()
         
@@ -186,17 +307,14 @@ async def handle_services_choice(update: Update, context: ContextTypes.DEFAULT_T
     await query.answer()
     
     if query.data == "service_calculate":
-        # Выполняем расчет
-        calculator = FulfillmentCalculator()
-        
-        marketplace = context.user_data.get('marketplace')
-        orders_count = context.user_data.get('orders_count')
-        selected_services = context.user_data.get('selected_services', [])
+        # Выполняем расчет (или берем готовый из кеша)
+        session = context.user_data
         
-        result = calculator.calculate(marketplace, orders_count, selected_services)
-        context.user_data['calculation_result'] = result
+        result, formatted_result = quote_cache.get_quote(session.marketplace, session.orders_count,
+                                                         session.selected_services)
+        # Храним только параметры расчета, сам расчет при необходимости берется из кеша
+        session.save_quote()
         
-        formatted_result = format_calculation_result(result, marketplace, orders_count, selected_services)
         keyboard = get_calculation_result_keyboard()
         
         await safe_edit_message(update, formatted_result, keyboard)
@@ -206,16 +324,9 @@ async def handle_services_choice(update: Update, context: ContextTypes.DEFAULT_T
     else:
         # Добавляем/убираем услугу из выбранных
         service = query.data.replace("service_", "")
-        selected_services = context.user_data.get('selected_services', [])
-        
-        if service in selected_services:
-            selected_services.remove(service)
-        else:
-            selected_services.append(service)
-        
-        context.user_data['selected_services'] = selected_services
+        context.user_data.toggle_service(service)
         
-        keyboard = get_services_keyboard(selected_services)
+        keyboard = get_services_keyboard(context.user_data.selected_services)
         
         await safe_edit_message(update, MESSAGES['services_choice'], keyboard)
         
@@ -258,7 +369,7 @@ async def handle_application_start(update: Update, context: ContextTypes.DEFAULT
 
 async def handle_application_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обработка имени заявителя"""
-    context.user_data['application_name'] = update.message.text
+    context.user_data.application_name = update.message.text
     
     await update.message.reply_text(
         text=MESSAGES['application_contact'],
@@ -269,7 +380,7 @@ async def handle_application_name(update: Update, context: ContextTypes.DEFAULT_
 
 async def handle_application_contact(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обработка контактных данных"""
-    context.user_data['application_contact'] = update.message.text
+    context.user_data.application_contact = update.message.text
     
     await update.message.reply_text(
         text=MESSAGES['application_description'],
@@ -280,18 +391,24 @@ async def handle_application_contact(update: Update, context: ContextTypes.DEFAU
 
 async def handle_application_description(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обработка описания потребностей"""
-    context.user_data['application_description'] = update.message.text
+    context.user_data.application_description = update.message.text
     
     await handle_application_complete(update, context)
     return ConversationHandler.END
 
 async def handle_application_complete(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Завершение подачи заявки"""
-    # Здесь можно добавить отправку заявки администратору или сохранение в базу данных
-    
-    keyboard = InlineKeyboardMarkup([
-        [InlineKeyboardButton("🔙 Главное меню", callback_data="main_menu")]
-    ])
+    # Заявка уходит в фоновую доставку; ключ из последнего сообщения не меняется при повторе обновления
+    lead_dispatcher.submit(make_lead(
+        key=f"{update.effective_chat.id}:{update.message.message_id}",
+        user=update.effective_user,
+        name=context.user_data.application_name,
+        contact=context.user_data.application_contact,
+        description=context.user_data.application_description,
+        last_quote=context.user_data.last_quote
+    ))
+    
+    keyboard = get_back_keyboard('main_menu')
     
     await update.message.reply_text(
         text=MESSAGES['application_complete'],
@@ -334,39 +451,48 @@ async def handle_ai_ask_question(update: Update, context: ContextTypes.DEFAULT_T
 async def handle_ai_question(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обработка вопроса пользователя к AI"""
     user_message = update.message.text
-    
-    # Показываем, что бот печатает
-    await update.message.chat.send_action(action="typing")
+    started = time.perf_counter()
     
     try:
-        # Инициализируем AI-помощника
-        ai_assistant = AIAssistant()
+        # Создаем клавиатуру для продолжения
+        keyboard = get_ai_answer_keyboard()
+        
+        # Типовые вопросы (цены, комиссии, скидки, контакты) отвечаем по шаблону без GPT
+        fast_answer = intent_router.answer(user_message)
+        if fast_answer is not None:
+            await update.message.reply_text(
+                text=AI_ANSWER_HEADER + fast_answer.strip(),
+                reply_markup=keyboard,
+                parse_mode='HTML'
+            )
+            ai_first_text_latency.observe(time.perf_counter() - started)
+            return AI_CHAT
+        
+        # Общий AI-помощник, созданный при запуске бота
+        ai_assistant = get_ai_assistant()
         
         # Получаем контекст пользователя (последний расчет)
         user_context = {}
-        if 'calculation_result' in context.user_data:
-            user_context['last_calculation'] = context.user_data['calculation_result']
+        if context.user_data.last_quote:
+            marketplace, orders_count, selected_services = context.user_data.last_quote
+            user_context['last_calculation'] = quote_cache.get_quote(marketplace, orders_count, selected_services)[0]
+        
+        if AI_STREAMING:
+            await _stream_ai_answer(update, ai_assistant, user_message, user_context, keyboard, started)
+            return AI_CHAT
+        
+        # Показываем, что бот печатает
+        await update.message.chat.send_action(action="typing")
         
         # Получаем ответ от AI
         ai_response = await ai_assistant.get_response(user_message, user_context)
         
-        # Создаем клавиатуру для продолжения
-        keyboard = InlineKeyboardMarkup([
-            [
-                InlineKeyboardButton("🧮 Калькулятор", callback_data="calculator"),
-                InlineKeyboardButton("📝 Подать заявку", callback_data="application")
-            ],
-            [
-                InlineKeyboardButton("❓ Еще вопрос", callback_data="ai_ask_question"),
-                InlineKeyboardButton("🔙 Главное меню", callback_data="main_menu")
-            ]
-        ])
-        
         await update.message.reply_text(
-            text=f"🤖 <b>AI-консультант отвечает:</b>\n\n{ai_response}",
+            text=AI_ANSWER_HEADER + sanitize_html(ai_response),
             reply_markup=keyboard,
             parse_mode='HTML'
         )
+        ai_first_text_latency.observe(time.perf_counter() - started)
         
         return AI_CHAT
         
@@ -383,3 +509,48 @@ async def handle_ai_question(update: Update, context: ContextTypes.DEFAULT_TYPE)
         )
         
         return AI_CHAT
+
+async def _stream_ai_answer(update: Update, ai_assistant, user_message: str, user_context: dict,
+                            keyboard: InlineKeyboardMarkup, started: float) -> None:
+    """Потоковый ответ AI: заглушка и ее периодическое редактирование по мере генерации"""
+    placeholder = await update.message.reply_text(
+        text=AI_ANSWER_HEADER + "<i>Печатает…</i>",
+        parse_mode='HTML'
+    )
+    
+    answer = ""
+    shown_length = 0
+    last_edit = time.perf_counter()
+    
+    async for fragment in ai_assistant.stream_response(user_message, user_context):
+        answer += fragment
+        now = time.perf_counter()
+        # Первый фрагмент показываем сразу, дальше правим раз в интервал или после
+        # AI_STREAM_EDIT_CHARS новых символов, но не чаще лимита отправок в чат
+        since_edit = now - last_edit
+        if shown_length and (since_edit < AI_STREAM_MIN_EDIT_INTERVAL or (
+                since_edit < AI_STREAM_EDIT_INTERVAL and len(answer) - shown_length < AI_STREAM_EDIT_CHARS)):
+            continue
+        
+        try:
+            await placeholder.edit_text(
+                text=AI_ANSWER_HEADER + html.escape(answer, quote=False) + " ▌",
+                parse_mode='HTML'
+            )
+        except BadRequest as e:
+            logger.debug(f"Промежуточная правка ответа AI не удалась: {e}")
+        
+        if not shown_length:
+            ai_first_text_latency.observe(time.perf_counter() - started)
+        shown_length = len(answer)
+        last_edit = time.perf_counter()
+    
+    # Финальная правка с HTML-разметкой и клавиатурой
+    await placeholder.edit_text(
+        text=AI_ANSWER_HEADER + sanitize_html(answer),
+        reply_markup=keyboard,
+        parse_mode='HTML'
+    )
+    if not shown_length:
+        ai_first_text_latency.observe(time.perf_counter() - started)
+    logger.debug(ai_first_text_latency.summary())
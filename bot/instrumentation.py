@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+
+"""
+Подключение метрик к приложению и эндпоинты /metrics, /healthz, /readyz
+
+instrument_application оборачивает колбэки всех обработчиков, в том
+числе внутри ConversationHandler, и добавляет сборщики, которые при
+запросе /metrics снимают счетчики кешей, быстрых ответов AI, ограничителя отправок,
+очереди заявок, сессий, лимитов пользователей и число диалогов в каждом состоянии из
+bot/states.py.
+
+Эндпоинты обслуживает небольшое приложение aiohttp на отдельном
+локальном порту (METRICS_PORT), в режимах polling и webhook одинаково.
+"""
+
+import functools
+import logging
+import time
+
+from telegram.ext import Application, ConversationHandler
+
+try:
+    from aiohttp import web
+except ImportError:  # aiohttp нужен только для HTTP-эндпоинтов метрик и проверок
+    web = None
+
+import bot.states as states
+import bot.ai_assistant as ai_assistant_module
+from bot.intent_router import intent_router
+from bot.leads import lead_dispatcher
+from bot.message_tracker import sent_messages
+from bot.metrics import MetricsRegistry, metrics, handler_seconds, handler_errors
+from bot.quote_cache import quote_cache
+from bot.session import session_sweeper
+from bot.throttle import user_throttle
+
+logger = logging.getLogger(__name__)
+
+# Имена состояний диалогов по их номерам
+STATE_NAMES = {value: name for name, value in vars(states).items() if name.isupper() and isinstance(value, int)}
+
+
+def instrument_callback(callback, name: str):
+    """Колбэк обработчика с учетом времени работы и исключений"""
+    if getattr(callback, 'instrumented', False):
+        return callback
+    latency = handler_seconds.labels(name)
+    errors = handler_errors.labels(name)
+    perf_counter = time.perf_counter
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            latency.observe(perf_counter() - started)
+
+    wrapper.instrumented = True
+    return wrapper
+
+
+def _conversation_children(conversation: ConversationHandler) -> list:
+    children = list(conversation.entry_points) + list(conversation.fallbacks)
+    for handlers in conversation.states.values():
+        children.extend(handlers)
+    return children
+
+
+def instrument_application(application: Application, registry: MetricsRegistry = metrics) -> None:
+    """Метрики для всех зарегистрированных обработчиков и сборщики состояния бота"""
+    conversations = []
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if isinstance(handler, ConversationHandler):
+                conversations.append(handler)
+                for child in _conversation_children(handler):
+                    child.callback = instrument_callback(child.callback, f"{handler.name}/{child.callback.__name__}")
+            else:
+                handler.callback = instrument_callback(handler.callback, handler.callback.__name__)
+
+    registry.set_collector('conversations', functools.partial(collect_conversations, conversations))
+    registry.set_collector('caches', collect_caches)
+    registry.set_collector('rate_limiter', functools.partial(collect_rate_limiter, application))
+    registry.set_collector('leads', collect_delivery)
+    registry.set_collector('sessions', functools.partial(collect_sessions, application))
+    registry.set_collector('user_throttle', collect_user_throttle)
+    registry.set_collector('ai_fast_path', collect_ai_fast_path)
+
+
+def collect_conversations(conversations: list) -> list:
+    """Число активных диалогов в каждом состоянии"""
+    values = []
+    for conversation in conversations:
+        counts = dict.fromkeys(conversation.states, 0)
+        # Публичного доступа к текущим диалогам у ConversationHandler нет
+        for state in conversation._conversations.values():
+            if state in counts:
+                counts[state] += 1
+        for state, count in counts.items():
+            values.append(({'conversation': conversation.name, 'state': STATE_NAMES.get(state, state)}, count))
+    return [("bot_conversations_active", "gauge", "Диалоги в каждом состоянии", values)]
+
+
+def collect_caches() -> list:
+    """Попадания в кеши расчетов и ответов AI"""
+    caches = {'quote': quote_cache.stats()}
+    # Только уже созданный AI-помощник: сбор метрик не должен создавать клиент OpenAI
+    assistant = ai_assistant_module._ai_assistant
+    if assistant is not None:
+        caches['ai_answer'] = assistant.answer_cache.stats()
+    return [
+        ("bot_cache_hits_total", "counter", "Попадания в кеш",
+         [({'cache': name}, stats['hits']) for name, stats in caches.items()]),
+        ("bot_cache_misses_total", "counter", "Промахи кеша",
+         [({'cache': name}, stats['misses']) for name, stats in caches.items()]),
+        ("bot_cache_hit_ratio", "gauge", "Доля попаданий в кеш",
+         [({'cache': name}, stats['hit_ratio']) for name, stats in caches.items()]),
+        ("bot_cache_entries", "gauge", "Записей в кеше",
+         [({'cache': name}, stats['size']) for name, stats in caches.items()]),
+        ("bot_edits_skipped_total", "counter", "Правок сообщений, пропущенных как не меняющих сообщение",
+         [({}, sent_messages.skipped)]),
+    ]
+
+
+def collect_ai_fast_path() -> list:
+    """Вопросы к AI-консультанту, отвеченные по шаблону без GPT"""
+    stats = intent_router.stats()
+    return [
+        ("bot_ai_questions_total", "counter", "Вопросов к AI-консультанту", [({}, stats['total'])]),
+        ("bot_ai_fast_answers_total", "counter", "Ответов по шаблону без GPT",
+         [({'intent': intent}, count) for intent, count in stats['by_intent'].items()]),
+        ("bot_ai_fast_share", "gauge", "Доля вопросов, отвеченных без GPT", [({}, stats['fast_share'])]),
+    ]
+
+
+def collect_rate_limiter(application: Application) -> list:
+    """Счетчики ограничителя отправок, если он поддерживает stats()"""
+    rate_limiter = application.bot.rate_limiter
+    if not hasattr(rate_limiter, 'stats'):
+        return []
+    stats = rate_limiter.stats()
+    return [
+        ("bot_rate_limiter_sent_total", "counter", "Отправок через ограничитель", [({}, stats['sent'])]),
+        ("bot_rate_limiter_throttled_total", "counter", "Отправок, ждавших очереди", [({}, stats['throttled'])]),
+        ("bot_rate_limiter_retry_after_total", "counter", "Ответов 429 от Telegram", [({}, stats['retry_after'])]),
+        ("bot_rate_limiter_queued", "gauge", "Отправок в очереди по полосам",
+         [({'lane': lane}, count) for lane, count in stats['queued'].items()]),
+        ("bot_rate_limiter_paused_seconds", "gauge", "Оставшаяся пауза после RetryAfter", [({}, stats['paused_for'])]),
+    ]
+
+
+def collect_delivery() -> list:
+    """Доставки заявок по приемникам и состояниям"""
+    values = [
+        ({'sink': sink, 'state': state}, count)
+        for sink, counts in lead_dispatcher.stats().items()
+        for state, count in counts.items()
+    ]
+    return [("bot_leads", "gauge", "Доставки заявок по приемникам", values)]
+
+
+def collect_sessions(application: Application) -> list:
+    """Сессии пользователей в памяти, выгруженные по простою и сброшенные брошенные диалоги"""
+    return [
+        ("bot_sessions_in_memory", "gauge", "Сессий пользователей в памяти", [({}, len(application.user_data))]),
+        ("bot_sessions_evicted_total", "counter", "Сессий, выгруженных из памяти по простою",
+         [({}, session_sweeper.evicted)]),
+        ("bot_conversations_expired_total", "counter", "Диалогов, сброшенных по таймауту",
+         [({}, session_sweeper.expired)]),
+        ("bot_sessions_reclaimed_bytes_total", "counter", "Байт памяти, освобожденных при сбросе диалогов",
+         [({}, session_sweeper.reclaimed_bytes)]),
+    ]
+
+
+def collect_user_throttle() -> list:
+    """Отклоненные запросы пользователей по классам действий"""
+    return [
+        ("bot_user_requests_rejected_total", "counter", "Запросов, отклоненных лимитом частоты пользователя",
+         [({'action': action}, count) for action, count in user_throttle.rejected.items()]),
+        ("bot_user_rate_warnings_total", "counter", "Отправленных сообщений об ограничении",
+         [({}, user_throttle.warned)]),
+        ("bot_user_rate_tracked", "gauge", "Пользователей с недавними запросами",
+         [({'action': action}, count) for action, count in user_throttle.tracked().items()]),
+    ]
+
+
+class MetricsServer:
+    """
+    Отдельный локальный HTTP-сервер: GET /metrics, /healthz и /readyz
+
+    /healthz отвечает, пока процесс жив; /readyz - 200, только когда
+    приложение запущено и получает обновления (polling или вебхук).
+    """
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self, registry: MetricsRegistry = metrics):
+        self.registry = registry
+        self.application = None
+        self._runner = None
+
+    @property
+    def port(self) -> int:
+        return self._runner.addresses[0][1] if self._runner else None
+
+    async def start(self, listen: str, port: int, application: Application = None) -> None:
+        if web is None:
+            logger.warning("aiohttp не установлен, эндпоинты /metrics, /healthz и /readyz выключены")
+            return
+        self.application = application
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle_metrics)
+        app.router.add_get("/healthz", self.handle_health)
+        app.router.add_get("/readyz", self.handle_ready)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, listen, port).start()
+        logger.info(f"Метрики и проверки доступны на http://{listen}:{self.port}")
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def ready(self) -> bool:
+        application = self.application
+        if application is None or not application.running:
+            return False
+        # Updater нет только у приложения, которому обновления передают напрямую
+        return application.updater is None or application.updater.running
+
+    async def handle_metrics(self, request):
+        return web.Response(body=self.registry.render().encode("utf-8"), headers={"Content-Type": self.CONTENT_TYPE})
+
+    async def handle_health(self, request):
+        return web.Response(text="ok")
+
+    async def handle_ready(self, request):
+        if self.ready():
+            return web.Response(text="ready")
+        return web.Response(status=503, text="not ready")
+
+
+# Общий сервер метрик; запускается из post_init, если задан METRICS_PORT
+metrics_server = MetricsServer()
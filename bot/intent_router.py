@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+
+"""
+Быстрые ответы на типовые вопросы без обращения к AI
+
+Вопросы о ценах услуг, комиссиях маркетплейсов, скидках и контактах
+распознаются одним скомпилированным регулярным выражением и получают
+ответ прямо из текущей таблицы тарифов и шаблонов bot/messages.py.
+Открытые вопросы уходят в GPT.
+"""
+
+import logging
+import re
+
+from bot.messages import MESSAGES
+from bot.tariff_engine import get_tariff_table
+from config.settings import AI_FAST_PATH_THRESHOLD
+from utils.formatters import format_rate
+
+logger = logging.getLogger(__name__)
+
+# (тип, значение) -> фрагменты регулярного выражения; все совпадают с начала слова
+KEYWORDS = {
+    ('intent', 'price'): ['сколько сто', 'стоимост', 'цен[аыу]', 'поч[её]м\\b', 'прайс', 'тариф'],
+    ('intent', 'commission'): ['комисси'],
+    ('intent', 'discount'): ['скидк'],
+    # 'почт' без окончания совпало бы с "почти", 'номер' - с "номер заказа"
+    ('intent', 'contacts'): ['контакт', 'телефон', 'номер (?:телефона|для связи)', 'e-?mail',
+                             'почт(?:а|ы|е|у|ой)\\b', 'связаться',
+                             'позвонить', 'режим работы', 'график работы', 'часы работы'],
+    ('service', 'storage'): ['хранени', 'хранит'],
+    ('service', 'packaging'): ['упаков'],
+    ('service', 'shipping'): ['отправк', 'отгруз'],
+    ('service', 'returns'): ['возврат'],
+    ('service', 'labeling'): ['маркиров', 'этикет', 'штрих'],
+    ('service', 'quality_control'): ['контрол[ьяе] качеств', 'брак'],
+    ('service', 'photo'): ['фото', 'съ[её]мк'],
+    ('service', 'analytics'): ['аналитик', 'отч[её]т'],
+    ('marketplace', 'wildberries'): ['wildberries', 'вайлдберриз', 'wb\\b', 'вб\\b'],
+    ('marketplace', 'ozon'): ['ozon', 'озон'],
+    ('marketplace', 'yandex'): ['яндекс', 'yandex'],
+    # Прочие слова о работе фулфилмента: вопрос по теме, но без готового шаблона
+    ('topic', 'fulfillment'): ['фулфилмент', 'склад', 'доставк', 'маркет', 'услуг', 'сколько', 'качеств',
+                               'расч[её]т', 'калькулятор'],
+    # Признаки открытого вопроса, на который нужен развернутый ответ
+    ('open', 'open'): ['почему', 'посовету', 'порекоменду', 'сравни', 'разниц', 'лучше',
+                       'выбрать', 'зачем', 'объясни', 'если', 'стоит ли'],
+}
+
+# Уверенность для однозначного вопроса по каждому намерению
+_BASE_CONFIDENCE = {
+    'price': 0.9,
+    'commission': 0.9,
+    'discount': 0.9,
+    'contacts': 0.9,
+}
+
+
+def _compile_keywords() -> tuple:
+    """Одно регулярное выражение по всем ключевым словам с именованными группами"""
+    groups = []
+    alternatives = []
+    for index, (kind_value, patterns) in enumerate(KEYWORDS.items()):
+        groups.append(kind_value)
+        alternatives.append(f"(?P<k{index}>{'|'.join(patterns)})")
+    pattern = re.compile(r"(?<!\w)(?:" + "|".join(alternatives) + ")", re.IGNORECASE)
+    return pattern, groups
+
+
+_KEYWORDS_RE, _KEYWORD_GROUPS = _compile_keywords()
+
+
+def _find_keywords(message: str) -> dict:
+    """Найденные значения по типам ключевых слов"""
+    found = {'intent': set(), 'service': set(), 'marketplace': set(), 'topic': set(), 'open': set()}
+    for match in _KEYWORDS_RE.finditer(message):
+        kind, value = _KEYWORD_GROUPS[int(match.lastgroup[1:])]
+        found[kind].add(value)
+    return found
+
+
+def _about_services(found: dict) -> bool:
+    """Вопрос об услугах: есть ключевое слово по теме, а не только признаки открытого вопроса"""
+    return any(values for kind, values in found.items() if kind != 'open')
+
+
+class IntentRouter:
+    """Маршрутизатор вопросов: быстрый шаблонный ответ или GPT"""
+
+    def __init__(self, threshold: float = None):
+        self.threshold = AI_FAST_PATH_THRESHOLD if threshold is None else threshold
+        self.total = 0
+        self.fast = 0
+        self.by_intent = {}
+
+    def classify(self, message: str) -> dict:
+        """
+        Определение намерения и его уверенности
+
+        Returns:
+            dict: intent, confidence и найденные услуги/маркетплейсы
+        """
+        found = _find_keywords(message)
+        result = {
+            'intent': None,
+            'confidence': 0.0,
+            'services': found['service'],
+            'marketplaces': found['marketplace']
+        }
+        if not _about_services(found):
+            # Вопрос не об услугах - шаблонного ответа нет
+            return result
+        if len(found['intent']) != 1:
+            # Нет намерения или вопрос сразу о нескольких вещах
+            return result
+
+        intent = next(iter(found['intent']))
+        confidence = _BASE_CONFIDENCE[intent]
+        if intent == 'price' and not found['service']:
+            confidence -= 0.3  # "Сколько стоят ваши услуги" - лучше ответит GPT
+        if intent == 'commission' and not found['marketplace']:
+            confidence -= 0.1
+        if found['open']:
+            confidence -= 0.3
+        if any(char.isdigit() for char in message):
+            confidence -= 0.2  # Конкретные объемы требуют расчета
+        if len(message.split()) > 12:
+            confidence -= 0.2
+
+        result['intent'] = intent
+        result['confidence'] = round(confidence, 2)
+        return result
+
+    def answer(self, message: str):
+        """Готовый ответ, если вопрос типовой и уверенность выше порога, иначе None"""
+        self.total += 1
+        match = self.classify(message)
+        if match['intent'] is None or match['confidence'] < self.threshold:
+            return None
+
+        self.fast += 1
+        self.by_intent[match['intent']] = self.by_intent.get(match['intent'], 0) + 1
+        return _RENDERERS[match['intent']](match)
+
+    @property
+    def fast_share(self) -> float:
+        """Доля вопросов, обработанных без GPT"""
+        return self.fast / self.total if self.total else 0.0
+
+    def stats(self) -> dict:
+        return {
+            'total': self.total,
+            'fast': self.fast,
+            'fast_share': self.fast_share,
+            'by_intent': dict(self.by_intent)
+        }
+
+
+def _render_prices(match: dict) -> str:
+    lines = []
+    for code, tariff in get_tariff_table().config.services.items():
+        if code not in match['services']:
+            continue
+        line = f"• <b>{tariff['name']}</b>: {format_rate(tariff['rate'], tariff['rate_type'])}"
+        if tariff.get('min_rate'):
+            line += f" (минимум {tariff['min_rate']} руб/месяц)"
+        lines.append(line)
+    return MESSAGES['fast_prices'].format(services="\n".join(lines))
+
+
+def _render_commissions(match: dict) -> str:
+    marketplace_tariffs = get_tariff_table().config.marketplaces
+    marketplaces = match['marketplaces'] or marketplace_tariffs.keys()
+    lines = [
+        f"• <b>{tariff['name']}</b>: {tariff['commission_rate'] * 100:g}% "
+        f"(средний чек {tariff['average_order_value']:,} руб)"
+        for code, tariff in marketplace_tariffs.items() if code in marketplaces
+    ]
+    return MESSAGES['fast_commissions'].format(marketplaces="\n".join(lines))
+
+
+def _render_discounts(match: dict) -> str:
+    lines = [
+        f"• От {threshold:,} заказов/месяц: скидка {discount * 100:g}%"
+        for threshold, discount in get_tariff_table().discounts.tiers
+    ]
+    return MESSAGES['fast_discounts'].format(tiers="\n".join(lines))
+
+
+def _render_contacts(match: dict) -> str:
+    return MESSAGES['fast_contacts']
+
+
+_RENDERERS = {
+    'price': _render_prices,
+    'commission': _render_commissions,
+    'discount': _render_discounts,
+    'contacts': _render_contacts,
+}
+
+# Общий маршрутизатор; счетчики копятся за все время работы бота
+intent_router = IntentRouter()
@@ -1,103 +1,141 @@
 # -*- coding: utf-8 -*-
 
+"""
+Инлайн-клавиатуры бота
+
+Объекты клавиатур в python-telegram-bot неизменяемы, поэтому статические
+клавиатуры создаются один раз при импорте и переиспользуются. Варианты
+клавиатуры услуг строятся лениво и кэшируются по битовой маске выбора.
+"""
+
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
+from bot.calculator import services_to_mask
+
+# Услуги в порядке вывода на клавиатуре
+SERVICES = (
+    ('packaging', '📮 Упаковка'),
+    ('shipping', '🚚 Отгрузка'),
+    ('returns', '↩️ Обработка возвратов'),
+    ('labeling', '🏷 Маркировка'),
+    ('quality_control', '✅ Контроль качества'),
+    ('photo', '📸 Фотосъемка товаров'),
+    ('analytics', '📊 Аналитика и отчеты')
+)
+
+# Клавиатуры "назад": 'back' - "Назад в меню", 'main_menu' - "Главное меню"
+BACK_KEYBOARDS = {
+    'back': InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад в меню", callback_data="main_menu")]]),
+    'main_menu': InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Главное меню", callback_data="main_menu")]]),
+}
+
+_MAIN_MENU_KEYBOARD = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("🧮 Калькулятор стоимости", callback_data="calculator"),
+        InlineKeyboardButton("📝 Подать заявку", callback_data="application")
+    ],
+    [
+        InlineKeyboardButton("🏢 О компании", callback_data="company_info"),
+        InlineKeyboardButton("🛠 Наши услуги", callback_data="services")
+    ],
+    [
+        InlineKeyboardButton("⭐ Преимущества", callback_data="advantages"),
+        InlineKeyboardButton("🤖 AI-консультант", callback_data="ai_chat")
+    ]
+])
+
+_MARKETPLACE_KEYBOARD = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("🛍 Wildberries", callback_data="marketplace_wildberries"),
+        InlineKeyboardButton("📦 Ozon", callback_data="marketplace_ozon")
+    ],
+    [
+        InlineKeyboardButton("🟡 Яндекс Маркет", callback_data="marketplace_yandex")
+    ],
+    BACK_KEYBOARDS['back'].inline_keyboard[0]
+])
+
+_CALCULATION_RESULT_KEYBOARD = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("🔄 Новый расчет", callback_data="calc_new"),
+        InlineKeyboardButton("📝 Подать заявку", callback_data="calc_application")
+    ],
+    BACK_KEYBOARDS['main_menu'].inline_keyboard[0]
+])
+
+_AI_CHAT_KEYBOARD = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("❓ Задать вопрос", callback_data="ai_ask_question"),
+        InlineKeyboardButton("💡 Примеры вопросов", callback_data="ai_examples")
+    ],
+    BACK_KEYBOARDS['main_menu'].inline_keyboard[0]
+])
+
+_AI_ANSWER_KEYBOARD = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("🧮 Калькулятор", callback_data="calculator"),
+        InlineKeyboardButton("📝 Подать заявку", callback_data="application")
+    ],
+    [
+        InlineKeyboardButton("❓ Еще вопрос", callback_data="ai_ask_question"),
+        InlineKeyboardButton("🔙 Главное меню", callback_data="main_menu")
+    ]
+])
+
+# Битовая маска выбранных услуг (services_to_mask) -> клавиатура; не более 2^len(SERVICES) вариантов
+_services_keyboards = {}
+
 def get_main_menu_keyboard() -> InlineKeyboardMarkup:
     """Главное меню бота"""
-    keyboard = [
-        [
-            InlineKeyboardButton("🧮 Калькулятор стоимости", callback_data="calculator"),
-            InlineKeyboardButton("📝 Подать заявку", callback_data="application")
-        ],
-        [
-            InlineKeyboardButton("🏢 О компании", callback_data="company_info"),
-            InlineKeyboardButton("🛠 Наши услуги", callback_data="services")
-        ],
-        [
-            InlineKeyboardButton("⭐ Преимущества", callback_data="advantages"),
-            InlineKeyboardButton("🤖 AI-консультант", callback_data="ai_chat")
-        ]
-    ]
-    return InlineKeyboardMarkup(keyboard)
+    return _MAIN_MENU_KEYBOARD
+
+def get_back_keyboard(kind: str = 'back') -> InlineKeyboardMarkup:
+    """Клавиатура с единственной кнопкой возврата в меню"""
+    return BACK_KEYBOARDS[kind]
 
 def get_marketplace_keyboard() -> InlineKeyboardMarkup:
     """Клавиатура выбора маркетплейса"""
-    keyboard = [
-        [
-            InlineKeyboardButton("🛍 Wildberries", callback_data="marketplace_wildberries"),
-            InlineKeyboardButton("📦 Ozon", callback_data="marketplace_ozon")
-        ],
-        [
-            InlineKeyboardButton("🟡 Яндекс Маркет", callback_data="marketplace_yandex")
-        ],
-        [
-            InlineKeyboardButton("🔙 Назад в меню", callback_data="main_menu")
-        ]
-    ]
-    return InlineKeyboardMarkup(keyboard)
+    return _MARKETPLACE_KEYBOARD
 
-def get_services_keyboard(selected_services: list = None) -> InlineKeyboardMarkup:
-    """Клавиатура выбора услуг"""
-    if selected_services is None:
-        selected_services = []
-    
-    services = [
-        ('packaging', '📮 Упаковка'),
-        ('shipping', '🚚 Отгрузка'),
-        ('returns', '↩️ Обработка возвратов'),
-        ('labeling', '🏷 Маркировка'),
-        ('quality_control', '✅ Контроль качества'),
-        ('photo', '📸 Фотосъемка товаров'),
-        ('analytics', '📊 Аналитика и отчеты')
-    ]
-    
+def _build_services_keyboard(mask: int) -> InlineKeyboardMarkup:
     keyboard = []
-    
+
     # Добавляем услуги по 2 в ряд
-    for i in range(0, len(services), 2):
+    for i in range(0, len(SERVICES), 2):
         row = []
-        for j in range(2):
-            if i + j < len(services):
-                service_code, service_name = services[i + j]
-                
-                # Добавляем галочку если услуга выбрана
-                if service_code in selected_services:
-                    service_name = f"✅ {service_name}"
-                
-                row.append(InlineKeyboardButton(service_name, callback_data=f"service_{service_code}"))
-        
+        for service_code, service_name in SERVICES[i:i + 2]:
+            # Добавляем галочку если услуга выбрана
+            if mask & services_to_mask([service_code]):
+                service_name = f"✅ {service_name}"
+
+            row.append(InlineKeyboardButton(service_name, callback_data=f"service_{service_code}"))
+
         keyboard.append(row)
-    
+
     # Кнопка расчета (активна только если выбрана хотя бы одна услуга)
-    if selected_services:
+    if mask:
         keyboard.append([InlineKeyboardButton("💰 Рассчитать стоимость", callback_data="service_calculate")])
-    
-    keyboard.append([InlineKeyboardButton("🔙 Назад в меню", callback_data="main_menu")])
-    
+
+    keyboard.append(BACK_KEYBOARDS['back'].inline_keyboard[0])
+
     return InlineKeyboardMarkup(keyboard)
 
+def get_services_keyboard(selected_services: list = None) -> InlineKeyboardMarkup:
+    """Клавиатура выбора услуг"""
+    mask = services_to_mask(selected_services or ())
+    keyboard = _services_keyboards.get(mask)
+    if keyboard is None:
+        keyboard = _services_keyboards[mask] = _build_services_keyboard(mask)
+    return keyboard
+
 def get_calculation_result_keyboard() -> InlineKeyboardMarkup:
     """Клавиатура для результата расчета"""
-    keyboard = [
-        [
-            InlineKeyboardButton("🔄 Новый расчет", callback_data="calc_new"),
-            InlineKeyboardButton("📝 Подать заявку", callback_data="calc_application")
-        ],
-        [
-            InlineKeyboardButton("🔙 Главное меню", callback_data="main_menu")
-        ]
-    ]
-    return InlineKeyboardMarkup(keyboard)
+    return _CALCULATION_RESULT_KEYBOARD
 
 def get_ai_chat_keyboard() -> InlineKeyboardMarkup:
     """Клавиатура для AI-чата"""
-    keyboard = [
-        [
-            InlineKeyboardButton("❓ Задать вопрос", callback_data="ai_ask_question"),
-            InlineKeyboardButton("💡 Примеры вопросов", callback_data="ai_examples")
-        ],
-        [
-            InlineKeyboardButton("🔙 Главное меню", callback_data="main_menu")
-        ]
-    ]
-    return InlineKeyboardMarkup(keyboard)
+    return _AI_CHAT_KEYBOARD
+
+def get_ai_answer_keyboard() -> InlineKeyboardMarkup:
+    """Клавиатура под ответом AI-консультанта"""
+    return _AI_ANSWER_KEYBOARD
@@ -0,0 +1,444 @@
+# -*- coding: utf-8 -*-
+
+"""
+Доставка заявок клиентов
+
+Обработчик заявки только кладет ее в очередь в памяти и сразу отвечает
+пользователю. Фоновый диспетчер записывает заявки в журнал SQLite
+(outbox) и пачками доставляет их в настроенные приемники: чат
+администратора в Telegram, вебхук CRM и почтовую папку. Неудачные
+доставки повторяются с экспоненциальной задержкой, недоставленное
+после перезапуска отправляется заново.
+
+Доставка "хотя бы один раз": у каждой заявки есть ключ идемпотентности,
+по которому приемник может отбросить повтор.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import sqlite3
+import time
+from email.message import EmailMessage
+from email.utils import formatdate
+
+import httpx
+from telegram import Bot
+
+from bot.rate_limiter import BULK, lane_kwargs
+from config.settings import (
+    LEADS_DB, LEADS_BATCH_SIZE, LEADS_FLUSH_INTERVAL, LEADS_MAX_ATTEMPTS, LEADS_RETRY_BASE, LEADS_RETRY_MAX,
+    LEADS_ADMIN_CHAT_ID, LEADS_WEBHOOK_URL, LEADS_WEBHOOK_TOKEN, LEADS_EMAIL_SPOOL, LEADS_EMAIL_TO
+)
+from utils.formatters import sanitize_html
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS leads (key TEXT PRIMARY KEY, created_at REAL NOT NULL, payload TEXT NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS deliveries ("
+    "key TEXT NOT NULL, sink TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, "
+    "next_attempt REAL NOT NULL DEFAULT 0, delivered_at REAL, error TEXT, PRIMARY KEY (key, sink))",
+    "CREATE INDEX IF NOT EXISTS deliveries_due ON deliveries (sink, delivered_at, next_attempt)",
+)
+
+# Максимальная длина сообщения Telegram с запасом на заголовок
+_TELEGRAM_TEXT_LIMIT = 3900
+# Описание длиннее обрезается, чтобы заявка поместилась в одно сообщение
+_TELEGRAM_DESCRIPTION_LIMIT = 3000
+# Имя и контакт длиннее обрезаются: вместе с описанием заявка всегда короче _TELEGRAM_TEXT_LIMIT
+_TELEGRAM_FIELD_LIMIT = 200
+
+
+def make_lead(key: str, user, name: str, contact: str, description: str, last_quote: list = None) -> dict:
+    """Заявка в виде словаря для журнала и приемников"""
+    lead = {
+        'key': key,
+        'created_at': time.time(),
+        'user_id': user.id if user else None,
+        'username': user.username if user else None,
+        'name': name,
+        'contact': contact,
+        'description': description,
+    }
+    if last_quote:
+        lead['last_quote'] = last_quote
+    return lead
+
+
+class LeadDeliveryError(Exception):
+    """Ошибка доставки; delivered - ключи заявок, которые все же доставлены"""
+
+    def __init__(self, message: str, delivered: tuple = ()):
+        super().__init__(message)
+        self.delivered = delivered
+
+
+class LeadOutbox:
+    """
+    Журнал заявок и их доставок в SQLite
+
+    leads - сами заявки, deliveries - состояние доставки каждой заявки
+    в каждый приемник. Повторная запись заявки с тем же ключом игнорируется.
+    """
+
+    def __init__(self, db_path: str):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db_path = db_path
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        for statement in _SCHEMA:
+            self._db.execute(statement)
+        self._db.commit()
+
+    def close(self) -> None:
+        self._db.close()
+
+    def append(self, leads: list, sinks: list) -> None:
+        with self._db:
+            self._db.executemany(
+                "INSERT OR IGNORE INTO leads VALUES (?, ?, ?)",
+                [(lead['key'], lead['created_at'], json.dumps(lead, ensure_ascii=False, separators=(',', ':')))
+                 for lead in leads]
+            )
+            self._db.executemany(
+                "INSERT OR IGNORE INTO deliveries (key, sink) VALUES (?, ?)",
+                [(lead['key'], sink) for lead in leads for sink in sinks]
+            )
+
+    def due(self, sink: str, now: float, limit: int, max_attempts: int) -> list:
+        """Заявки, которые пора доставить в приемник: [(заявка, число попыток)]"""
+        rows = self._db.execute(
+            "SELECT l.payload, d.attempts FROM deliveries d JOIN leads l ON l.key = d.key "
+            "WHERE d.sink = ? AND d.delivered_at IS NULL AND d.next_attempt <= ? AND d.attempts < ? "
+            "ORDER BY l.created_at LIMIT ?",
+            (sink, now, max_attempts, limit)
+        ).fetchall()
+        return [(json.loads(payload), attempts) for payload, attempts in rows]
+
+    def mark_delivered(self, sink: str, keys: list, now: float) -> None:
+        with self._db:
+            self._db.executemany(
+                "UPDATE deliveries SET delivered_at = ?, attempts = attempts + 1, error = NULL "
+                "WHERE key = ? AND sink = ?",
+                [(now, key, sink) for key in keys]
+            )
+
+    def mark_failed(self, sink: str, retries: list, error: str) -> None:
+        """retries - [(ключ, время следующей попытки)]"""
+        with self._db:
+            self._db.executemany(
+                "UPDATE deliveries SET attempts = attempts + 1, next_attempt = ?, error = ? "
+                "WHERE key = ? AND sink = ?",
+                [(next_attempt, error, key, sink) for key, next_attempt in retries]
+            )
+
+    def stats(self, max_attempts: int) -> dict:
+        """Число доставок по состояниям для каждого приемника"""
+        rows = self._db.execute(
+            "SELECT sink, "
+            "SUM(delivered_at IS NOT NULL), "
+            "SUM(delivered_at IS NULL AND attempts < ?), "
+            "SUM(delivered_at IS NULL AND attempts >= ?) "
+            "FROM deliveries GROUP BY sink",
+            (max_attempts, max_attempts)
+        ).fetchall()
+        return {
+            sink: {'delivered': delivered, 'pending': pending, 'failed': failed}
+            for sink, delivered, pending, failed in rows
+        }
+
+
+class TelegramChatSink:
+    """Заявки сообщениями в чат администратора; несколько заявок в одном сообщении"""
+
+    name = 'telegram'
+
+    def __init__(self, bot: Bot, chat_id: int):
+        self.bot = bot
+        self.chat_id = chat_id
+
+    @staticmethod
+    def format_lead(lead: dict) -> str:
+        author = f"@{lead['username']}" if lead.get('username') else f"id {lead.get('user_id')}"
+        lines = [
+            f"👤 <b>{sanitize_html((lead['name'] or '-')[:_TELEGRAM_FIELD_LIMIT])}</b> ({author})",
+            f"📞 {sanitize_html((lead['contact'] or '-')[:_TELEGRAM_FIELD_LIMIT])}",
+            f"📝 {sanitize_html((lead['description'] or '-')[:_TELEGRAM_DESCRIPTION_LIMIT])}",
+        ]
+        if lead.get('last_quote'):
+            marketplace, orders_count, services = lead['last_quote']
+            lines.append(f"🧮 Расчет: {marketplace}, {orders_count} заказов, {', '.join(services)}")
+        return "\n".join(lines)
+
+    async def deliver(self, leads: list) -> None:
+        # Заявки собираются в сообщения до лимита длины
+        messages, current, size = [], [], 0
+        for lead in leads:
+            text = self.format_lead(lead)
+            if current and size + len(text) > _TELEGRAM_TEXT_LIMIT:
+                messages.append(current)
+                current, size = [], 0
+            current.append((lead['key'], text))
+            size += len(text) + 2
+
+        delivered = []
+        for chunk in messages + [current]:
+            text = f"📥 <b>Новые заявки: {len(chunk)}</b>\n\n" + "\n\n".join(text for _, text in chunk)
+            try:
+                await self.bot.send_message(chat_id=self.chat_id, text=text, parse_mode='HTML',
+                                            **lane_kwargs(self.bot, BULK))
+            except Exception as e:
+                raise LeadDeliveryError(str(e), delivered=tuple(delivered)) from e
+            delivered.extend(key for key, _ in chunk)
+
+
+class WebhookSink:
+    """
+    Пачка заявок одним POST-запросом в CRM; успех - любой ответ 2xx
+
+    Повторная попытка может собрать другую пачку, поэтому ключ
+    идемпотентности у каждой заявки свой (idempotency_key) и не меняется
+    между попытками: по нему CRM отбрасывает уже принятые заявки.
+    """
+
+    name = 'webhook'
+
+    def __init__(self, url: str, token: str = "", timeout: float = 10.0):
+        self.url = url
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        self._client = httpx.AsyncClient(timeout=timeout, headers=headers)
+
+    async def deliver(self, leads: list) -> None:
+        response = await self._client.post(
+            self.url,
+            json={'leads': [{**lead, 'idempotency_key': lead['key']} for lead in leads]}
+        )
+        if response.status_code // 100 != 2:
+            raise LeadDeliveryError(f"HTTP {response.status_code}")
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+
+class EmailSpoolSink:
+    """
+    Письма с заявками в почтовую папку
+
+    Каждая заявка - отдельный .eml файл с именем по ключу, его забирает
+    внешний почтовый агент. Повторная доставка перезаписывает тот же файл.
+    """
+
+    name = 'email'
+
+    def __init__(self, directory: str, recipient: str = ""):
+        self.directory = directory
+        self.recipient = recipient
+        os.makedirs(directory, exist_ok=True)
+
+    def _write(self, lead: dict) -> None:
+        message = EmailMessage()
+        # Перевод строки в заголовке письма недопустим, а имя вводит пользователь
+        message['Subject'] = " ".join(f"Заявка: {lead['name']}".split())
+        message['Date'] = formatdate(lead['created_at'], localtime=True)
+        if self.recipient:
+            message['To'] = self.recipient
+        message['X-Lead-Key'] = lead['key']
+        message.set_content(
+            f"Имя: {lead['name']}\nКонтакт: {lead['contact']}\nОписание: {lead['description']}\n"
+            f"Telegram: {lead.get('username') or lead.get('user_id')}\n"
+        )
+        filename = "".join(ch if ch.isalnum() else "_" for ch in lead['key'])
+        path = os.path.join(self.directory, f"{filename}.eml")
+        with open(f"{path}.tmp", 'wb') as spool:
+            spool.write(message.as_bytes())
+        os.replace(f"{path}.tmp", path)
+
+    async def deliver(self, leads: list) -> None:
+        # Письма независимы: ошибка одной заявки не задерживает остальные
+        delivered, errors = [], []
+        for lead in leads:
+            try:
+                await asyncio.to_thread(self._write, lead)
+            except Exception as e:
+                logger.warning(f"Письмо с заявкой {lead['key']} не записано: {e!r}")
+                errors.append(e)
+                continue
+            delivered.append(lead['key'])
+        if errors:
+            raise LeadDeliveryError(str(errors[0]) or type(errors[0]).__name__, delivered=tuple(delivered))
+
+
+class LeadDispatcher:
+    """
+    Фоновая доставка заявок из журнала в приемники
+
+    submit() не обращается к диску и не ждет сети. Диспетчер записывает
+    новые заявки в журнал сразу после поступления, а доставку повторяет
+    раз в flush_interval секунд. Между неудачными попытками задержка
+    растет вдвое (retry_base, 2*retry_base, ... до retry_max) со случайной
+    добавкой; после max_attempts попыток доставка считается проваленной.
+    """
+
+    def __init__(self, db_path: str, sinks: list = (), batch_size: int = 20, flush_interval: float = 2.0,
+                 max_attempts: int = 8, retry_base: float = 5.0, retry_max: float = 600.0):
+        self.db_path = db_path
+        self.sinks = list(sinks)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.journaled = 0
+        self._outbox = None
+        # Приемники доставляют параллельно, а соединение с журналом одно: транзакции
+        # из разных потоков смешались бы, поэтому обращения к журналу по очереди
+        self._outbox_lock = asyncio.Lock()
+        self._stats = {}
+        self._pending = []
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def submit(self, lead: dict) -> None:
+        """Заявка в очередь на запись и доставку"""
+        self._pending.append(lead)
+        self._wakeup.set()
+        if self._task is None:
+            logger.warning(f"Диспетчер заявок не запущен, заявка {lead['key']} ждет в памяти")
+
+    async def start(self) -> None:
+        self._outbox = await asyncio.to_thread(LeadOutbox, self.db_path)
+        await self.refresh_stats()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        sinks = ", ".join(sink.name for sink in self.sinks) or "нет, только журнал"
+        logger.info(f"Диспетчер заявок запущен, приемники: {sinks}")
+
+    async def stop(self) -> None:
+        """Запись оставшихся заявок в журнал и последняя попытка доставки"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self.dispatch()
+        for sink in self.sinks:
+            if hasattr(sink, 'close'):
+                await sink.close()
+        await self._call_outbox(self._outbox.close)
+        self._outbox = None
+
+    def stats(self) -> dict:
+        """Доставки по приемникам на конец последней итерации (без запроса к базе)"""
+        return self._stats
+
+    async def refresh_stats(self) -> dict:
+        """Пересчет доставок по журналу в отдельном потоке"""
+        if self._outbox is not None:
+            self._stats = await self._call_outbox(self._outbox.stats, self.max_attempts)
+        return self._stats
+
+    async def _call_outbox(self, method, *args):
+        """Метод журнала в отдельном потоке, не одновременно с другими"""
+        async with self._outbox_lock:
+            return await asyncio.to_thread(method, *args)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.dispatch()
+            except Exception as e:
+                logger.error(f"Ошибка доставки заявок: {e}")
+
+    async def dispatch(self) -> None:
+        """Одна итерация: журнал новых заявок, затем доставка всего, что пора отправить"""
+        changed = bool(self._pending)
+        if self._pending:
+            leads, self._pending = self._pending, []
+            await self._call_outbox(self._outbox.append, leads, [sink.name for sink in self.sinks])
+            self.journaled += len(leads)
+        attempts = await asyncio.gather(*(self._deliver_due(sink) for sink in self.sinks))
+        # Счетчики для /metrics пересчитываются, только если журнал изменился
+        if changed or any(attempts):
+            await self.refresh_stats()
+
+    async def _deliver_due(self, sink) -> bool:
+        """Доставка всего, что пора отправить; True, если были попытки"""
+        attempted = False
+        while True:
+            due = await self._call_outbox(
+                self._outbox.due, sink.name, time.time(), self.batch_size, self.max_attempts
+            )
+            if not due:
+                return attempted
+            attempted = True
+
+            leads = [lead for lead, _ in due]
+            error = None
+            try:
+                await sink.deliver(leads)
+                delivered = [lead['key'] for lead in leads]
+            except LeadDeliveryError as e:
+                delivered, error = list(e.delivered), str(e)
+            except Exception as e:
+                delivered, error = [], str(e) or type(e).__name__
+
+            now = time.time()
+            if delivered:
+                await self._call_outbox(self._outbox.mark_delivered, sink.name, delivered, now)
+            if error is None:
+                continue
+
+            delivered = set(delivered)
+            retries = [
+                (lead['key'], now + self._backoff(attempts))
+                for lead, attempts in due if lead['key'] not in delivered
+            ]
+            await self._call_outbox(self._outbox.mark_failed, sink.name, retries, error)
+            for lead, attempts in due:
+                if lead['key'] not in delivered and attempts + 1 >= self.max_attempts:
+                    logger.error(f"Заявка {lead['key']} не доставлена в {sink.name} после {attempts + 1} попыток: {error}")
+            logger.warning(f"Не удалось доставить {len(retries)} заявок в {sink.name}: {error}")
+            return attempted
+
+    def _backoff(self, attempts: int) -> float:
+        delay = min(self.retry_base * 2 ** attempts, self.retry_max)
+        return delay * random.uniform(0.8, 1.2)
+
+
+def create_sinks(bot: Bot) -> list:
+    """Приемники заявок по настройкам окружения"""
+    sinks = []
+    if LEADS_ADMIN_CHAT_ID:
+        sinks.append(TelegramChatSink(bot, LEADS_ADMIN_CHAT_ID))
+    if LEADS_WEBHOOK_URL:
+        sinks.append(WebhookSink(LEADS_WEBHOOK_URL, LEADS_WEBHOOK_TOKEN))
+    if LEADS_EMAIL_SPOOL:
+        sinks.append(EmailSpoolSink(LEADS_EMAIL_SPOOL, LEADS_EMAIL_TO))
+    return sinks
+
+
+# Общий диспетчер; приемники подключаются при запуске бота
+lead_dispatcher = LeadDispatcher(
+    LEADS_DB,
+    batch_size=LEADS_BATCH_SIZE,
+    flush_interval=LEADS_FLUSH_INTERVAL,
+    max_attempts=LEADS_MAX_ATTEMPTS,
+    retry_base=LEADS_RETRY_BASE,
+    retry_max=LEADS_RETRY_MAX
+)
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+"""
+Реестр медиафайлов, уже загруженных в Telegram
+
+Каждый файл из assets/ или attached_assets/ загружается один раз,
+дальше отправляется по file_id. Идентификаторы хранятся в небольшом
+JSON-файле по хешу содержимого, поэтому переживают перезапуск бота
+и автоматически обновляются, если файл изменился.
+"""
+
+import hashlib
+import json
+import logging
+import os
+
+from telegram import Message
+from telegram.error import BadRequest
+
+from config.settings import MEDIA_REGISTRY_PATH
+
+logger = logging.getLogger(__name__)
+
+
+class MediaRegistry:
+    """file_id загруженных файлов по хешу содержимого"""
+
+    def __init__(self, store_path: str):
+        self.store_path = store_path
+        self._file_ids = None  # sha256 -> file_id
+        self._hashes = {}  # path -> (mtime_ns, size, sha256)
+
+    def use_store(self, store_path: str) -> None:
+        """Переход на другой файл реестра; идентификаторы перечитываются из него"""
+        self.store_path = store_path
+        self._file_ids = None
+
+    def _load(self) -> dict:
+        if self._file_ids is None:
+            try:
+                with open(self.store_path, encoding='utf-8') as store:
+                    self._file_ids = json.load(store)
+            except FileNotFoundError:
+                self._file_ids = {}
+            except (OSError, ValueError) as e:
+                logger.warning(f"Не удалось прочитать реестр медиа {self.store_path}: {e}")
+                self._file_ids = {}
+        return self._file_ids
+
+    def _save(self) -> None:
+        directory = os.path.dirname(self.store_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.store_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as store:
+            json.dump(self._file_ids, store, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.store_path)
+
+    def content_hash(self, path: str):
+        """Хеш содержимого файла или None, если файла нет; файл перечитывается только при изменении"""
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+
+        cached = self._hashes.get(path)
+        if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            return cached[2]
+
+        with open(path, 'rb') as media_file:
+            digest = hashlib.sha256(media_file.read()).hexdigest()
+        self._hashes[path] = (stat.st_mtime_ns, stat.st_size, digest)
+        return digest
+
+    def exists(self, path: str) -> bool:
+        return self.content_hash(path) is not None
+
+    def get_file_id(self, path: str):
+        digest = self.content_hash(path)
+        return self._load().get(digest) if digest else None
+
+    def remember(self, path: str, file_id: str) -> None:
+        digest = self.content_hash(path)
+        if digest:
+            self._load()[digest] = file_id
+            self._save()
+
+    def forget(self, path: str) -> None:
+        digest = self.content_hash(path)
+        if digest and self._load().pop(digest, None) is not None:
+            self._save()
+
+    async def reply_photo(self, message: Message, path: str, **kwargs) -> Message:
+        """
+        Ответ фотографией: по сохраненному file_id, а при его отсутствии
+        или отказе Telegram - с загрузкой файла
+        """
+        file_id = self.get_file_id(path)
+        if file_id:
+            try:
+                return await message.reply_photo(photo=file_id, **kwargs)
+            except BadRequest as e:
+                logger.warning(f"Telegram отклонил file_id для {path}: {e}, загружаем заново")
+                self.forget(path)
+
+        with open(path, 'rb') as media_file:
+            sent = await message.reply_photo(photo=media_file, **kwargs)
+
+        if sent.photo:
+            # Самый крупный размер - последний
+            self.remember(path, sent.photo[-1].file_id)
+            logger.info(f"Файл {path} загружен в Telegram, file_id сохранен")
+        return sent
+
+
+media_registry = MediaRegistry(MEDIA_REGISTRY_PATH)
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+"""
+Учет сообщений бота для правки меню
+
+Меню бота переключается правкой последнего сообщения. Чтобы не делать
+заведомо неудачных запросов, для каждого чата запоминается последнее
+отправленное или измененное сообщение: его вид (текст или фото с
+подписью) и хеш содержимого. По ним safe_edit_message сразу выбирает
+нужный метод и пропускает правки, которые ничего не меняют.
+"""
+
+from collections import OrderedDict
+
+from telegram import Message
+
+from config.settings import MESSAGE_TRACKER_SIZE
+
+TEXT = 'text'
+PHOTO = 'photo'
+
+# Ограничение Telegram на длину подписи к фото
+CAPTION_LIMIT = 1024
+
+
+def content_hash(text: str, reply_markup=None, parse_mode: str = None) -> int:
+    """Хеш того, что видит пользователь: текст, разметка и клавиатура"""
+    return hash((text, parse_mode, reply_markup))
+
+
+def message_kind(message) -> str:
+    """Вид сообщения по данным Telegram или None, если его нельзя определить"""
+    if not isinstance(message, Message):
+        return None
+    if message.photo:
+        return PHOTO
+    if message.text is not None:
+        return TEXT
+    return None
+
+
+class MessageTracker:
+    """Последнее сообщение бота в каждом чате: (message_id, вид, хеш содержимого)"""
+
+    def __init__(self, max_chats: int = 10000):
+        self.max_chats = max_chats
+        self.skipped = 0  # Правок, пропущенных как не меняющих сообщение
+        self._chats = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._chats)
+
+    def clear(self) -> None:
+        self._chats.clear()
+
+    def remember(self, chat_id: int, message_id: int, kind: str, content: int) -> None:
+        self._chats[chat_id] = (message_id, kind, content)
+        self._chats.move_to_end(chat_id)
+        while len(self._chats) > self.max_chats:
+            self._chats.popitem(last=False)
+
+    def remember_sent(self, message: Message, content: int) -> None:
+        """Запомнить только что отправленное сообщение"""
+        self.remember(message.chat_id, message.message_id, message_kind(message), content)
+
+    def get(self, chat_id: int, message_id: int) -> tuple:
+        """(вид, хеш содержимого) или (None, None), если сообщение не отслеживается"""
+        entry = self._chats.get(chat_id)
+        if entry is None or entry[0] != message_id:
+            return None, None
+        return entry[1], entry[2]
+
+
+# Общий учет сообщений бота
+sent_messages = MessageTracker(MESSAGE_TRACKER_SIZE)
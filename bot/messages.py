@@ -283,5 +283,52 @@ MESSAGES = {
 • Как подключиться к вашим услугам?
 
 Задавайте любой вопрос! 👇
-"""
+""",
+
+    'fast_prices': """
+💰 <b>Тарифы на услуги фулфилмента</b>
+
+{services}
+
+🧮 Точную стоимость для вашего объема заказов посчитает калькулятор в главном меню.
+""",
+
+    'fast_commissions': """
+🛍 <b>Комиссии маркетплейсов</b>
+
+{marketplaces}
+
+💡 Для больших объемов действуют скидки - подробности в калькуляторе.
+""",
+
+    'fast_discounts': """
+🎉 <b>Скидки за объем</b>
+
+{tiers}
+
+Скидка применяется автоматически при расчете в калькуляторе.
+""",
+
+    'fast_contacts': """
+📞 <b>Наши контакты</b>
+
+• Сайт: надежные-решения.рф
+• Email: info@надежные-решения.рф
+• Телефон: +7 (916) 218 20 00
+
+<b>🕒 Режим работы:</b>
+Пн-Вс: 9:00-20:00 (МСК)
+""",
+
+    'session_expired': """
+⌛ <b>Сессия истекла</b>
+
+Вы давно не продолжали начатое действие, поэтому мы его сбросили. Вернуться можно в любой момент: выберите нужный раздел в меню ⬇️
+""",
+
+    # Без HTML: текст уходит и во всплывающее уведомление кнопки
+    'rate_limited': "⏳ Слишком много запросов подряд. Попробуйте снова через {seconds} сек.",
+
+    'ai_rate_limited': "⏳ AI-консультант отвечает не больше чем на {limit} вопросов за {minutes} мин. "
+                       "Задайте следующий вопрос через {seconds} сек."
 }
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+"""
+Метрики в текстовом формате Prometheus
+
+Счетчики и гистограммы - простые объекты со __slots__; бот работает
+в одном цикле событий, поэтому замки не нужны. Метка метрики выбирается
+один раз (labels() при обертке обработчика), дальше на каждый вызов
+только увеличиваются числа, без словарей и строк. Значения, которые
+уже считают другие модули (кеши, ограничитель, заявки), снимаются
+в момент запроса /metrics через функции-сборщики.
+"""
+
+import logging
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+# Границы гистограмм задержек, в секундах
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Counter:
+    """Монотонно растущий счетчик"""
+
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: int = 1) -> None:
+        self.value += amount
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами корзин"""
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последняя корзина - +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricFamily:
+    """Метрика с метками: значения меток -> Counter или Histogram"""
+
+    def __init__(self, name: str, documentation: str, kind: str, labelnames: tuple = (), buckets: tuple = None):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._children = {}
+
+    def labels(self, *values):
+        """Метрика для значений меток; создается при первом обращении"""
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = Histogram(self.buckets) if self.kind == 'histogram' else Counter()
+        return child
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in sorted(self._children.items()):
+            if self.kind == 'histogram':
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+                    cumulative += count
+                    labels = _format_labels(self.labelnames, values, f'le="{_format_value(bound)}"')
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labelnames, values)
+                lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+                lines.append(f"{self.name}_count{labels} {child.count}")
+            else:
+                lines.append(f"{self.name}{_format_labels(self.labelnames, values)} {child.value}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Набор метрик процесса
+
+    Сборщик - функция без аргументов, возвращающая список
+    (имя, тип, описание, [(словарь меток, значение), ...]); вызывается
+    только при выдаче /metrics. Сборщик с тем же именем заменяет
+    прежний (приложение может создаваться заново).
+    """
+
+    def __init__(self):
+        self._families = {}
+        self._collectors = {}  # имя -> сборщик
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> MetricFamily:
+        return self._family(name, documentation, 'counter', labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (),
+                  buckets: tuple = LATENCY_BUCKETS) -> MetricFamily:
+        return self._family(name, documentation, 'histogram', labelnames, buckets)
+
+    def _family(self, name: str, documentation: str, kind: str, labelnames: tuple, buckets: tuple = None):
+        family = self._families.get(name)
+        if family is None:
+            family = self._families[name] = MetricFamily(name, documentation, kind, labelnames, buckets)
+        return family
+
+    def set_collector(self, name: str, collector) -> None:
+        self._collectors[name] = collector
+
+    def render(self) -> str:
+        lines = []
+        for family in self._families.values():
+            lines.extend(family.render())
+        for collector_name, collector in self._collectors.items():
+            try:
+                samples = collector()
+            except Exception as e:
+                logger.warning(f"Ошибка сборщика метрик {collector_name}: {e}")
+                continue
+            for name, kind, documentation, values in samples:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in values:
+                    names = tuple(labels)
+                    lines.append(f"{name}{_format_labels(names, tuple(labels[key] for key in names))} "
+                                 f"{_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# Общий набор метрик процесса
+metrics = MetricsRegistry()
+
+handler_seconds = metrics.histogram(
+    "bot_handler_seconds", "Время работы обработчика обновления", ("handler",)
+)
+handler_errors = metrics.counter(
+    "bot_handler_errors_total", "Исключения в обработчиках обновлений", ("handler",)
+)
+telegram_api_seconds = metrics.histogram(
+    "bot_telegram_api_seconds", "Длительность запроса к Bot API без ожидания в ограничителе", ("method",)
+)
+telegram_api_errors = metrics.counter(
+    "bot_telegram_api_errors_total", "Запросы к Bot API, завершившиеся ошибкой", ("method",)
+)
+openai_seconds = metrics.histogram(
+    "bot_openai_seconds", "Время получения ответа OpenAI (без ответов из кеша)", ("mode",)
+)
+openai_errors = metrics.counter(
+    "bot_openai_errors_total", "Ошибки и таймауты запросов к OpenAI", ("mode",)
+)
+openai_tokens = metrics.counter(
+    "bot_openai_tokens_total", "Токены OpenAI по отчету API", ("kind",)
+)
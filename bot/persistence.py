@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+
+"""
+Хранение состояния бота в SQLite
+
+Состояния ConversationHandler, user_data и bot_data переживают перезапуск.
+Обработчики не ждут диска: PTB раз в update_interval передает только
+изменившиеся записи, они копятся в памяти и записываются одной
+транзакцией в отдельном потоке. При остановке бота оставшееся
+записывается в flush().
+
+С session_type (UserSession) user_data не читается целиком при запуске:
+сессия подгружается из базы при первом обновлении пользователя, поэтому
+в памяти остаются только недавно активные пользователи (см. bot/session.py).
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS user_data (user_id INTEGER PRIMARY KEY, data TEXT NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS chat_data (chat_id INTEGER PRIMARY KEY, data TEXT NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS bot_data (id INTEGER PRIMARY KEY CHECK (id = 0), data TEXT NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS conversations ("
+    "name TEXT NOT NULL, key TEXT NOT NULL, state TEXT NOT NULL, PRIMARY KEY (name, key))",
+)
+
+# Отметка удаления в очереди записи
+_DELETED = object()
+
+
+def _encode(value) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+class SQLitePersistence(BasePersistence):
+    """
+    Persistence для python-telegram-bot на SQLite в режиме WAL
+
+    Данные кодируются компактным JSON, поэтому в user_data, chat_data
+    и bot_data должны лежать только JSON-совместимые значения. Записи,
+    которые не удалось закодировать, пропускаются с ошибкой в логе.
+    """
+
+    def __init__(self, db_path: str, update_interval: float = 5.0,
+                 store_data: PersistenceInput = None, session_type: type = None):
+        super().__init__(
+            store_data=store_data or PersistenceInput(chat_data=False, callback_data=False),
+            update_interval=update_interval
+        )
+        self.db_path = db_path
+        self.session_type = session_type
+        self.writes = 0
+        self.last_flush_seconds = 0.0
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        for statement in _SCHEMA:
+            self._db.execute(statement)
+        self._db.commit()
+
+        # Очередь записи: ключ -> значение или _DELETED
+        self._pending_users = {}
+        self._pending_chats = {}
+        self._pending_conversations = {}  # (name, key) -> state
+        self._pending_bot_data = None
+        self._write_task = None
+        self._write_lock = asyncio.Lock()
+
+    @property
+    def pending(self) -> int:
+        """Число записей, ожидающих сохранения"""
+        return (len(self._pending_users) + len(self._pending_chats) + len(self._pending_conversations)
+                + (self._pending_bot_data is not None))
+
+    # Чтение при запуске приложения
+
+    async def get_user_data(self) -> dict:
+        if self.session_type is not None:
+            return {}  # сессии подгружаются по одной в refresh_user_data
+        rows = self._db.execute("SELECT user_id, data FROM user_data").fetchall()
+        return {user_id: json.loads(data) for user_id, data in rows}
+
+    async def get_chat_data(self) -> dict:
+        rows = self._db.execute("SELECT chat_id, data FROM chat_data").fetchall()
+        return {chat_id: json.loads(data) for chat_id, data in rows}
+
+    async def get_bot_data(self) -> dict:
+        row = self._db.execute("SELECT data FROM bot_data WHERE id = 0").fetchone()
+        return json.loads(row[0]) if row else {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        rows = self._db.execute("SELECT key, state FROM conversations WHERE name = ?", (name,)).fetchall()
+        return {tuple(json.loads(key)): json.loads(state) for key, state in rows}
+
+    # Изменения от приложения: только в очередь, без обращения к диску
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        self._pending_users[user_id] = data
+        self._schedule_write()
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        self._pending_chats[chat_id] = data
+        self._schedule_write()
+
+    async def update_bot_data(self, data: dict) -> None:
+        self._pending_bot_data = data
+        self._schedule_write()
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def update_conversation(self, name: str, key: tuple, new_state) -> None:
+        self._pending_conversations[(name, key)] = _DELETED if new_state is None else new_state
+        self._schedule_write()
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._pending_users[user_id] = _DELETED
+        self._schedule_write()
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._pending_chats[chat_id] = _DELETED
+        self._schedule_write()
+
+    async def refresh_user_data(self, user_id: int, user_data) -> None:
+        """Подгрузка сессии из базы перед первым обновлением пользователя"""
+        if self.session_type is None or not isinstance(user_data, self.session_type):
+            return
+        if user_data.loaded:
+            return
+        user_data.loaded = True
+        state = await self._load_user_state(user_id)
+        if state:
+            user_data.restore(state)
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    async def flush(self) -> None:
+        """Запись всего накопленного и закрытие базы (при остановке бота)"""
+        if self._write_task is not None:
+            await self._write_task
+        await self._write_pending()
+        self._db.close()
+
+    async def _load_user_state(self, user_id: int):
+        # Выгруженная сессия может еще ждать записи в очереди
+        pending = self._pending_users.get(user_id)
+        if pending is None:
+            async with self._write_lock:  # или записываться в отдельном потоке прямо сейчас
+                pending = self._pending_users.get(user_id)
+                if pending is None:
+                    row = await asyncio.to_thread(self._select_user, user_id)
+                    return json.loads(row[0]) if row else None
+        if pending is _DELETED:
+            return None
+        return pending.to_state() if hasattr(pending, 'to_state') else pending
+
+    def _select_user(self, user_id: int):
+        return self._db.execute("SELECT data FROM user_data WHERE user_id = ?", (user_id,)).fetchone()
+
+    # Запись
+
+    def _schedule_write(self) -> None:
+        if self._write_task is None:
+            self._write_task = asyncio.get_running_loop().create_task(self._write_soon())
+
+    async def _write_soon(self) -> None:
+        # PTB передает изменения пачкой через gather: даем всем вызовам update_* отработать
+        await asyncio.sleep(0)
+        try:
+            await self._write_pending()
+        finally:
+            self._write_task = None
+
+    async def _write_pending(self) -> None:
+        async with self._write_lock:
+            users, self._pending_users = self._pending_users, {}
+            chats, self._pending_chats = self._pending_chats, {}
+            conversations, self._pending_conversations = self._pending_conversations, {}
+            bot_data, self._pending_bot_data = self._pending_bot_data, None
+            if not (users or chats or conversations or bot_data is not None):
+                return
+            try:
+                # Кодирование и запись - в отдельном потоке, цикл событий не блокируется
+                await asyncio.to_thread(self._write, users, chats, conversations, bot_data)
+            except Exception as e:
+                logger.error(f"Ошибка записи состояния в {self.db_path}: {e}")
+
+    def _write(self, users: dict, chats: dict, conversations: dict, bot_data) -> None:
+        started = time.perf_counter()
+        with self._db:
+            for table, column, changes in (("user_data", "user_id", users), ("chat_data", "chat_id", chats)):
+                deleted = [(key,) for key, value in changes.items() if value is _DELETED]
+                if deleted:
+                    self._db.executemany(f"DELETE FROM {table} WHERE {column} = ?", deleted)
+                self._db.executemany(
+                    f"INSERT OR REPLACE INTO {table} VALUES (?, ?)",
+                    self._encoded_rows(table, changes)
+                )
+
+            deleted = [(name, _encode(list(key))) for (name, key), state in conversations.items() if state is _DELETED]
+            if deleted:
+                self._db.executemany("DELETE FROM conversations WHERE name = ? AND key = ?", deleted)
+            self._db.executemany(
+                "INSERT OR REPLACE INTO conversations VALUES (?, ?, ?)",
+                [(name, _encode(list(key)), _encode(state))
+                 for (name, key), state in conversations.items() if state is not _DELETED]
+            )
+
+            if bot_data is not None:
+                self._db.execute("INSERT OR REPLACE INTO bot_data VALUES (0, ?)", (_encode(bot_data),))
+
+        self.writes += 1
+        self.last_flush_seconds = time.perf_counter() - started
+        logger.debug(
+            f"Состояние сохранено: пользователей {len(users)}, диалогов {len(conversations)}, "
+            f"{self.last_flush_seconds * 1000:.1f} мс"
+        )
+
+    @staticmethod
+    def _encoded_rows(table: str, changes: dict) -> list:
+        rows = []
+        for key, value in changes.items():
+            if value is _DELETED:
+                continue
+            try:
+                rows.append((key, _encode(value.to_state() if hasattr(value, 'to_state') else value)))
+            except (TypeError, ValueError) as e:
+                logger.error(f"Не удалось сохранить {table}[{key}]: {e}")
+        return rows
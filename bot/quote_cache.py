@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+"""
+Кеш готовых расчетов стоимости
+
+Пользователи чаще всего выбирают одни и те же сочетания маркетплейса,
+объема и услуг. Кеш хранит результат калькулятора вместе с готовым HTML
+и отдает их без повторного расчета и форматирования.
+"""
+
+import logging
+from collections import OrderedDict
+from datetime import date
+
+from bot.calculator import FulfillmentCalculator, SERVICE_CODES
+from bot.tariff_engine import get_tariff_table
+from config.settings import QUOTE_CACHE_SIZE
+from utils.formatters import format_calculation_result
+
+logger = logging.getLogger(__name__)
+
+
+def canonical_services(selected_services: list) -> list:
+    """Услуги в порядке тарифов: одинаковый набор дает одинаковый текст"""
+    selected = set(selected_services)
+    known = [code for code in SERVICE_CODES if code in selected]
+    return known + sorted(selected.difference(SERVICE_CODES))
+
+
+class QuoteCache:
+    """
+    LRU-кеш расчетов с ограничением размера
+
+    Ключ - (маркетплейс, количество заказов, набор услуг, сезон, версия тарифов).
+    Количество заказов точное: оно выводится в тексте расчета. При смене
+    версии тарифов кеш очищается целиком.
+
+    Возвращаемый результат общий для всех попаданий и не должен изменяться.
+    """
+
+    def __init__(self, max_size: int = 1000):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (result, text)
+        self._tariffs_version = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict:
+        """Счетчики кеша"""
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hit_ratio
+        }
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def get_quote(self, marketplace: str, orders_count: int, selected_services: list,
+                  when: date = None) -> tuple:
+        """(результат расчета, HTML для отправки)"""
+        tariffs = get_tariff_table()
+        if tariffs.version != self._tariffs_version:
+            if self._entries:
+                logger.info(f"Тарифы изменились ({self._tariffs_version} -> {tariffs.version}), кеш расчетов очищен")
+            self._entries.clear()
+            self._tariffs_version = tariffs.version
+
+        season = tariffs.seasons.season(when or date.today())
+        key = (marketplace, orders_count, frozenset(selected_services), season, tariffs.version)
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry
+
+        self.misses += 1
+        services = canonical_services(selected_services)
+        result = FulfillmentCalculator(tariffs).calculate(marketplace, orders_count, services, season=season)
+        entry = (result, format_calculation_result(result, marketplace, orders_count, services, tariffs))
+        self._entries[key] = entry
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return entry
+
+
+# Общий кеш расчетов
+quote_cache = QuoteCache(QUOTE_CACHE_SIZE)
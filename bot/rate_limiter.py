@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+
+"""
+Ограничение частоты исходящих запросов к Bot API
+
+Telegram отвечает 429 (RetryAfter), если бот отправляет больше ~30
+сообщений в секунду всего или больше ~1 сообщения в секунду в один чат
+(в группы - 20 в минуту). Ограничитель распределяет отправки по времени
+token bucket'ами, а при заторе пропускает сначала ответы пользователям
+(полоса interactive), затем фоновые и массовые рассылки (полоса bulk).
+
+Полоса задается через rate_limit_args у методов бота:
+    await bot.send_message(chat_id, text, **lane_kwargs(bot, BULK))
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from bot.metrics import telegram_api_seconds, telegram_api_errors
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+LANES = (INTERACTIVE, BULK)  # по убыванию приоритета
+
+# Запросы, на которые распространяются лимиты Telegram на сообщения
+_LIMITED_PREFIXES = ('send', 'edit', 'copy', 'forward')
+
+# Сколько простаивающих корзин чатов хранить до очистки
+_MAX_IDLE_CHAT_BUCKETS = 10000
+
+
+def lane_kwargs(bot, lane: str) -> dict:
+    """Аргументы для выбора полосы; без ограничителя rate_limit_args передавать нельзя"""
+    return {'rate_limit_args': lane} if getattr(bot, 'rate_limiter', None) else {}
+
+
+def _seconds(retry_after) -> float:
+    # В новых версиях PTB retry_after - timedelta
+    return retry_after.total_seconds() if hasattr(retry_after, 'total_seconds') else float(retry_after)
+
+
+class TokenBucket:
+    """Корзина токенов: rate токенов в секунду, не больше capacity про запас"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Секунд до появления целого токена"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+    def reserve(self, now: float) -> float:
+        """
+        Занять токен заранее, даже если его еще нет
+
+        Возвращает задержку до своей очереди; следующие резервирования
+        встают за ним, поэтому отправки в чат идут по одной в свой слот.
+        """
+        self.take(now)
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def is_idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class PriorityRateLimiter(BaseRateLimiter):
+    """
+    Ограничитель для Application.builder().rate_limiter(...)
+
+    Корзина вмещает burst токенов, поэтому за любую секунду уходит не больше
+    burst + rate - 1 отправок: общая корзина по умолчанию не копит запас.
+
+    Сначала запрос ждет своего слота в корзине чата, затем встает в общую
+    очередь с приоритетом полосы. Общую корзину разбирает одна задача,
+    всегда отдавая токен самому приоритетному и раннему запросу. После
+    RetryAfter отправки приостанавливаются на указанное Telegram время,
+    запрос повторяется до max_retries раз.
+
+    Запросы, не отправляющие сообщения (answerCallbackQuery, getUpdates и т.п.),
+    проходят без ограничений. Нулевая частота снимает соответствующий лимит.
+    """
+
+    def __init__(self, overall_rate: float = 30.0, chat_rate: float = 1.0, chat_burst: float = 3.0,
+                 group_rate: float = 20 / 60, max_retries: int = 3, overall_burst: float = 1.0):
+        self.overall_rate = overall_rate
+        self.overall_burst = overall_burst
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+
+        self.sent = 0
+        self.throttled = 0  # Запросов, ждавших своей очереди
+        self.retry_after = 0  # Полученных 429
+        self.max_queue_depth = 0
+
+        self._overall = None
+        self._chats = {}  # chat_id -> TokenBucket
+        self._waiters = []  # heap: (приоритет полосы, номер, future)
+        self._sequence = itertools.count()
+        self._queued = dict.fromkeys(LANES, 0)
+        self._chat_waiting = 0
+        self._paused_until = 0.0
+        self._pump_task = None
+        self._timers = {}  # метод Bot API -> (гистограмма длительности, счетчик ошибок)
+
+    async def initialize(self) -> None:
+        if self.overall_rate > 0:
+            self._overall = TokenBucket(self.overall_rate, self.overall_burst, time.monotonic())
+
+    async def shutdown(self) -> None:
+        if self._pump_task is not None:
+            self._pump_task.cancel()
+            self._pump_task = None
+        for _, _, future in self._waiters:
+            future.cancel()
+        self._waiters.clear()
+
+    def queue_depth(self) -> dict:
+        """Запросов в общей очереди по полосам"""
+        return dict(self._queued)
+
+    def stats(self) -> dict:
+        """Счетчики для метрик"""
+        return {
+            'sent': self.sent,
+            'throttled': self.throttled,
+            'retry_after': self.retry_after,
+            'queued': self.queue_depth(),
+            'waiting_for_chat': self._chat_waiting,
+            'max_queue_depth': self.max_queue_depth,
+            'paused_for': max(0.0, self._paused_until - time.monotonic()),
+        }
+
+    async def _timed(self, callback, args, kwargs, endpoint: str):
+        """Вызов Bot API с записью длительности в метрики"""
+        timer = self._timers.get(endpoint)
+        if timer is None:
+            timer = self._timers[endpoint] = (telegram_api_seconds.labels(endpoint), telegram_api_errors.labels(endpoint))
+        started = time.perf_counter()
+        try:
+            return await callback(*args, **kwargs)
+        except Exception:
+            timer[1].inc()
+            raise
+        finally:
+            timer[0].observe(time.perf_counter() - started)
+
+    async def process_request(self, callback, args, kwargs, endpoint: str, data: dict, rate_limit_args):
+        if endpoint == 'getUpdates':
+            # Long polling держит запрос открытым, его длительность ничего не говорит
+            return await callback(*args, **kwargs)
+        if not endpoint.startswith(_LIMITED_PREFIXES):
+            return await self._timed(callback, args, kwargs, endpoint)
+
+        lane = rate_limit_args if rate_limit_args in LANES else INTERACTIVE
+        chat_id = data.get('chat_id')
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(chat_id, lane)
+            try:
+                result = await self._timed(callback, args, kwargs, endpoint)
+            except RetryAfter as e:
+                self.retry_after += 1
+                delay = _seconds(e.retry_after)
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                if attempt == self.max_retries:
+                    raise
+                logger.warning(f"Telegram просит подождать {delay} сек ({endpoint}, чат {chat_id}), повтор")
+                continue
+            self.sent += 1
+            return result
+
+    def _chat_bucket(self, chat_id, now: float):
+        """Корзина чата или None, если для такого чата лимит снят"""
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Отрицательный id - группа или канал, у них свой лимит
+            is_group = isinstance(chat_id, int) and chat_id < 0
+            rate = self.group_rate if is_group else self.chat_rate
+            if rate <= 0:
+                return None
+            if len(self._chats) >= _MAX_IDLE_CHAT_BUCKETS:
+                self._chats = {key: value for key, value in self._chats.items() if not value.is_idle(now)}
+            bucket = self._chats[chat_id] = TokenBucket(rate, 1.0 if is_group else self.chat_burst, now)
+        return bucket
+
+    async def _acquire(self, chat_id, lane: str) -> None:
+        now = time.monotonic()
+        bucket = self._chat_bucket(chat_id, now) if chat_id is not None else None
+        delay = bucket.reserve(now) if bucket is not None else 0.0
+        if delay > 0:
+            self._chat_waiting += 1
+            try:
+                await asyncio.sleep(delay)
+            finally:
+                self._chat_waiting -= 1
+            now = time.monotonic()
+
+        # Быстрый путь: очереди нет, токен есть (или общий лимит снят)
+        if not self._waiters and now >= self._paused_until and (
+                self._overall is None or self._overall.wait_time(now) == 0):
+            if self._overall is not None:
+                self._overall.take(now)
+            if delay > 0:
+                self.throttled += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (LANES.index(lane), next(self._sequence), future))
+        self._queued[lane] += 1
+        self.max_queue_depth = max(self.max_queue_depth, len(self._waiters))
+        self.throttled += 1
+        if self._pump_task is None:
+            self._pump_task = asyncio.get_running_loop().create_task(self._pump())
+        try:
+            await future
+        finally:
+            self._queued[lane] -= 1
+
+    async def _pump(self) -> None:
+        """Выдача общих токенов очереди в порядке приоритета"""
+        try:
+            while self._waiters:
+                now = time.monotonic()
+                token_wait = self._overall.wait_time(now) if self._overall is not None else 0.0
+                delay = max(self._paused_until - now, token_wait)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    continue
+                _, _, future = heapq.heappop(self._waiters)
+                if future.done():
+                    continue
+                if self._overall is not None:
+                    self._overall.take(now)
+                future.set_result(None)
+        finally:
+            self._pump_task = None
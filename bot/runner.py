@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+"""
+Запуск приложения в режиме long polling или вебхука
+
+Вебхук принимает встроенный сервер python-telegram-bot
+(Application.run_webhook, extra python-telegram-bot[webhooks]): он
+проверяет секретный токен и регистрирует адрес в Telegram. Проверки
+живости и готовности отдает сервер метрик (bot/instrumentation.py).
+"""
+
+import logging
+import secrets
+
+from telegram.ext import Application
+
+from config.settings import (
+    BOT_MODE, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_LISTEN, WEBHOOK_PORT,
+    WEBHOOK_SECRET_TOKEN, WEBHOOK_MAX_CONNECTIONS, WEBHOOK_TLS_CERT, WEBHOOK_TLS_KEY
+)
+
+logger = logging.getLogger(__name__)
+
+
+def run_application(application: Application, allowed_updates: list) -> None:
+    """Запуск бота в режиме, заданном переменной окружения BOT_MODE"""
+    if BOT_MODE != "webhook":
+        application.run_polling(allowed_updates=allowed_updates)
+        return
+    if not WEBHOOK_URL:
+        raise ValueError("Для BOT_MODE=webhook нужно задать WEBHOOK_URL")
+    logger.info(f"Прием обновлений вебхуком: {WEBHOOK_URL}{WEBHOOK_PATH}")
+    application.run_webhook(
+        listen=WEBHOOK_LISTEN,
+        port=WEBHOOK_PORT,
+        url_path=WEBHOOK_PATH.lstrip("/"),
+        webhook_url=WEBHOOK_URL + WEBHOOK_PATH,
+        # Без заданного токена - случайный на этот запуск: чужие запросы без него отклоняются
+        secret_token=WEBHOOK_SECRET_TOKEN or secrets.token_urlsafe(32),
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+        # TLS на самом боте, если перед ним нет завершающего TLS прокси
+        cert=WEBHOOK_TLS_CERT or None,
+        key=WEBHOOK_TLS_KEY or None,
+        allowed_updates=allowed_updates
+    )
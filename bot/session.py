@@ -0,0 +1,417 @@
+# -*- coding: utf-8 -*-
+
+"""
+Компактные сессии пользователей вместо словарей user_data
+
+UserSession - объект со __slots__: маркетплейс хранится номером в
+MARKETPLACE_CODES, услуги - битовой маской по SERVICE_CODES, последний
+расчет - только его параметрами (сам расчет берется из кеша расчетов
+или считается заново). На диск сессия пишется прежним словарем
+(to_state), поэтому старые записи в базе читаются без миграции.
+
+SQLitePersistence(session_type=UserSession) подгружает сессию из базы
+при первом обновлении пользователя, touch_session (группа -2) отмечает
+время каждого обращения.
+
+SessionSweeper раз в interval секунд:
+- сбрасывает диалоги, брошенные дольше таймаута своего ConversationHandler
+  (CONVERSATION_TIMEOUTS): состояние удаляется, черновые данные диалога
+  в сессии очищаются, пустая сессия удаляется совсем, а пользователь
+  получает одно сообщение session_expired через полосу BULK;
+- выгружает из памяти сессии, не использованные дольше ttl: их данные
+  остаются в базе. Без persistence сессии не выгружаются - хранить их
+  больше негде.
+
+Публичного доступа к текущим диалогам и удаления user_data без
+persistence у PTB нет, поэтому сборщик работает с закрытыми атрибутами
+ConversationHandler._conversations и Application._user_data. Версия PTB
+закреплена (python-telegram-bot==20.7), а check_ptb_internals при
+запуске останавливает бота, если этих атрибутов не оказалось.
+"""
+
+import asyncio
+import itertools
+import logging
+import sys
+import time
+from collections import deque
+from collections.abc import MutableMapping
+
+import telegram
+from telegram import Update
+from telegram.error import TelegramError
+from telegram.ext import Application, ConversationHandler
+
+from bot.calculator import MARKETPLACE_CODES, services_to_mask, mask_to_services
+from bot.keyboards import get_main_menu_keyboard
+from bot.messages import MESSAGES
+from bot.rate_limiter import BULK, lane_kwargs
+from config.settings import (
+    SESSION_TTL, SESSION_SWEEP_INTERVAL, CONVERSATION_TIMEOUTS, CONVERSATION_SWEEP_BATCH, CONVERSATION_EXPIRED_NOTICE
+)
+
+logger = logging.getLogger(__name__)
+
+_NO_MARKETPLACE = -1
+
+
+class UserSession:
+    """Данные пользователя между обновлениями"""
+
+    __slots__ = (
+        '_marketplace', 'orders_count', 'services_mask',
+        '_quote_marketplace', '_quote_orders', '_quote_services',
+        'application_name', 'application_contact', 'application_description',
+        'last_seen', 'loaded',
+    )
+
+    def __init__(self):
+        self.clear()
+        self.last_seen = time.monotonic()
+        # Данные из базы уже подгружены (или загружать нечего)
+        self.loaded = False
+
+    def clear(self) -> None:
+        """Сброс всех данных (новый расчет)"""
+        self._marketplace = _NO_MARKETPLACE
+        self.orders_count = 0
+        self.services_mask = 0
+        self._quote_marketplace = _NO_MARKETPLACE
+        self._quote_orders = 0
+        self._quote_services = 0
+        self.application_name = None
+        self.application_contact = None
+        self.application_description = None
+
+    def touch(self) -> None:
+        self.last_seen = time.monotonic()
+
+    def reset_flow(self, name: str) -> None:
+        """Очистка черновых данных брошенного диалога (последний расчет сохраняется)"""
+        if name == 'calculator':
+            self._marketplace = _NO_MARKETPLACE
+            self.orders_count = 0
+            self.services_mask = 0
+        elif name == 'application':
+            self.application_name = None
+            self.application_contact = None
+            self.application_description = None
+
+    def __deepcopy__(self, memo):
+        # PTB копирует user_data перед передачей в persistence; все поля неизменяемые
+        copy = UserSession.__new__(UserSession)
+        for name in UserSession.__slots__:
+            setattr(copy, name, getattr(self, name))
+        return copy
+
+    # Расчет
+
+    @property
+    def marketplace(self):
+        return MARKETPLACE_CODES[self._marketplace] if self._marketplace != _NO_MARKETPLACE else None
+
+    @marketplace.setter
+    def marketplace(self, code: str) -> None:
+        self._marketplace = MARKETPLACE_CODES.index(code) if code in MARKETPLACE_CODES else _NO_MARKETPLACE
+
+    @property
+    def selected_services(self) -> list:
+        return mask_to_services(self.services_mask)
+
+    def toggle_service(self, code: str) -> None:
+        self.services_mask ^= services_to_mask([code])
+
+    def save_quote(self) -> None:
+        """Запомнить текущие параметры как последний расчет"""
+        self._quote_marketplace = self._marketplace
+        self._quote_orders = self.orders_count
+        self._quote_services = self.services_mask
+
+    @property
+    def last_quote(self):
+        """[маркетплейс, количество заказов, услуги] последнего расчета или None"""
+        if self._quote_marketplace == _NO_MARKETPLACE or not self._quote_orders:
+            return None
+        return [MARKETPLACE_CODES[self._quote_marketplace], self._quote_orders, mask_to_services(self._quote_services)]
+
+    # Сохранение
+
+    def to_state(self) -> dict:
+        """Словарь для записи в базу: те же ключи, что были в user_data"""
+        state = {}
+        if self._marketplace != _NO_MARKETPLACE:
+            state['marketplace'] = self.marketplace
+        if self.orders_count:
+            state['orders_count'] = self.orders_count
+        if self.services_mask:
+            state['selected_services'] = self.selected_services
+        if self.last_quote:
+            state['last_quote'] = self.last_quote
+        for key in ('application_name', 'application_contact', 'application_description'):
+            if getattr(self, key) is not None:
+                state[key] = getattr(self, key)
+        return state
+
+    def restore(self, state: dict) -> None:
+        """Загрузка из словаря to_state (или из user_data прежних версий бота)"""
+        self.clear()
+        self.marketplace = state.get('marketplace')
+        self.orders_count = state.get('orders_count') or 0
+        self.services_mask = services_to_mask(state.get('selected_services') or ())
+        if state.get('last_quote'):
+            marketplace, orders_count, selected_services = state['last_quote']
+            self._quote_marketplace = (MARKETPLACE_CODES.index(marketplace) if marketplace in MARKETPLACE_CODES
+                                       else _NO_MARKETPLACE)
+            self._quote_orders = orders_count or 0
+            self._quote_services = services_to_mask(selected_services)
+        for key in ('application_name', 'application_contact', 'application_description'):
+            setattr(self, key, state.get(key))
+        self.loaded = True
+
+
+def _deep_size(value) -> int:
+    """Размер объекта вместе со строками, числами и вложенными коллекциями (без ключей словарей - они общие)"""
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(_deep_size(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(_deep_size(item) for item in value)
+    if value is None or isinstance(value, bool) or (isinstance(value, int) and -5 <= value <= 256):
+        return 0  # общие объекты интерпретатора
+    return sys.getsizeof(value)
+
+
+def session_size(session: UserSession) -> int:
+    """Байт памяти на сессию вместе со значениями полей"""
+    return sys.getsizeof(session) + sum(_deep_size(getattr(session, name)) for name in UserSession.__slots__)
+
+
+def memory_report(sessions, sample: int = 10000) -> dict:
+    """
+    Память сессий: компактные объекты против прежних словарей user_data
+
+    Размеры считаются по первым sample сессиям и переносятся на все.
+    """
+    sessions = list(itertools.islice(sessions, sample))
+    count = len(sessions)
+    compact = sum(session_size(session) for session in sessions)
+    legacy = sum(_deep_size(session.to_state()) for session in sessions)
+    return {
+        'sampled': count,
+        'compact_per_session': compact / count if count else 0.0,
+        'dict_per_session': legacy / count if count else 0.0,
+    }
+
+
+async def touch_session(update: Update, context) -> None:
+    """Отметка обращения пользователя до всех остальных обработчиков"""
+    session = context.user_data
+    if isinstance(session, UserSession):
+        session.touch()
+
+
+def check_ptb_internals(application: Application) -> None:
+    """Проверка закрытых атрибутов PTB, с которыми работают сборщик, лимиты и метрики диалогов"""
+    missing = []
+    if not isinstance(getattr(application, '_user_data', None), MutableMapping):
+        missing.append("Application._user_data")
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if (isinstance(handler, ConversationHandler)
+                    and not isinstance(getattr(handler, '_conversations', None), MutableMapping)):
+                missing.append(f"ConversationHandler._conversations ({handler.name})")
+    if missing:
+        raise RuntimeError(f"В python-telegram-bot {telegram.__version__} нет {', '.join(missing)}; "
+                           f"бот проверен на версии 20.7")
+
+
+class SessionSweeper:
+    """Сброс брошенных диалогов и выгрузка из памяти простаивающих сессий"""
+
+    # Одновременных отправок сообщения об истекшей сессии
+    NOTICE_WORKERS = 4
+
+    def __init__(self, ttl: float = 1800.0, interval: float = 60.0, timeouts: dict = None,
+                 batch_size: int = 500, notify: bool = False):
+        self.ttl = ttl
+        self.interval = interval
+        # Таймаут по имени ConversationHandler; 0 или нет имени - без ограничения
+        self.timeouts = dict(timeouts or {})
+        self.batch_size = max(1, batch_size)
+        self.notify = notify
+        self.evicted = 0
+        self.expired = 0
+        self.reclaimed_bytes = 0
+        self.notified = 0
+        self._application = None
+        self._conversations = []
+        self._timed = []
+        self._notices = deque()
+        self._queued_chats = set()
+        self._task = None
+        self._notice_task = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    @property
+    def evicting(self) -> bool:
+        return self.running and self.ttl > 0 and self._application.persistence is not None
+
+    async def start(self, application: Application) -> None:
+        check_ptb_internals(application)
+        self._application = application
+        self._conversations = [handler for handlers in application.handlers.values() for handler in handlers
+                               if isinstance(handler, ConversationHandler)]
+        self._timed = [handler for handler in self._conversations if self.timeouts.get(handler.name, 0) > 0]
+        if self.interval <= 0:
+            return
+        evict = self.ttl > 0
+        if evict and application.persistence is None:
+            logger.info("Состояние не сохраняется на диск, простаивающие сессии остаются в памяти")
+            evict = False
+        if evict or self._timed:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        for task in (self._task, self._notice_task):
+            if task is not None:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        self._task = None
+        self._notice_task = None
+
+    async def sweep(self) -> int:
+        """Сброс брошенных диалогов и выгрузка простаивающих сессий; возвращает число выгруженных"""
+        await self.expire_conversations()
+        return await self.evict_idle()
+
+    async def evict_idle(self) -> int:
+        """Выгрузка простаивающих сессий; возвращает их число"""
+        application = self._application
+        if self.ttl <= 0 or application.persistence is None:
+            return 0
+        # Сначала изменения попадают в очередь записи persistence, потом сессии уходят из памяти
+        await application.update_persistence()
+        deadline = time.monotonic() - self.ttl
+        # Сессия диалога, который еще не истек по своему таймауту, остается в памяти
+        active = {key[-1] for handler in self._timed for key in handler._conversations}
+        idle = [user_id for user_id, session in application.user_data.items()
+                if isinstance(session, UserSession) and session.last_seen < deadline and user_id not in active]
+        # Публичного способа убрать user_data без удаления из persistence у Application нет
+        for user_id in idle:
+            del application._user_data[user_id]
+        self.evicted += len(idle)
+        if idle:
+            logger.info(f"Выгружено простаивающих сессий: {len(idle)}, в памяти: {len(application.user_data)}")
+        return len(idle)
+
+    async def expire_conversations(self) -> int:
+        """
+        Сброс диалогов, в которых пользователь не действовал дольше таймаута
+
+        Диалоги сбрасываются пачками по batch_size, между пачками цикл
+        событий обрабатывает обновления. Пользователь, вернувшийся до
+        своей пачки, диалог не теряет.
+
+        Returns:
+            int: Число сброшенных диалогов
+        """
+        application = self._application
+        now = time.monotonic()
+        candidates = []
+        for handler in self._timed:
+            deadline = now - self.timeouts[handler.name]
+            for key in list(handler._conversations):
+                session = application.user_data.get(key[-1])
+                if session is None or session.last_seen < deadline:
+                    candidates.append((handler, key, deadline))
+
+        expired = reclaimed = 0
+        for start in range(0, len(candidates), self.batch_size):
+            if start:
+                await asyncio.sleep(0)
+            for handler, key, deadline in candidates[start:start + self.batch_size]:
+                freed = self._expire(handler, key, deadline)
+                if freed is not None:
+                    expired += 1
+                    reclaimed += freed
+
+        if expired:
+            self.expired += expired
+            self.reclaimed_bytes += reclaimed
+            # Удаленные состояния и сессии сразу уходят в persistence
+            await application.update_persistence()
+            logger.info(f"Сброшено брошенных диалогов: {expired}, освобождено ~{reclaimed / 1024:.0f} КБ")
+            if self._notices and self._notice_task is None:
+                self._notice_task = asyncio.get_running_loop().create_task(self._send_notices())
+        return expired
+
+    def _expire(self, handler: ConversationHandler, key: tuple, deadline: float):
+        """Сброс одного диалога; возвращает освобожденные байты или None, если сбрасывать не нужно"""
+        application = self._application
+        user_id = key[-1]
+        session = application.user_data.get(user_id)
+        if key not in handler._conversations or (session is not None and session.last_seen >= deadline):
+            return None
+        # pop у TrackingDict отмечает ключ для удаления из persistence
+        handler._conversations.pop(key)
+        freed = _deep_size(key)
+
+        if isinstance(session, UserSession):
+            size = session_size(session)
+            session.reset_flow(handler.name)
+            in_conversation = any(key in other._conversations for other in self._conversations)
+            if not in_conversation and not session.to_state():
+                self._drop_session(user_id)
+                freed += size
+            else:
+                if application.persistence is not None:
+                    application.mark_data_for_update_persistence(user_ids=user_id)
+                freed += size - session_size(session)
+
+        chat_id = key[0]
+        if self.notify and chat_id not in self._queued_chats:
+            self._queued_chats.add(chat_id)
+            self._notices.append(chat_id)
+        return freed
+
+    def _drop_session(self, user_id: int) -> None:
+        application = self._application
+        if application.persistence is not None:
+            application.drop_user_data(user_id)
+        else:
+            # drop_user_data копит отметки для persistence, которые без нее никто не заберет
+            del application._user_data[user_id]
+
+    async def _send_notices(self) -> None:
+        try:
+            await asyncio.gather(*(self._notice_worker() for _ in range(self.NOTICE_WORKERS)))
+        finally:
+            self._notice_task = None
+
+    async def _notice_worker(self) -> None:
+        bot = self._application.bot
+        while self._notices:
+            chat_id = self._notices.popleft()
+            self._queued_chats.discard(chat_id)
+            try:
+                await bot.send_message(chat_id=chat_id, text=MESSAGES['session_expired'],
+                                       reply_markup=get_main_menu_keyboard(), parse_mode='HTML',
+                                       **lane_kwargs(bot, BULK))
+                self.notified += 1
+            except TelegramError as e:
+                logger.debug(f"Сообщение об истекшей сессии в чат {chat_id} не отправлено: {e}")
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Ошибка очистки сессий: {e}")
+
+
+# Общий сборщик брошенных диалогов и простаивающих сессий; запускается из post_init
+session_sweeper = SessionSweeper(SESSION_TTL, SESSION_SWEEP_INTERVAL, CONVERSATION_TIMEOUTS,
+                                 CONVERSATION_SWEEP_BATCH, CONVERSATION_EXPIRED_NOTICE)
@@ -0,0 +1,532 @@
+# -*- coding: utf-8 -*-
+
+"""
+Компиляция тарифов в неизменяемую таблицу цен
+
+Конфигурация из config/tariffs.py проверяется и один раз превращается
+в таблицу: параметры маркетплейсов и услуг лежат в именованных кортежах,
+у каждой услуги - готовая функция цены для ее типа тарифа. Расчет
+стоимости после этого не ходит по вложенным словарям.
+
+Функции цены - чистая арифметика, поэтому одна и та же функция считает
+и одно значение (int), и массив NumPy в пакетном расчете.
+
+Таблица неизменяема и содержит и исходную конфигурацию (названия,
+описания, особенности), поэтому все, что показывается пользователю,
+берется из одной версии тарифов. Новая версия (из TARIFFS_FILE или
+перечитанного config/tariffs.py) собирается целиком и подменяет текущую
+одним присваиванием: кто уже взял таблицу, досчитывает по старой.
+"""
+
+import importlib
+import json
+import logging
+import math
+import tomllib
+from bisect import bisect_right
+from datetime import date
+from types import MappingProxyType
+from typing import Callable, Mapping, NamedTuple
+
+import config.tariffs
+from config.settings import TARIFFS_FILE
+from config.tariffs import (
+    MARKETPLACE_TARIFFS, SERVICE_TARIFFS, VOLUME_DISCOUNTS, CALCULATION_PARAMS, get_tariffs_version
+)
+
+try:
+    import numpy as np
+except ImportError:  # numpy нужен только для пакетного расчета
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# Параметры маркетплейса, не найденного в тарифах (как было в калькуляторе)
+DEFAULT_COMMISSION_RATE = 0.1
+DEFAULT_AVERAGE_ORDER_VALUE = 1000
+
+# Средний чек для оценки процентных тарифов
+PERCENTAGE_ORDER_VALUE = 1000
+
+
+class TariffConfigError(ValueError):
+    """Ошибка в конфигурации тарифов"""
+
+
+# Режимы скидки за объем
+DISCOUNT_MODES = ('progressive', 'marginal')
+
+
+class DiscountSchedule:
+    """
+    Шкала скидок за объем, построенная из VOLUME_DISCOUNTS
+
+    progressive - скидка достигнутой ступени действует на весь объем
+    marginal - скидка ступени действует только на заказы сверх ее порога,
+        итоговая скидка - средневзвешенная по ступеням
+
+    Поиск ступени - bisect по отсортированным порогам, O(log n) от числа ступеней.
+    """
+
+    __slots__ = ('thresholds', 'rates', 'mode', '_marginal_base')
+
+    def __init__(self, volume_discounts: dict, mode: str = 'progressive'):
+        if mode not in DISCOUNT_MODES:
+            raise ValueError(f"Неизвестный режим скидок: {mode!r}")
+        self.thresholds = tuple(sorted(volume_discounts))
+        # rates[i] - скидка при объеме в [thresholds[i-1], thresholds[i]); rates[0] = 0
+        self.rates = (0.0,) + tuple(volume_discounts[threshold] for threshold in self.thresholds)
+        self.mode = mode
+
+        # Для marginal: сумма скидок (в заказах) на всех полных ступенях ниже i-го порога
+        marginal_base = [0.0]
+        for i in range(1, len(self.thresholds)):
+            band = self.thresholds[i] - self.thresholds[i - 1]
+            marginal_base.append(marginal_base[-1] + band * self.rates[i])
+        self._marginal_base = (0.0,) + tuple(marginal_base)
+
+    @property
+    def tiers(self) -> list:
+        """Ступени шкалы: [(порог, скидка), ...] по возрастанию порога"""
+        return list(zip(self.thresholds, self.rates[1:]))
+
+    def tier(self, orders_count: int):
+        """Достигнутая ступень (порог, скидка) или None"""
+        index = bisect_right(self.thresholds, orders_count)
+        if index == 0:
+            return None
+        return self.thresholds[index - 1], self.rates[index]
+
+    def discount(self, orders_count: int) -> float:
+        """Итоговая доля скидки для объема"""
+        index = bisect_right(self.thresholds, orders_count)
+        if self.mode == 'progressive' or index == 0:
+            return self.rates[index]
+        over_threshold = orders_count - self.thresholds[index - 1]
+        return (self._marginal_base[index] + over_threshold * self.rates[index]) / orders_count
+
+    def discount_batch(self, orders):
+        """discount() для массива NumPy с теми же операциями"""
+        rates = np.array(self.rates)
+        index = np.searchsorted(np.array(self.thresholds, dtype=np.int64), orders, side='right')
+        if self.mode == 'progressive':
+            return rates[index]
+        thresholds = np.array((0,) + self.thresholds, dtype=np.int64)
+        over_threshold = orders - thresholds[index]
+        discounted = np.array(self._marginal_base)[index] + over_threshold * rates[index]
+        return np.where(
+            index == 0, rates[index],
+            np.divide(discounted, orders, out=np.zeros(np.shape(discounted)), where=orders > 0)
+        )
+
+
+# Сезон для дней, не попавших ни в один диапазон
+DEFAULT_SEASON = 'normal'
+
+# Первый день месяца в високосном году (индекс 0..365): по (месяц, день) без учета года
+_MONTH_OFFSETS = (0, 31, 60, 91, 121, 152, 182, 213, 244, 274, 305, 335)
+
+
+def _parse_month_day(value: str) -> tuple:
+    """'ММ-ДД' -> (месяц, день); 29 февраля допустимо"""
+    month, day = (int(part) for part in value.split('-'))
+    date(2000, month, day)
+    return month, day
+
+
+def day_of_year_index(month: int, day: int) -> int:
+    return _MONTH_OFFSETS[month - 1] + day - 1
+
+
+class SeasonCalendar:
+    """
+    Календарь сезонных коэффициентов
+
+    Диапазоны сезонов ('ММ-ДД', 'ММ-ДД') включительно, могут переходить
+    через Новый год. При сборке раскладываются в таблицу на 366 дней,
+    поэтому коэффициент для даты - одно обращение по индексу.
+    """
+
+    __slots__ = ('multipliers', 'day_seasons', 'day_multipliers')
+
+    def __init__(self, multipliers: dict, season_ranges: dict):
+        self.multipliers = MappingProxyType(dict(multipliers))
+        day_seasons = [DEFAULT_SEASON] * 366
+        for season, periods in season_ranges.items():
+            for start, end in periods:
+                index = day_of_year_index(*_parse_month_day(start))
+                last = day_of_year_index(*_parse_month_day(end))
+                while True:
+                    day_seasons[index] = season
+                    if index == last:
+                        break
+                    index = (index + 1) % 366
+        self.day_seasons = tuple(day_seasons)
+        self.day_multipliers = tuple(self.multipliers[season] for season in day_seasons)
+
+    def season(self, when: date) -> str:
+        return self.day_seasons[day_of_year_index(when.month, when.day)]
+
+    def multiplier(self, when: date) -> float:
+        return self.day_multipliers[day_of_year_index(when.month, when.day)]
+
+    def month_multiplier(self, year: int, month: int) -> float:
+        """Средний коэффициент по дням месяца"""
+        days = (date(year + month // 12, month % 12 + 1, 1) - date(year, month, 1)).days
+        start = day_of_year_index(month, 1)
+        return math.fsum(self.day_multipliers[start:start + days]) / days
+
+    def ranges(self, season: str) -> list:
+        """Диапазоны сезона в виде [(первый день, последний день), ...] по таблице дней"""
+        periods = []
+        for index, day_season in enumerate(self.day_seasons):
+            if day_season != season:
+                continue
+            if periods and periods[-1][1] == index - 1:
+                periods[-1][1] = index
+            else:
+                periods.append([index, index])
+        return [(_index_to_month_day(first), _index_to_month_day(last)) for first, last in periods]
+
+
+def _index_to_month_day(index: int) -> tuple:
+    month = bisect_right(_MONTH_OFFSETS, index)
+    return month, index - _MONTH_OFFSETS[month - 1] + 1
+
+
+class MarketplacePricing(NamedTuple):
+    code: str
+    name: str
+    commission_rate: float
+    average_order_value: float
+    return_rate: float
+
+
+class ServicePricing(NamedTuple):
+    code: str
+    name: str
+    rate: float
+    rate_type: str
+    # Единиц тарифа на заказ (товаров, м³·дней, рублей оборота), для per_sku - товаров каталога в месяц
+    units: float
+    min_rate: float
+    price: Callable
+
+
+class TariffConfig(NamedTuple):
+    """Исходная конфигурация в неизменяемом виде (словари - MappingProxyType, списки - кортежи)"""
+    marketplaces: Mapping
+    services: Mapping
+    volume_discounts: Mapping
+    params: Mapping
+
+
+class TariffTable(NamedTuple):
+    marketplaces: Mapping
+    services: Mapping
+    default_marketplace: MarketplacePricing
+    discounts: DiscountSchedule
+    seasons: SeasonCalendar
+    version: str
+    config: TariffConfig
+
+
+def _price_per_order(service: ServicePricing, orders, return_rate):
+    return service.rate * orders
+
+def _price_per_unit(service: ServicePricing, orders, return_rate):
+    # per_item, per_m3_day и percentage: ставка за единицу, единиц на заказ задано при компиляции
+    return service.rate * orders * service.units
+
+def _price_per_sku(service: ServicePricing, orders, return_rate):
+    # Разовая работа с товаром каталога: от числа заказов не зависит
+    return service.rate * service.units
+
+def _price_per_return(service: ServicePricing, orders, return_rate):
+    return service.rate * orders * return_rate
+
+def _price_monthly(service: ServicePricing, orders, return_rate):
+    return service.rate
+
+# Функция цены для каждого типа тарифа
+RATE_PRICERS = {
+    'per_order': _price_per_order,
+    'per_item': _price_per_unit,
+    'per_m3_day': _price_per_unit,
+    'percentage': _price_per_unit,
+    'per_return': _price_per_return,
+    'per_sku': _price_per_sku,
+    'monthly': _price_monthly,
+}
+
+
+def _units(rate_type: str, params: dict) -> float:
+    if rate_type == 'per_sku':
+        return params['catalog_skus']
+    if rate_type == 'per_item':
+        return params.get('items_per_order', 1)
+    if rate_type == 'per_m3_day':
+        return params['storage_coefficient'] * params.get('storage_days', 30)
+    if rate_type == 'percentage':
+        return PERCENTAGE_ORDER_VALUE
+    return 1
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def validate_tariffs(marketplace_tariffs: dict, service_tariffs: dict, volume_discounts: dict,
+                     params: dict) -> list:
+    """Список ошибок конфигурации тарифов (пустой, если все в порядке)"""
+    errors = []
+    return_rates = params.get('return_rate', {})
+
+    for code, tariff in marketplace_tariffs.items():
+        commission_rate = tariff.get('commission_rate', DEFAULT_COMMISSION_RATE)
+        if not _is_number(commission_rate) or not 0 <= commission_rate < 1:
+            errors.append(f"{code}: commission_rate должен быть в [0, 1), получено {commission_rate!r}")
+        average_order_value = tariff.get('average_order_value', DEFAULT_AVERAGE_ORDER_VALUE)
+        if not _is_number(average_order_value) or average_order_value <= 0:
+            errors.append(f"{code}: average_order_value должен быть положительным, получено {average_order_value!r}")
+        if code not in return_rates:
+            errors.append(f"{code}: нет доли возвратов в CALCULATION_PARAMS['return_rate']")
+
+    for code, rate in return_rates.items():
+        if not _is_number(rate) or not 0 <= rate <= 1:
+            errors.append(f"return_rate[{code}] должен быть в [0, 1], получено {rate!r}")
+
+    for code, tariff in service_tariffs.items():
+        rate_type = tariff.get('rate_type', 'per_order')
+        if rate_type not in RATE_PRICERS:
+            errors.append(f"{code}: неизвестный тип тарифа {rate_type!r}")
+        rate = tariff.get('rate', 0)
+        if not _is_number(rate) or rate < 0:
+            errors.append(f"{code}: rate должен быть неотрицательным числом, получено {rate!r}")
+        min_rate = tariff.get('min_rate', 0)
+        if not _is_number(min_rate) or min_rate < 0:
+            errors.append(f"{code}: min_rate должен быть неотрицательным числом, получено {min_rate!r}")
+        if rate_type == 'per_m3_day' and not _is_number(params.get('storage_coefficient')):
+            errors.append(f"{code}: для per_m3_day нужен CALCULATION_PARAMS['storage_coefficient']")
+        if rate_type == 'per_sku' and not (_is_number(params.get('catalog_skus')) and params['catalog_skus'] >= 0):
+            errors.append(f"{code}: для per_sku нужно неотрицательное CALCULATION_PARAMS['catalog_skus']")
+
+    if params.get('discount_mode', 'progressive') not in DISCOUNT_MODES:
+        errors.append(f"discount_mode должен быть одним из {DISCOUNT_MODES}, получено {params.get('discount_mode')!r}")
+
+    multipliers = params.get('seasonal_multiplier', {})
+    if DEFAULT_SEASON not in multipliers:
+        errors.append(f"В seasonal_multiplier нет сезона по умолчанию {DEFAULT_SEASON!r}")
+    for season, multiplier in multipliers.items():
+        if not _is_number(multiplier) or multiplier <= 0:
+            errors.append(f"seasonal_multiplier[{season}] должен быть положительным, получено {multiplier!r}")
+    for season, periods in params.get('season_ranges', {}).items():
+        if season not in multipliers:
+            errors.append(f"Сезон {season!r} из season_ranges отсутствует в seasonal_multiplier")
+        for period in periods:
+            try:
+                start, end = period
+                _parse_month_day(start)
+                _parse_month_day(end)
+            except (TypeError, ValueError, AttributeError):
+                errors.append(f"Диапазон сезона {season!r} должен быть парой 'ММ-ДД', получено {period!r}")
+
+    for threshold, discount in volume_discounts.items():
+        if not isinstance(threshold, int) or threshold <= 0:
+            errors.append(f"Порог скидки должен быть положительным целым, получено {threshold!r}")
+        if not _is_number(discount) or not 0 <= discount < 1:
+            errors.append(f"Скидка от {threshold} должна быть в [0, 1), получено {discount!r}")
+
+    return errors
+
+
+def compile_tariffs(marketplace_tariffs: dict = None, service_tariffs: dict = None,
+                    volume_discounts: dict = None, params: dict = None, version: str = "") -> TariffTable:
+    """Проверка конфигурации и сборка таблицы цен"""
+    marketplace_tariffs = MARKETPLACE_TARIFFS if marketplace_tariffs is None else marketplace_tariffs
+    service_tariffs = SERVICE_TARIFFS if service_tariffs is None else service_tariffs
+    volume_discounts = VOLUME_DISCOUNTS if volume_discounts is None else volume_discounts
+    params = CALCULATION_PARAMS if params is None else params
+
+    errors = validate_tariffs(marketplace_tariffs, service_tariffs, volume_discounts, params)
+    if errors:
+        raise TariffConfigError("Ошибки в конфигурации тарифов:\n" + "\n".join(errors))
+
+    return_rates = params.get('return_rate', {})
+    marketplaces = {
+        code: MarketplacePricing(
+            code=code,
+            name=tariff.get('name', code),
+            commission_rate=tariff.get('commission_rate', DEFAULT_COMMISSION_RATE),
+            average_order_value=tariff.get('average_order_value', DEFAULT_AVERAGE_ORDER_VALUE),
+            return_rate=return_rates[code]
+        )
+        for code, tariff in marketplace_tariffs.items()
+    }
+    # Для неизвестного маркетплейса берем наибольшую долю возвратов
+    default_marketplace = MarketplacePricing(
+        code='', name='',
+        commission_rate=DEFAULT_COMMISSION_RATE,
+        average_order_value=DEFAULT_AVERAGE_ORDER_VALUE,
+        return_rate=max(return_rates.values(), default=0)
+    )
+
+    services = {}
+    for code, tariff in service_tariffs.items():
+        rate_type = tariff.get('rate_type', 'per_order')
+        services[code] = ServicePricing(
+            code=code,
+            name=tariff.get('name', code),
+            rate=tariff.get('rate', 0),
+            rate_type=rate_type,
+            units=_units(rate_type, params),
+            min_rate=tariff.get('min_rate', 0),
+            price=RATE_PRICERS[rate_type]
+        )
+
+    return TariffTable(
+        marketplaces=MappingProxyType(marketplaces),
+        services=MappingProxyType(services),
+        default_marketplace=default_marketplace,
+        discounts=DiscountSchedule(volume_discounts, params.get('discount_mode', 'progressive')),
+        seasons=SeasonCalendar(params['seasonal_multiplier'], params.get('season_ranges', {})),
+        version=version,
+        config=TariffConfig(
+            marketplaces=_freeze(marketplace_tariffs),
+            services=_freeze(service_tariffs),
+            volume_discounts=_freeze(volume_discounts),
+            params=_freeze(params)
+        )
+    )
+
+
+def _freeze(value):
+    """Глубокая неизменяемая копия конфигурации"""
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def _read_tariffs_file(path: str) -> dict:
+    """Разделы файла тарифов (JSON или TOML); отсутствующие берутся из config/tariffs.py"""
+    with open(path, 'rb') as file:
+        if path.endswith('.toml'):
+            data = tomllib.load(file)
+        else:
+            data = json.load(file)
+    if not isinstance(data, dict):
+        raise TariffConfigError(f"{path}: ожидался объект с разделами marketplaces, services, volume_discounts, params")
+    unknown = set(data) - {'marketplaces', 'services', 'volume_discounts', 'params'}
+    if unknown:
+        raise TariffConfigError(f"{path}: неизвестные разделы {sorted(unknown)}")
+    return data
+
+
+def load_tariffs(path: str = None) -> TariffTable:
+    """
+    Сборка таблицы из файла тарифов или из заново прочитанного config/tariffs.py
+
+    Raises:
+        TariffConfigError: файл не читается или конфигурация не проходит проверку
+    """
+    if path:
+        try:
+            data = _read_tariffs_file(path)
+        except (OSError, ValueError) as e:
+            raise TariffConfigError(f"Не удалось прочитать {path}: {e}") from e
+        module = config.tariffs
+        marketplace_tariffs = data.get('marketplaces', module.MARKETPLACE_TARIFFS)
+        service_tariffs = data.get('services', module.SERVICE_TARIFFS)
+        params = data.get('params', module.CALCULATION_PARAMS)
+        try:
+            # В JSON и TOML ключи - строки, пороги скидок - целые
+            volume_discounts = {int(threshold): discount for threshold, discount in
+                                data.get('volume_discounts', module.VOLUME_DISCOUNTS).items()}
+        except (TypeError, ValueError, AttributeError) as e:
+            raise TariffConfigError(f"{path}: пороги volume_discounts должны быть целыми числами") from e
+    else:
+        try:
+            module = importlib.reload(config.tariffs)
+        except Exception as e:
+            raise TariffConfigError(f"Не удалось перечитать config/tariffs.py: {e}") from e
+        marketplace_tariffs, service_tariffs = module.MARKETPLACE_TARIFFS, module.SERVICE_TARIFFS
+        volume_discounts, params = module.VOLUME_DISCOUNTS, module.CALCULATION_PARAMS
+
+    for name, section in (('marketplaces', marketplace_tariffs), ('services', service_tariffs)):
+        if not isinstance(section, dict) or not all(isinstance(item, dict) for item in section.values()):
+            raise TariffConfigError(f"Раздел {name} должен быть словарем словарей")
+    if not isinstance(params, dict):
+        raise TariffConfigError("Раздел params должен быть словарем")
+
+    version = get_tariffs_version(marketplace_tariffs, service_tariffs, volume_discounts, params)
+    try:
+        return compile_tariffs(marketplace_tariffs, service_tariffs, volume_discounts, params, version=version)
+    except TariffConfigError:
+        raise
+    except (KeyError, TypeError, ValueError) as e:
+        # Проверка не ловит все ошибки структуры, например отсутствие обязательного ключа
+        raise TariffConfigError(f"Ошибка в конфигурации тарифов: {e!r}") from e
+
+
+def check_compatible(current: TariffTable, new: TariffTable) -> None:
+    """Набор маркетплейсов и услуг зашит в меню и разбор вопросов, при перезагрузке он меняться не может"""
+    for name, old_codes, new_codes in (
+        ('маркетплейсов', current.marketplaces, new.marketplaces),
+        ('услуг', current.services, new.services),
+    ):
+        if list(old_codes) != list(new_codes):
+            raise TariffConfigError(
+                f"Состав {name} изменился ({', '.join(old_codes)} -> {', '.join(new_codes)}); "
+                f"это требует изменения кода и перезапуска"
+            )
+
+
+def _flatten(value, prefix: str = "") -> dict:
+    if isinstance(value, Mapping):
+        flat = {}
+        for key, item in value.items():
+            flat.update(_flatten(item, f"{prefix}.{key}" if prefix else str(key)))
+        return flat
+    return {prefix: value}
+
+
+def diff_tariffs(old: TariffTable, new: TariffTable) -> list:
+    """Изменения конфигурации построчно: 'путь: было -> стало'"""
+    before, after = _flatten(old.config._asdict()), _flatten(new.config._asdict())
+    lines = []
+    for path in sorted(before.keys() | after.keys()):
+        if path not in after:
+            lines.append(f"{path}: {before[path]!r} -> удалено")
+        elif path not in before:
+            lines.append(f"{path}: добавлено {after[path]!r}")
+        elif before[path] != after[path]:
+            lines.append(f"{path}: {before[path]!r} -> {after[path]!r}")
+    return lines
+
+
+_tariff_table = None
+
+def get_tariff_table() -> TariffTable:
+    """
+    Текущая таблица цен; собирается при первом обращении
+
+    Расчет, которому нужна согласованная версия, берет таблицу один раз
+    и дальше работает только с ней.
+    """
+    global _tariff_table
+    if _tariff_table is None:
+        if TARIFFS_FILE:
+            _tariff_table = load_tariffs(TARIFFS_FILE)
+        else:
+            _tariff_table = compile_tariffs(version=get_tariffs_version())
+        logger.info(f"Тарифы скомпилированы, версия {_tariff_table.version}")
+    return _tariff_table
+
+
+def set_tariff_table(table: TariffTable) -> TariffTable:
+    """Подмена текущей таблицы (одно присваивание ссылки); возвращает прежнюю"""
+    global _tariff_table
+    previous, _tariff_table = _tariff_table, table
+    return previous
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+"""
+Перезагрузка тарифов без перезапуска бота
+
+Новая конфигурация читается и компилируется в отдельном потоке, затем
+проверяется на совместимость и подменяет текущую таблицу в цикле
+событий. Расчеты, которые уже взяли прежнюю таблицу, досчитываются по
+ней; кеш расчетов очищается, промпт AI-помощника и ключи кеша его
+ответов зависят от версии тарифов и обновляются сами.
+
+Файл TARIFFS_FILE проверяется по времени изменения раз в
+TARIFFS_WATCH_INTERVAL секунд; при ошибке в файле остается прежняя
+версия, а ошибка пишется в лог.
+"""
+
+import asyncio
+import logging
+import os
+
+from bot.quote_cache import quote_cache
+from bot.tariff_engine import (
+    TariffConfigError, check_compatible, diff_tariffs, get_tariff_table, load_tariffs, set_tariff_table
+)
+from config.settings import TARIFFS_FILE, TARIFFS_WATCH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+
+class TariffReloader:
+    """Загрузка новой версии тарифов по команде или при изменении файла"""
+
+    def __init__(self, path: str = "", interval: float = 5.0):
+        self.path = path
+        self.interval = interval
+        self.reloads = 0
+        self._mtime = None
+        self._lock = asyncio.Lock()
+        self._task = None
+
+    async def reload(self) -> list:
+        """
+        Загрузка и подмена тарифов
+
+        Returns:
+            list: Изменения построчно; пустой, если версия не изменилась
+
+        Raises:
+            TariffConfigError: новая конфигурация не прошла проверку, действует прежняя
+        """
+        async with self._lock:
+            self._mtime = self._file_mtime()
+            table = await asyncio.to_thread(load_tariffs, self.path or None)
+            current = get_tariff_table()
+            if table.version == current.version:
+                return []
+            check_compatible(current, table)
+            changes = diff_tariffs(current, table)
+            set_tariff_table(table)
+            quote_cache.clear()
+            self.reloads += 1
+            logger.info(f"Тарифы обновлены: {current.version} -> {table.version}, изменений: {len(changes)}")
+            return changes
+
+    async def start(self) -> None:
+        """Слежение за файлом тарифов, если он задан"""
+        if not self.path or self.interval <= 0:
+            return
+        self._mtime = self._file_mtime()
+        self._task = asyncio.get_running_loop().create_task(self._watch())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def _file_mtime(self):
+        if not self.path:
+            return None
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            if self._file_mtime() == self._mtime:
+                continue
+            try:
+                await self.reload()
+            except TariffConfigError as e:
+                logger.error(f"Новые тарифы из {self.path} не применены: {e}")
+            except Exception as e:
+                logger.error(f"Ошибка перезагрузки тарифов: {e}")
+
+
+# Общий загрузчик тарифов; слежение за файлом запускается из post_init
+tariff_reloader = TariffReloader(TARIFFS_FILE, TARIFFS_WATCH_INTERVAL)
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+
+"""
+Ограничение частоты входящих запросов одного пользователя
+
+Каждое обновление относится к одному классу действий: вопрос AI-
+консультанту (ai, каждый - платный запрос к OpenAI), кнопки калькулятора
+(calculator, каждая - правка сообщения) и все остальное (default). Для
+класса задается лимит запросов за окно в секундах (USER_RATE_LIMITS).
+
+Окно скользящее по приближению двух соседних окон: число запросов в
+прошлом окне берется с весом оставшейся от него доли. Состояние
+пользователя в классе - одно целое число в словаре: около 80 байт, для
+100 тысяч пользователей во всех классах - десятки мегабайт; проверка
+занимает единицы микросекунд.
+
+ThrottleHandler регистрируется в группе -1, до всех обработчиков.
+Лишнее обновление дальше не обрабатывается; пользователь получает одно
+сообщение об ограничении на окно, остальные лишние запросы отклоняются
+без текста (на нажатие кнопки все равно отвечаем, чтобы клиент не
+показывал загрузку). Администраторы и USER_RATE_ALLOWLIST не ограничиваются.
+"""
+
+import logging
+import time
+
+from telegram import Update
+from telegram.error import TelegramError
+from telegram.ext import ApplicationHandlerStop, BaseHandler, ConversationHandler
+
+from bot.messages import MESSAGES
+from config.settings import USER_RATE_LIMITS, USER_RATE_ALLOWLIST
+
+logger = logging.getLogger(__name__)
+
+AI = 'ai'
+CALCULATOR = 'calculator'
+DEFAULT = 'default'
+
+# Кнопки калькулятора: выбор маркетплейса, услуг и действия с расчетом
+CALCULATOR_CALLBACKS = ("calculator", "marketplace_", "service_", "calc_")
+
+_COUNT_BITS = 8
+_COUNT_MASK = (1 << _COUNT_BITS) - 1
+_WARNED = 1 << (2 * _COUNT_BITS)
+_WINDOW_SHIFT = 2 * _COUNT_BITS + 1
+
+
+class SlidingWindowLimit:
+    """
+    Не больше limit запросов пользователя за window секунд
+
+    Состояние пользователя упаковано в одно число:
+    номер окна | уже предупрежден | запросов в прошлом окне | в текущем.
+    """
+
+    # Секунд между чистками давно не обращавшихся пользователей
+    PRUNE_INTERVAL = 300.0
+
+    __slots__ = ('limit', 'window', '_states', '_prune_at')
+
+    def __init__(self, limit: int, window: float):
+        # Счетчики восьмибитные
+        self.limit = min(limit, _COUNT_MASK)
+        self.window = window
+        self._states = {}
+        self._prune_at = 0.0
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def hit(self, user_id: int, now: float):
+        """
+        Учет запроса пользователя
+
+        Returns:
+            None, если запрос разрешен, иначе (секунд до следующего
+            разрешенного запроса, нужно ли предупредить пользователя)
+        """
+        position = now / self.window
+        window_id = int(position)
+        if now >= self._prune_at:
+            self.prune(window_id)
+            self._prune_at = now + max(self.PRUNE_INTERVAL, self.window * 2)
+
+        state = self._states.get(user_id, 0)
+        state_window = state >> _WINDOW_SHIFT
+        if state_window == window_id:
+            previous = (state >> _COUNT_BITS) & _COUNT_MASK
+            current = state & _COUNT_MASK
+            warned = state & _WARNED
+        elif state_window == window_id - 1:
+            previous, current, warned = state & _COUNT_MASK, 0, 0
+        else:
+            previous = current = warned = 0
+
+        elapsed = position - window_id
+        if previous * (1.0 - elapsed) + current < self.limit:
+            self._states[user_id] = (window_id << _WINDOW_SHIFT | warned | previous << _COUNT_BITS
+                                     | min(current + 1, _COUNT_MASK))
+            return None
+
+        self._states[user_id] = window_id << _WINDOW_SHIFT | _WARNED | previous << _COUNT_BITS | current
+        return self._retry_after(previous, current, elapsed), not warned
+
+    def _retry_after(self, previous: int, current: int, elapsed: float) -> float:
+        """Секунд, пока вес прошлого окна не упадет настолько, что запрос пройдет"""
+        if current < self.limit:
+            # Еще в этом окне: previous * (1 - x) + current < limit
+            position = 1.0 - (self.limit - current) / previous
+        else:
+            # В следующем окне текущие запросы станут прошлыми
+            position = 1.0 + max(0.0, 1.0 - self.limit / current) if current else 1.0
+        return max(0.0, position - elapsed) * self.window
+
+    def prune(self, window_id: int) -> None:
+        """Удаление пользователей без запросов в текущем и прошлом окнах (словарь пересобирается и сжимается)"""
+        oldest = window_id - 1
+        self._states = {user_id: state for user_id, state in self._states.items()
+                        if state >> _WINDOW_SHIFT >= oldest}
+
+    def clear(self) -> None:
+        self._states.clear()
+
+
+class UserThrottle:
+    """Лимиты по классам действий и счетчики отказов"""
+
+    def __init__(self, limits: dict, allowlist=frozenset()):
+        # Класс без лимита или с нулевым окном не ограничивается
+        self.limits = {
+            action: SlidingWindowLimit(limit, window)
+            for action, (limit, window) in limits.items() if limit > 0 and window > 0
+        }
+        self.allowlist = frozenset(allowlist)
+        self.rejected = dict.fromkeys(self.limits, 0)
+        self.warned = 0
+
+    def check(self, user_id: int, action: str, now: float = None):
+        """None, если запрос разрешен, иначе (секунд до следующего разрешенного, нужно ли предупредить)"""
+        limit = self.limits.get(action)
+        if limit is None or user_id in self.allowlist:
+            return None
+        verdict = limit.hit(user_id, time.monotonic() if now is None else now)
+        if verdict is not None:
+            self.rejected[action] += 1
+            if verdict[1]:
+                self.warned += 1
+        return verdict
+
+    def tracked(self) -> dict:
+        """Пользователей с недавними запросами по классам"""
+        return {action: len(limit) for action, limit in self.limits.items()}
+
+    def clear(self) -> None:
+        for limit in self.limits.values():
+            limit.clear()
+
+
+class ThrottleHandler(BaseHandler):
+    """
+    Отклонение слишком частых обновлений до остальных обработчиков
+
+    check_update сам учитывает запрос, поэтому разрешенное обновление
+    стоит одной проверки словаря, а обработчик вызывается только для
+    отклоненного. Текстовое сообщение пользователя, находящегося в диалоге
+    ai_conversation, считается вопросом к AI.
+    """
+
+    __slots__ = ('throttle', 'ai_conversation')
+
+    def __init__(self, throttle: UserThrottle, ai_conversation: ConversationHandler = None):
+        super().__init__(self.reject_update)
+        self.throttle = throttle
+        self.ai_conversation = ai_conversation
+
+    def classify(self, update: Update, user_id: int) -> str:
+        query = update.callback_query
+        if query is not None:
+            return CALCULATOR if (query.data or "").startswith(CALCULATOR_CALLBACKS) else DEFAULT
+        message = update.message
+        if (message is not None and message.text and not message.text.startswith("/")
+                and self.ai_conversation is not None
+                # Ключ диалога при per_chat и per_user; публичного доступа к диалогам нет
+                and (message.chat_id, user_id) in self.ai_conversation._conversations):
+            return AI
+        return DEFAULT
+
+    def check_update(self, update: object):
+        if not isinstance(update, Update):
+            return None
+        user = update.effective_user
+        if user is None:
+            return None
+        action = self.classify(update, user.id)
+        verdict = self.throttle.check(user.id, action)
+        return None if verdict is None else (action, *verdict)
+
+    def collect_additional_context(self, context, update, application, check_result) -> None:
+        context.rate_limit = check_result
+
+    async def handle_update(self, update, application, check_result, context):
+        self.collect_additional_context(context, update, application, check_result)
+        await self.callback(update, context)
+        # Вне колбэка, чтобы обертка метрик не считала остановку ошибкой
+        raise ApplicationHandlerStop
+
+    async def reject_update(self, update: Update, context) -> None:
+        """Одно сообщение об ограничении на окно; остальные отказы без текста"""
+        action, retry_after, warn = context.rate_limit
+        if not warn:
+            if update.callback_query is not None:
+                try:
+                    # answerCallbackQuery не входит в лимиты отправок, а без него клиент крутит загрузку
+                    await update.callback_query.answer()
+                except TelegramError as e:
+                    logger.debug(f"Ответ на нажатие не отправлен: {e}")
+            return
+        limit = self.throttle.limits[action]
+        seconds = max(1, round(retry_after))
+        if action == AI:
+            text = MESSAGES['ai_rate_limited'].format(limit=limit.limit, minutes=max(1, round(limit.window / 60)),
+                                                      seconds=seconds)
+        else:
+            text = MESSAGES['rate_limited'].format(seconds=seconds)
+        logger.info(f"Пользователь {update.effective_user.id} превысил лимит {action}")
+        try:
+            if update.callback_query is not None:
+                await update.callback_query.answer(text=text)
+            elif update.effective_message is not None:
+                await update.effective_message.reply_text(text=text)
+        except TelegramError as e:
+            logger.debug(f"Сообщение об ограничении не отправлено: {e}")
+
+
+# Общие лимиты пользователей; обработчик добавляется в build_application
+user_throttle = UserThrottle(USER_RATE_LIMITS, USER_RATE_ALLOWLIST)
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+"""
+Параллельная обработка обновлений с сохранением порядка внутри чата
+"""
+
+import asyncio
+import logging
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+# Потолок ожидающих обновлений для базового семафора PTB. Реальный
+# параллелизм ограничивает число воркеров; базовый семафор не должен
+# блокировать, иначе порядок входа в do_process_update не гарантирован.
+_MAX_PENDING_UPDATES = 100000
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Обработчик обновлений: до `workers` обновлений одновременно,
+    но обновления одного чата - строго по очереди и в порядке поступления
+
+    Это нужно ConversationHandler: состояние диалога читается и
+    записывается в обработчике, и два обновления одного чата не должны
+    обрабатываться параллельно.
+    """
+
+    __slots__ = ('workers', '_workers_semaphore', '_chat_tails')
+
+    def __init__(self, workers: int):
+        super().__init__(max_concurrent_updates=_MAX_PENDING_UPDATES)
+        self.workers = workers
+        self._workers_semaphore = asyncio.BoundedSemaphore(workers)
+        # chat_id -> future завершения последнего поставленного в очередь обновления чата
+        self._chat_tails = {}
+
+    @property
+    def pending_chats(self) -> int:
+        """Число чатов, у которых есть обновления в обработке или в очереди"""
+        return len(self._chat_tails)
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            async with self._workers_semaphore:
+                await coroutine
+            return
+
+        chat_id = chat.id
+        previous = self._chat_tails.get(chat_id)
+        done = asyncio.get_running_loop().create_future()
+        self._chat_tails[chat_id] = done
+        try:
+            if previous is not None:
+                # Ждем завершения предыдущего обновления этого же чата
+                try:
+                    await asyncio.shield(previous)
+                except asyncio.CancelledError:
+                    coroutine.close()
+                    raise
+            async with self._workers_semaphore:
+                await coroutine
+        finally:
+            done.set_result(None)
+            if self._chat_tails.get(chat_id) is done:
+                del self._chat_tails[chat_id]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
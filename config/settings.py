@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+"""
+Параметры работы бота, задаваемые через переменные окружения
+"""
+
+import os
+
+
+def _env_int(name: str, default: int) -> int:
+    """Целочисленный параметр из окружения"""
+    value = os.getenv(name, "").strip()
+    return int(value) if value else default
+
+
+def _env_float(name: str, default: float) -> float:
+    """Дробный параметр из окружения"""
+    value = os.getenv(name, "").strip()
+    return float(value) if value else default
+
+
+def _env_int_list(name: str) -> frozenset:
+    """Набор целых чисел из окружения через запятую"""
+    value = os.getenv(name, "")
+    return frozenset(int(item) for item in value.replace(" ", "").split(",") if item)
+
+
+# AI-консультант
+AI_MAX_CONCURRENCY = _env_int("AI_MAX_CONCURRENCY", 8)  # Одновременных запросов к OpenAI
+AI_REQUEST_TIMEOUT = _env_float("AI_REQUEST_TIMEOUT", 30.0)  # Секунд на один ответ
+AI_MAX_RETRIES = _env_int("AI_MAX_RETRIES", 1)
+AI_KEEPALIVE_EXPIRY = _env_float("AI_KEEPALIVE_EXPIRY", 120.0)  # Секунд простоя keep-alive соединения
+
+# Кеш ответов AI-консультанта
+AI_CACHE_SIZE = _env_int("AI_CACHE_SIZE", 2000)  # Записей в памяти
+AI_CACHE_TTL = _env_float("AI_CACHE_TTL", 6 * 3600)  # Секунд жизни ответа
+AI_CACHE_DB = os.getenv("AI_CACHE_DB", "").strip()  # Путь к SQLite; пусто - только память
+AI_CACHE_SIMILARITY = _env_float("AI_CACHE_SIMILARITY", 0.0)  # Порог похожести вопросов; 0 - только точное совпадение
+
+# Кеш готовых расчетов калькулятора
+QUOTE_CACHE_SIZE = _env_int("QUOTE_CACHE_SIZE", 1000)  # Записей в памяти
+
+# Потоковые ответы AI-консультанта
+AI_STREAMING = os.getenv("AI_STREAMING", "1").strip().lower() not in ("0", "false", "no")
+AI_STREAM_EDIT_INTERVAL = _env_float("AI_STREAM_EDIT_INTERVAL", 1.0)  # Секунд между правками сообщения
+AI_STREAM_EDIT_CHARS = _env_int("AI_STREAM_EDIT_CHARS", 400)  # Или после стольких новых символов
+
+# Быстрые шаблонные ответы без GPT; порог выше 1 отключает их
+AI_FAST_PATH_THRESHOLD = _env_float("AI_FAST_PATH_THRESHOLD", 0.8)
+
+# Учет последнего сообщения бота в чате для правки меню
+MESSAGE_TRACKER_SIZE = _env_int("MESSAGE_TRACKER_SIZE", 10000)  # Чатов в памяти
+
+# Реестр загруженных в Telegram медиафайлов (file_id по хешу содержимого)
+MEDIA_REGISTRY_PATH = os.getenv("MEDIA_REGISTRY_PATH", "data/media_registry.json").strip()
+
+# Режим получения обновлений: polling или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling").strip().lower()
+
+# Вебхук; TLS обычно завершается на прокси, бот слушает обычный HTTP
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").strip().rstrip("/")  # Публичный https-адрес бота
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram").strip()
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0").strip()
+WEBHOOK_PORT = _env_int("WEBHOOK_PORT", 8080)
+WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN", "").strip()  # Пусто - случайный токен при каждом запуске
+WEBHOOK_MAX_CONNECTIONS = _env_int("WEBHOOK_MAX_CONNECTIONS", 40)  # Параллельных соединений от Telegram (1-100)
+WEBHOOK_TLS_CERT = os.getenv("WEBHOOK_TLS_CERT", "").strip()  # Сертификат, если TLS без прокси
+WEBHOOK_TLS_KEY = os.getenv("WEBHOOK_TLS_KEY", "").strip()
+
+# Параллельная обработка обновлений; 1 - строго последовательно
+UPDATE_WORKERS = _env_int("UPDATE_WORKERS", 16)
+
+# Сохранение диалогов и user_data между перезапусками (SQLite); пусто - только память
+PERSISTENCE_DB = os.getenv("PERSISTENCE_DB", "data/bot_state.sqlite3").strip()
+PERSISTENCE_FLUSH_INTERVAL = _env_float("PERSISTENCE_FLUSH_INTERVAL", 5.0)  # Секунд между записями на диск
+SESSION_TTL = _env_float("SESSION_TTL", 1800.0)  # Секунд простоя до выгрузки сессии из памяти; 0 - не выгружать
+SESSION_SWEEP_INTERVAL = _env_float("SESSION_SWEEP_INTERVAL", 60.0)  # Секунд между проверками
+
+# Брошенные диалоги: секунд без действий пользователя до сброса диалога; 0 - без ограничения
+CONVERSATION_TIMEOUTS = {
+    'calculator': _env_float("CALCULATOR_TIMEOUT", 1800.0),
+    'application': _env_float("APPLICATION_TIMEOUT", 3600.0),
+    'ai_chat': _env_float("AI_CHAT_TIMEOUT", 1800.0),
+}
+CONVERSATION_EXPIRED_NOTICE = os.getenv("CONVERSATION_EXPIRED_NOTICE", "1").strip().lower() not in ("0", "false", "no")
+CONVERSATION_SWEEP_BATCH = _env_int("CONVERSATION_SWEEP_BATCH", 500)  # Диалогов за один шаг, между шагами цикл свободен
+
+# Заявки клиентов: журнал SQLite и приемники; пустой приемник отключен
+LEADS_DB = os.getenv("LEADS_DB", "data/leads.sqlite3").strip()
+LEADS_ADMIN_CHAT_ID = _env_int("LEADS_ADMIN_CHAT_ID", 0)  # Чат администратора в Telegram
+LEADS_WEBHOOK_URL = os.getenv("LEADS_WEBHOOK_URL", "").strip()  # POST пачки заявок в CRM
+LEADS_WEBHOOK_TOKEN = os.getenv("LEADS_WEBHOOK_TOKEN", "").strip()
+LEADS_EMAIL_SPOOL = os.getenv("LEADS_EMAIL_SPOOL", "").strip()  # Папка для .eml файлов
+LEADS_EMAIL_TO = os.getenv("LEADS_EMAIL_TO", "").strip()
+LEADS_BATCH_SIZE = _env_int("LEADS_BATCH_SIZE", 20)  # Заявок в одной доставке
+LEADS_FLUSH_INTERVAL = _env_float("LEADS_FLUSH_INTERVAL", 2.0)  # Секунд между проверками очереди
+LEADS_MAX_ATTEMPTS = _env_int("LEADS_MAX_ATTEMPTS", 8)  # Попыток доставки в один приемник
+LEADS_RETRY_BASE = _env_float("LEADS_RETRY_BASE", 5.0)  # Секунд до первого повтора, дальше вдвое больше
+LEADS_RETRY_MAX = _env_float("LEADS_RETRY_MAX", 600.0)
+
+# Ограничение частоты отправок в Telegram; 0 снимает лимит
+RATE_LIMIT_OVERALL = _env_float("RATE_LIMIT_OVERALL", 30.0)  # Сообщений в секунду всего
+RATE_LIMIT_CHAT = _env_float("RATE_LIMIT_CHAT", 1.0)  # Сообщений в секунду в личный чат
+RATE_LIMIT_CHAT_BURST = _env_float("RATE_LIMIT_CHAT_BURST", 3.0)  # Короткий всплеск в личный чат
+RATE_LIMIT_GROUP_PER_MINUTE = _env_float("RATE_LIMIT_GROUP_PER_MINUTE", 20.0)  # Сообщений в минуту в группу
+RATE_LIMIT_MAX_RETRIES = _env_int("RATE_LIMIT_MAX_RETRIES", 3)  # Повторов после RetryAfter
+# Правки потокового ответа AI не чаще лимита отправок в личный чат, иначе они копятся в ограничителе
+AI_STREAM_MIN_EDIT_INTERVAL = 1 / RATE_LIMIT_CHAT if RATE_LIMIT_CHAT > 0 else 0.0
+
+# Реестр пользователей и рассылки
+USERS_DB = os.getenv("USERS_DB", "data/users.sqlite3").strip()
+ADMIN_USER_IDS = _env_int_list("ADMIN_USER_IDS")  # Telegram id администраторов через запятую
+BROADCAST_WORKERS = _env_int("BROADCAST_WORKERS", 20)  # Одновременных отправок
+BROADCAST_PAGE_SIZE = _env_int("BROADCAST_PAGE_SIZE", 500)  # Чатов между контрольными точками
+BROADCAST_PROGRESS_INTERVAL = _env_float("BROADCAST_PROGRESS_INTERVAL", 15.0)  # Секунд между отчетами о ходе
+
+# Частота запросов одного пользователя: (запросов, за сколько секунд); 0 запросов - без ограничения
+USER_RATE_LIMITS = {
+    'ai': (_env_int("USER_RATE_AI", 5), _env_float("USER_RATE_AI_WINDOW", 60.0)),  # Вопросы к AI-консультанту
+    'calculator': (_env_int("USER_RATE_CALCULATOR", 20), _env_float("USER_RATE_CALCULATOR_WINDOW", 10.0)),
+    'default': (_env_int("USER_RATE_DEFAULT", 30), _env_float("USER_RATE_DEFAULT_WINDOW", 10.0)),
+}
+USER_RATE_ALLOWLIST = ADMIN_USER_IDS | _env_int_list("USER_RATE_ALLOWLIST")  # Без ограничений, кроме администраторов
+
+# Метрики Prometheus
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1").strip()  # Только локально по умолчанию
+METRICS_PORT = _env_int("METRICS_PORT", 9100)  # 0 - эндпоинт /metrics выключен
+
+# Тарифы
+TARIFFS_FILE = os.getenv("TARIFFS_FILE", "").strip()  # JSON или TOML; пусто - config/tariffs.py
+TARIFFS_WATCH_INTERVAL = _env_float("TARIFFS_WATCH_INTERVAL", 5.0)  # Секунд между проверками файла; 0 - не следить
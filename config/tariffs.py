@@ -4,6 +4,9 @@
 Конфигурация тарифов для различных маркетплейсов и услуг
 """
 
+import hashlib
+import json
+
 # Тарифы маркетплейсов
 MARKETPLACE_TARIFFS = {
     'wildberries': {
@@ -118,8 +121,8 @@ SERVICE_TARIFFS = {
     },
     'photo': {
         'name': 'Фотосъемка товаров',
-        'rate': 150,  # руб за товар
-        'rate_type': 'per_item',
+        'rate': 150,  # руб за товар каталога, а не за каждый заказ
+        'rate_type': 'per_sku',
         'description': 'Профессиональная предметная съемка',
         'features': [
             'Студийная съемка',
@@ -152,6 +155,10 @@ VOLUME_DISCOUNTS = {
 # Дополнительные параметры расчета
 CALCULATION_PARAMS = {
     'storage_coefficient': 0.02,  # м³ на один заказ в среднем
+    'storage_days': 30,           # Дней хранения в расчетном месяце
+    'items_per_order': 1,         # Товаров в одном заказе в среднем
+    'catalog_skus': 10,           # Новых товаров каталога в месяц (для тарифов per_sku, например фотосъемки)
+    'discount_mode': 'progressive',  # progressive - на весь объем, marginal - только сверх порога
     'return_rate': {  # Процент возвратов по маркетплейсам
         'wildberries': 0.15,  # 15%
         'ozon': 0.12,         # 12%
@@ -161,5 +168,24 @@ CALCULATION_PARAMS = {
         'high': 1.2,    # Высокий сезон
         'normal': 1.0,  # Обычный период
         'low': 0.9      # Низкий сезон
+    },
+    'season_ranges': {  # Периоды сезонов ('ММ-ДД', 'ММ-ДД') включительно; остальные дни - normal
+        'high': [('11-01', '12-31')],  # Ноябрь-декабрь: распродажи и праздники
+        'low': []
     }
 }
+
+
+def get_tariffs_version(marketplace_tariffs: dict = None, service_tariffs: dict = None,
+                        volume_discounts: dict = None, params: dict = None) -> str:
+    """Версия тарифов - хеш содержимого конфигурации; не переданные разделы берутся из этого модуля"""
+    content = json.dumps(
+        [
+            MARKETPLACE_TARIFFS if marketplace_tariffs is None else marketplace_tariffs,
+            SERVICE_TARIFFS if service_tariffs is None else service_tariffs,
+            VOLUME_DISCOUNTS if volume_discounts is None else volume_discounts,
+            CALCULATION_PARAMS if params is None else params,
+        ],
+        sort_keys=True, ensure_ascii=False, default=str
+    )
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()[:12]
@@ -8,15 +8,36 @@ import sys
 # Токены будут взяты из переменных окружения Replit (используйте Secrets в Replit)
 # TELEGRAM_BOT_TOKEN и OPENAI_API_KEY должны быть настроены в Secrets
 
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ConversationHandler
+from telegram.ext import (
+    Application, BasePersistence, BaseRateLimiter, BaseUpdateProcessor, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ConversationHandler,
+    ContextTypes, TypeHandler
+)
+from telegram import Update
+from telegram.request import BaseRequest
 from bot.handlers import (
-    start, help_command, company_info, services_info, advantages,
+    start, help_command, broadcast_command, reload_tariffs_command, memory_command, company_info, services_info, advantages,
     button_callback, handle_calculator_start, handle_marketplace_choice,
     handle_orders_count, handle_services_choice, handle_calculation_result,
     handle_application_start, handle_application_name, handle_application_contact,
     handle_application_description, handle_application_complete,
     handle_ai_chat_start, handle_ai_examples, handle_ai_ask_question, handle_ai_question
 )
+from bot.ai_assistant import get_ai_assistant, close_ai_assistant
+from bot.broadcast import broadcaster
+from bot.instrumentation import instrument_application, metrics_server
+from bot.leads import lead_dispatcher, create_sinks
+from bot.persistence import SQLitePersistence
+from bot.rate_limiter import PriorityRateLimiter
+from bot.runner import run_application
+from bot.session import UserSession, session_sweeper, touch_session
+from bot.tariff_engine import get_tariff_table
+from bot.throttle import ThrottleHandler, user_throttle
+from bot.tariff_reload import tariff_reloader
+from bot.update_processor import ChatOrderedUpdateProcessor
+from config.settings import (
+    UPDATE_WORKERS, PERSISTENCE_DB, PERSISTENCE_FLUSH_INTERVAL, RATE_LIMIT_OVERALL, RATE_LIMIT_CHAT,
+    RATE_LIMIT_CHAT_BURST, RATE_LIMIT_GROUP_PER_MINUTE, RATE_LIMIT_MAX_RETRIES, METRICS_LISTEN, METRICS_PORT
+)
 from bot.states import (
     MARKETPLACE_CHOICE, ORDERS_COUNT, SERVICES_CHOICE, CALCULATION_RESULT,
     APPLICATION_NAME, APPLICATION_CONTACT, APPLICATION_DESCRIPTION, AI_CHAT
@@ -29,19 +50,68 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def main():
-    """Основная функция запуска бота"""
-    # Получаем токен бота из переменных окружения
-    bot_token = os.getenv("TELEGRAM_BOT_TOKEN", "").strip()
+async def post_init(application: Application) -> None:
+    """Запуск фоновых задач после инициализации бота"""
+    lead_dispatcher.sinks = create_sinks(application.bot)
+    await lead_dispatcher.start()
+    await broadcaster.start(application.bot)
+    await tariff_reloader.start()
+    await session_sweeper.start(application)
+    if METRICS_PORT:
+        await metrics_server.start(METRICS_LISTEN, METRICS_PORT, application)
+
+async def post_stop(application: Application) -> None:
+    """Доставка оставшихся заявок, пока бот еще может отправлять сообщения"""
+    await tariff_reloader.stop()
+    await session_sweeper.stop()
+    await broadcaster.stop()
+    await lead_dispatcher.stop()
+
+async def post_shutdown(application: Application) -> None:
+    """Освобождение ресурсов при остановке бота"""
+    await metrics_server.stop()
+    await close_ai_assistant()
+
+def build_application(bot_token: str, request: BaseRequest = None,
+                      update_processor: BaseUpdateProcessor = None,
+                      persistence: BasePersistence = None,
+                      rate_limiter: BaseRateLimiter = None,
+                      instrument: bool = True) -> Application:
+    """Создание приложения со всеми обработчиками"""
+    builder = (
+        Application.builder().token(bot_token)
+        .post_init(post_init).post_stop(post_stop).post_shutdown(post_shutdown)
+        # user_data - компактная сессия со __slots__, а не словарь
+        .context_types(ContextTypes(user_data=UserSession))
+    )
     
-    if not bot_token:
-        logger.error("TELEGRAM_BOT_TOKEN не найден в переменных окружения!")
-        return
+    # Состояния диалогов и user_data переживают перезапуск
+    if persistence is not None:
+        builder = builder.persistence(persistence)
+    persistent = persistence is not None
     
-    logger.info(f"Запуск бота с токеном: {bot_token[:20]}...")
+    # Параллельная обработка обновлений разных чатов, внутри чата - по порядку
+    if update_processor is None and UPDATE_WORKERS > 1:
+        update_processor = ChatOrderedUpdateProcessor(UPDATE_WORKERS)
+    if update_processor is not None:
+        builder = builder.concurrent_updates(update_processor)
     
-    # Создаем приложение
-    application = Application.builder().token(bot_token).build()
+    # Отправки распределяются под лимиты Telegram, ответы пользователям идут раньше рассылок
+    if rate_limiter is None:
+        rate_limiter = PriorityRateLimiter(
+            overall_rate=RATE_LIMIT_OVERALL,
+            chat_rate=RATE_LIMIT_CHAT,
+            chat_burst=RATE_LIMIT_CHAT_BURST,
+            group_rate=RATE_LIMIT_GROUP_PER_MINUTE / 60,
+            max_retries=RATE_LIMIT_MAX_RETRIES
+        )
+    builder = builder.rate_limiter(rate_limiter)
+    
+    # Подмена транспорта к Bot API (для нагрузочных тестов)
+    if request is not None:
+        builder = builder.request(request).get_updates_request(request)
+    
+    application = builder.build()
     
     # Создаем ConversationHandler для калькулятора
     calculator_handler = ConversationHandler(
@@ -52,7 +122,9 @@ def main():
             SERVICES_CHOICE: [CallbackQueryHandler(handle_services_choice, pattern="^service_")],
             CALCULATION_RESULT: [CallbackQueryHandler(handle_calculation_result, pattern="^calc_")]
         },
-        fallbacks=[CommandHandler('start', start)]
+        fallbacks=[CommandHandler('start', start)],
+        name="calculator",
+        persistent=persistent
     )
     
     # Создаем ConversationHandler для подачи заявки
@@ -63,7 +135,9 @@ def main():
             APPLICATION_CONTACT: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_application_contact)],
             APPLICATION_DESCRIPTION: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_application_description)]
         },
-        fallbacks=[CommandHandler('start', start)]
+        fallbacks=[CommandHandler('start', start)],
+        name="application",
+        persistent=persistent
     )
     
     # Создаем ConversationHandler для AI-чата
@@ -76,23 +150,66 @@ def main():
                 CallbackQueryHandler(handle_ai_ask_question, pattern="^ai_ask_question$")
             ]
         },
-        fallbacks=[CommandHandler('start', start)]
+        fallbacks=[CommandHandler('start', start)],
+        name="ai_chat",
+        persistent=persistent
     )
     
-    # Добавляем обработчики
+    # Добавляем обработчики; время обращения отмечается до всех остальных (для таймаутов диалогов)
+    application.add_handler(TypeHandler(Update, touch_session), group=-2)
+    # Слишком частые запросы одного пользователя отклоняются до всех обработчиков
+    application.add_handler(ThrottleHandler(user_throttle, ai_chat_handler), group=-1)
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(CommandHandler("broadcast", broadcast_command))
+    application.add_handler(CommandHandler("reload_tariffs", reload_tariffs_command))
+    application.add_handler(CommandHandler("memory", memory_command))
     application.add_handler(calculator_handler)
     application.add_handler(application_handler)
     application.add_handler(ai_chat_handler)
     application.add_handler(CallbackQueryHandler(button_callback))
     
+    # Гистограммы времени обработчиков и сборщики для /metrics
+    if instrument:
+        instrument_application(application)
+    
+    return application
+
+def main():
+    """Основная функция запуска бота"""
+    # Получаем токен бота из переменных окружения
+    bot_token = os.getenv("TELEGRAM_BOT_TOKEN", "").strip()
+    
+    if not bot_token:
+        logger.error("TELEGRAM_BOT_TOKEN не найден в переменных окружения!")
+        return
+    
+    logger.info(f"Запуск бота с токеном: {bot_token[:20]}...")
+    
+    # Проверяем и компилируем тарифы до старта: ошибка конфигурации останавливает запуск
+    get_tariff_table()
+    
+    # Создаем общий AI-помощник с постоянным пулом соединений
+    try:
+        ai_assistant = get_ai_assistant()
+        logger.info(f"AI-помощник готов, версия системного промпта: {ai_assistant.prompt_version}")
+    except Exception as e:
+        logger.warning(f"AI-помощник недоступен: {e}")
+    
+    # Создаем приложение
+    persistence = None
+    if PERSISTENCE_DB:
+        persistence = SQLitePersistence(PERSISTENCE_DB, update_interval=PERSISTENCE_FLUSH_INTERVAL,
+                                        session_type=UserSession)
+        logger.info(f"Состояние диалогов сохраняется в {PERSISTENCE_DB}")
+    application = build_application(bot_token, persistence=persistence)
+    
     # Запускаем бота
     logger.info("🚀 Запуск Telegram-бота Надежные-решения.рф")
     logger.info("✅ Бот готов к работе! Найдите его в Telegram и отправьте /start")
     
     try:
-        application.run_polling(allowed_updates=['message', 'callback_query'])
+        run_application(application, allowed_updates=['message', 'callback_query'])
     except Exception as e:
         logger.error(f"Ошибка запуска бота: {e}")
 
@@ -4,9 +4,61 @@
 Форматтеры для вывода результатов расчетов
 """
 
-from config.tariffs import MARKETPLACE_TARIFFS, SERVICE_TARIFFS
+import html
+import re
 
-def format_calculation_result(result: dict, marketplace: str, orders_count: int, selected_services: list) -> str:
+from bot.tariff_engine import TariffTable, get_tariff_table
+
+# Теги, которые Telegram поддерживает в parse_mode='HTML' и которые мы пропускаем
+_ALLOWED_TAGS = ('b', 'i', 'u', 's', 'code', 'pre')
+_ESCAPED_TAG_RE = re.compile(r"&lt;(/?)(" + "|".join(_ALLOWED_TAGS) + r")&gt;")
+_MARKDOWN_BOLD_RE = re.compile(r"\*\*(.+?)\*\*")
+_TAG_RE = re.compile(r"<(/?)(" + "|".join(_ALLOWED_TAGS) + r")>")
+
+SEASON_NAMES = {
+    'high': 'высокий сезон',
+    'normal': 'обычный период',
+    'low': 'низкий сезон'
+}
+
+MARKETPLACE_DISPLAY_NAMES = {
+    'wildberries': '🛍 Wildberries',
+    'ozon': '📦 Ozon',
+    'yandex': '🟡 Яндекс Маркет'
+}
+
+_RESULT_HEADER = """
+💰 <b>Результат расчета стоимости</b>
+
+<b>📊 Параметры расчета:</b>
+• Маркетплейс: {marketplace}
+• Количество заказов в месяц: {orders_count:,}
+
+<b>🛠 Выбранные услуги:</b>
+"""
+
+_RESULT_TOTALS = """
+<b>💸 Расчет стоимости:</b>
+• Услуги фулфилмента: {services_cost:,.0f} руб/мес
+• Комиссии маркетплейса: {marketplace_commission:,.0f} руб/мес
+
+<b>🎯 ИТОГО: {total_cost:,.0f} руб/мес</b>
+<b>📈 Стоимость за заказ: {cost_per_order:.0f} руб</b>
+
+<b>💡 Дополнительная информация:</b>
+"""
+
+_RESULT_FOOTER = """
+<b>⚡ Что дальше?</b>
+• Подайте заявку для получения персонального предложения
+• Наш менеджер свяжется с вами в течение 2 часов
+• Обсудим детали и запустим сотрудничество
+
+<i>* Расчет является примерным. Точная стоимость определяется после анализа ваших потребностей.</i>
+"""
+
+def format_calculation_result(result: dict, marketplace: str, orders_count: int, selected_services: list,
+                              tariffs: TariffTable = None) -> str:
     """
     Форматирование результата расчета для вывода пользователю
     
@@ -15,96 +67,80 @@ def format_calculation_result(result: dict, marketplace: str, orders_count: int,
         marketplace: Название маркетплейса
         orders_count: Количество заказов
         selected_services: Список выбранных услуг
+        tariffs: Таблица тарифов, по которой сделан расчет (по умолчанию текущая)
     
     Returns:
         str: Отформатированный текст результата
     """
-    
-    marketplace_names = {
-        'wildberries': '🛍 Wildberries',
-        'ozon': '📦 Ozon',
-        'yandex': '🟡 Яндекс Маркет'
-    }
-    
-    marketplace_display = marketplace_names.get(marketplace, marketplace)
-    
-    text = f"""
-💰 <b>Результат расчета стоимости</b>
-
-<b>📊 Параметры расчета:</b>
-• Маркетплейс: {marketplace_display}
-• Количество заказов в месяц: {orders_count:,}
-
-<b>🛠 Выбранные услуги:</b>
-"""
+    tariffs = tariffs or get_tariff_table()
+    marketplace_display = MARKETPLACE_DISPLAY_NAMES.get(marketplace, marketplace)
+    parts = [_RESULT_HEADER.format(marketplace=marketplace_display, orders_count=orders_count)]
     
     # Детализация по услугам
     total_services_cost = 0
-    for service_code, service_data in result['services'].items():
-        service_name = service_data['name']
+    for service_data in result['services'].values():
         service_cost = service_data['cost']
-        rate = service_data['rate']
-        rate_type = service_data['rate_type']
-        
         total_services_cost += service_cost
-        
-        # Форматирование тарифа
-        if rate_type == 'per_order':
-            rate_text = f"{rate} руб/заказ"
-        elif rate_type == 'monthly':
-            rate_text = f"{rate} руб/месяц"
-        elif rate_type == 'per_item':
-            rate_text = f"{rate} руб/товар"
-        elif rate_type == 'per_m3_day':
-            rate_text = f"{rate} руб/м³/день"
-        else:
-            rate_text = f"{rate}"
-        
-        text += f"  • {service_name}: {service_cost:,.0f} руб ({rate_text})\n"
+        parts.append(
+            f"  • {service_data['name']}: {service_cost:,.0f} руб "
+            f"({format_rate(service_data['rate'], service_data['rate_type'])})\n"
+        )
     
     # Итоговые суммы
-    text += f"""
-<b>💸 Расчет стоимости:</b>
-• Услуги фулфилмента: {total_services_cost:,.0f} руб/мес
-• Комиссии маркетплейса: {result['marketplace_commission']:,.0f} руб/мес
-
-<b>🎯 ИТОГО: {result['total_cost']:,.0f} руб/мес</b>
-<b>📈 Стоимость за заказ: {result['cost_per_order']:.0f} руб</b>
-
-<b>💡 Дополнительная информация:</b>
-"""
+    parts.append(_RESULT_TOTALS.format(
+        services_cost=total_services_cost,
+        marketplace_commission=result['marketplace_commission'],
+        total_cost=result['total_cost'],
+        cost_per_order=result['cost_per_order']
+    ))
     
     # Добавляем информацию о скидках
-    volume_discount = _get_volume_discount_info(orders_count)
+    volume_discount = _get_volume_discount_info(orders_count, tariffs)
     if volume_discount:
-        text += f"• {volume_discount}\n"
+        parts.append(f"• {volume_discount}\n")
     
-    # Информация о маркетплейсе
-    marketplace_info = MARKETPLACE_TARIFFS.get(marketplace, {})
-    commission_rate = marketplace_info.get('commission_rate', 0) * 100
-    text += f"• Комиссия {marketplace_display}: {commission_rate}%\n"
+    # Сезонный коэффициент
+    seasonal_multiplier = result.get('seasonal_multiplier', 1.0)
+    if seasonal_multiplier != 1.0:
+        season_name = SEASON_NAMES.get(result.get('season'), result.get('season'))
+        parts.append(f"• Сезонный коэффициент на услуги: ×{seasonal_multiplier:g} ({season_name})\n")
     
-    text += """
-<b>⚡ Что дальше?</b>
-• Подайте заявку для получения персонального предложения
-• Наш менеджер свяжется с вами в течение 2 часов
-• Обсудим детали и запустим сотрудничество
-
-<i>* Расчет является примерным. Точная стоимость определяется после анализа ваших потребностей.</i>
-"""
+    # Информация о маркетплейсе
+    commission_rate = tariffs.config.marketplaces.get(marketplace, {}).get('commission_rate', 0) * 100
+    parts.append(f"• Комиссия {marketplace_display}: {commission_rate}%\n")
     
-    return text
+    parts.append(_RESULT_FOOTER)
+    return "".join(parts)
 
-def _get_volume_discount_info(orders_count: int) -> str:
+def _get_volume_discount_info(orders_count: int, tariffs: TariffTable = None) -> str:
     """Получение информации о скидке за объем"""
-    if orders_count >= 10000:
-        return "🎉 Скидка за объем: 15% (от 10,000 заказов)"
-    elif orders_count >= 5000:
-        return "🎉 Скидка за объем: 10% (от 5,000 заказов)"
-    elif orders_count >= 1000:
-        return "🎉 Скидка за объем: 5% (от 1,000 заказов)"
-    else:
+    discounts = (tariffs or get_tariff_table()).discounts
+    tier = discounts.tier(orders_count)
+    if tier is None:
         return ""
+    threshold, rate = tier
+    if discounts.mode == 'marginal':
+        return (f"🎉 Скидка за объем: {rate * 100:g}% на заказы сверх {threshold:,} "
+                f"(в среднем {discounts.discount(orders_count) * 100:.1f}%)")
+    return f"🎉 Скидка за объем: {rate * 100:g}% (от {threshold:,} заказов)"
+
+RATE_UNITS = {
+    'per_order': 'руб/заказ',
+    'monthly': 'руб/месяц',
+    'per_item': 'руб/товар',
+    'per_sku': 'руб/товар каталога',
+    'per_return': 'руб/возврат',
+    'per_m3_day': 'руб/м³/день',
+    'percentage': '% от суммы заказа'
+}
+
+def format_rate(rate: float, rate_type: str) -> str:
+    """Форматирование тарифа с единицей измерения"""
+    unit = RATE_UNITS.get(rate_type)
+    if rate_type == 'percentage':
+        # Процентная ставка хранится долей
+        return f"{rate * 100:g}{unit}"
+    return f"{rate} {unit}" if unit else f"{rate}"
 
 def format_currency(amount: float) -> str:
     """Форматирование денежных сумм"""
@@ -112,7 +148,7 @@ def format_currency(amount: float) -> str:
 
 def format_service_description(service_code: str) -> str:
     """Получение описания услуги"""
-    service_info = SERVICE_TARIFFS.get(service_code, {})
+    service_info = get_tariff_table().config.services.get(service_code, {})
     
     name = service_info.get('name', service_code)
     description = service_info.get('description', '')
@@ -127,7 +163,7 @@ def format_service_description(service_code: str) -> str:
 
 def format_marketplace_info(marketplace: str) -> str:
     """Форматирование информации о маркетплейсе"""
-    marketplace_info = MARKETPLACE_TARIFFS.get(marketplace, {})
+    marketplace_info = get_tariff_table().config.marketplaces.get(marketplace, {})
     
     name = marketplace_info.get('name', marketplace)
     commission = marketplace_info.get('commission_rate', 0) * 100
@@ -148,3 +184,24 @@ def format_marketplace_info(marketplace: str) -> str:
         text += f"• {feature}\n"
     
     return text
+
+def sanitize_html(text: str) -> str:
+    """
+    Подготовка произвольного текста (например, ответа AI) к отправке с parse_mode='HTML'
+    
+    Экранирует все, кроме простых тегов форматирования, и переводит **жирный**
+    из Markdown в <b>. Если теги не сбалансированы, возвращает полностью
+    экранированный текст, чтобы Telegram не отклонил сообщение.
+    """
+    escaped = html.escape(text, quote=False)
+    result = _ESCAPED_TAG_RE.sub(r"<\1\2>", escaped)
+    result = _MARKDOWN_BOLD_RE.sub(r"<b>\1</b>", result)
+    
+    open_tags = []
+    for closing, tag in _TAG_RE.findall(result):
+        if not closing:
+            open_tags.append(tag)
+        elif not open_tags or open_tags.pop() != tag:
+            return escaped
+    
+    return escaped if open_tags else result
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+
+"""
+Простые счетчики задержек для логов и отчетов
+"""
+
+from collections import deque
+
+
+class LatencyTracker:
+    """Скользящая выборка последних измерений с перцентилями"""
+
+    def __init__(self, name: str, window: int = 1000):
+        self.name = name
+        self.count = 0
+        self.total = 0.0
+        self._samples = deque(maxlen=window)
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self._samples.append(seconds)
+
+    def percentile(self, p: float) -> float:
+        """Перцентиль по последним измерениям, в секундах"""
+        if not self._samples:
+            return 0.0
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(len(ordered) * p / 100))
+        return ordered[index]
+
+    def summary(self) -> str:
+        return (f"{self.name}: n={self.count}, "
+                f"p50={self.percentile(50) * 1000:.0f} мс, "
+                f"p95={self.percentile(95) * 1000:.0f} мс")